@@ -0,0 +1,565 @@
+"""Core WSP graph analysis: PDF and recorder-data ingestion, the Gemini prompt and the model call.
+
+Importable without Streamlit so the batch runner and other tools can reuse it.
+"""
+import io
+import math
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+import fitz  # PyMuPDF for PDF to image conversion
+from PIL import Image
+
+from classifier import fast_path_report
+from metrics import count, record_span, span
+from preprocessing import model_image
+from recorder_data import RENDER_SIZE, is_recorder_data, read_recording, render_graph
+from report_schema import RESPONSE_SCHEMA, AnalysisReport, parse_report
+from scheduler import BATCH, INTERACTIVE, ModelScheduler, ModelUnavailable
+from slip_analysis import with_measurements
+from trace_extraction import describe_traces, extract_traces
+from vector_extraction import extract_vector_traces
+
+# --- Helper: Convert PDF Page to Image ---
+RENDER_ZOOM = 2
+# Pages that would exceed this at RENDER_ZOOM are rendered at a lower zoom
+MAX_RENDER_PIXELS = int(float(os.getenv("WSP_MAX_RENDER_MEGAPIXELS", "8")) * 1_000_000)
+RENDER_BAND_ROWS = 256  # pixel rows rendered per clip rectangle
+RENDER_BAND_OVERLAP = 128  # rows drawn past each band edge and cropped, so edges match a single render
+
+def render_zoom(rect, zoom=RENDER_ZOOM, max_pixels=None):
+    """``zoom`` for a page of this size, lowered to keep the bitmap within the pixel budget"""
+    max_pixels = MAX_RENDER_PIXELS if max_pixels is None else max_pixels
+    pixels = rect.width * rect.height * zoom * zoom
+    if max_pixels and pixels > max_pixels:
+        zoom *= math.sqrt(max_pixels / pixels)
+    return zoom
+
+def pdf_to_image(page, zoom=RENDER_ZOOM, max_pixels=None):
+    """Render a PDF page straight into a PIL image (no PNG round trip)
+
+    The page is drawn band by band through clip rectangles into the final
+    image, each band's pixmap freed before the next, so the peak is one
+    bitmap plus a band instead of a full pixmap and its copy. Lines are
+    anti-aliased differently where a clip cuts them, so every band is drawn
+    with a margin of extra rows that is cropped off: the result is the same
+    as a single full-page pixmap.
+    """
+    zoom = render_zoom(page.rect, zoom, max_pixels)
+    matrix = fitz.Matrix(zoom, zoom)
+    box = (page.rect * matrix).irect
+    image = Image.new("RGB", (box.width, box.height), "white")
+    display_list = page.get_displaylist()  # parse the page once for every band
+    for top in range(box.y0, box.y1, RENDER_BAND_ROWS):
+        bottom = min(top + RENDER_BAND_ROWS, box.y1)
+        clip = fitz.Rect(page.rect.x0, (top - RENDER_BAND_OVERLAP) / zoom,
+                         page.rect.x1, (bottom + RENDER_BAND_OVERLAP) / zoom)
+        pix = display_list.get_pixmap(matrix=matrix, clip=clip, alpha=False)
+        band = Image.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv, "raw", "RGB", pix.stride, 1)
+        band = band.crop((0, top - pix.y, pix.width, bottom - pix.y))  # a view until pasted
+        image.paste(band, (pix.x - box.x0, top - box.y0))
+        del band, pix
+    del display_list
+    return image
+
+# --- Helper: Extract Graph Period from PDF Text ---
+def extract_graph_period(text):
+    """Extract graph period from the text layer of the graph page"""
+    # Look for date patterns like "18.01.25 07:10:24"
+    date_pattern = r'\d{2}\.\d{2}\.\d{2}\s+\d{2}:\d{2}:\d{2}'
+    dates = re.findall(date_pattern, text or "")
+    
+    if len(dates) >= 2:
+        return f"{dates[0]} to {dates[-1]}"
+    elif len(dates) == 1:
+        return dates[0]
+    return "Not Available"
+
+def graph_duration_seconds(graph_period):
+    """Length of the recording in seconds, or None if the period has no end"""
+    dates = re.findall(r'\d{2}\.\d{2}\.\d{2}\s+\d{2}:\d{2}:\d{2}', graph_period or "")
+    if len(dates) < 2:
+        return None
+    start, end = (datetime.strptime(" ".join(d.split()), "%d.%m.%y %H:%M:%S") for d in (dates[0], dates[-1]))
+    seconds = (end - start).total_seconds()
+    return seconds if seconds > 0 else None
+
+# --- Helper: Single-Pass PDF Ingestion ---
+# Bump when rendering or trace extraction changes, so stored pages are re-ingested
+INGEST_VERSION = 3
+
+@dataclass
+class GraphDocument:
+    """Everything the pipeline needs from one page of an uploaded graph PDF"""
+    image: Image.Image
+    graph_period: str
+    text: str
+    traces: object = None
+    page_number: int = 0
+    page_count: int = 1
+
+def open_pdf(source):
+    """Open a PDF from a file path or from raw bytes"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=bytes(source), filetype="pdf")
+    return fitz.open(source)
+
+def ingest_page(page, extract=True, render=True):
+    """Return the image, graph period, raw text and traces of one loaded page
+
+    Traces are read from the vector paths when the page has them, so the
+    raster is only needed for display and the model; pass ``render=False``
+    to skip rasterization for numeric-only consumers.
+    """
+    with span("ingest"):
+        image = traces = None
+        text = page.get_text()
+        graph_period = extract_graph_period(text)
+        duration = graph_duration_seconds(graph_period)
+        time_range = (0.0, duration) if duration else None
+        
+        if extract:
+            with span("extract_traces"):
+                try:
+                    traces = extract_vector_traces(page, time_range=time_range)
+                except Exception:
+                    traces = None
+        if render or (extract and traces is None):
+            with span("rasterize"):
+                image = pdf_to_image(page)
+        
+        if extract and traces is None:
+            with span("extract_traces"):
+                try:
+                    traces = extract_traces(image, time_range=time_range)
+                except Exception:
+                    traces = None  # the model still sees the image
+    return GraphDocument(image=image, graph_period=graph_period, text=text, traces=traces,
+                         page_number=page.number, page_count=page.parent.page_count)
+
+class RecordedGraph(GraphDocument):
+    """A raw recorder export; the traces are exact and the graph is drawn on first use of ``image``"""
+
+    @property
+    def image(self):
+        if self._image is None:
+            with span("render_recording"):
+                self._image = render_graph(self.traces, self.graph_period)
+        return self._image
+
+    @image.setter
+    def image(self, value):
+        self._image = value
+
+def ingest_recording(source):
+    """Read a CSV/NPY recorder export (path or bytes) as a single-page GraphDocument"""
+    with span("ingest"):
+        traces, graph_period = read_recording(source)
+    return RecordedGraph(image=None, graph_period=graph_period, text="", traces=traces)
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def graph_png(graph):
+    """PNG bytes of a page's image; for a recording not drawn yet, a callable drawing it when first needed
+
+    The callable keeps only the traces, so nothing is drawn for results
+    nobody looks at (rules-only or headless JSON/markdown requests).
+    """
+    if isinstance(graph, RecordedGraph) and graph._image is None:
+        traces, graph_period = graph.traces, graph.graph_period
+        return lambda: encode_png(RecordedGraph(image=None, graph_period=graph_period, text="", traces=traces).image)
+    return encode_png(graph.image) if graph.image is not None else None
+
+def recording_png(source):
+    """Callable drawing the graph of a recorder export (path or bytes) as PNG when first needed"""
+    return lambda: encode_png(ingest_recording(source).image)
+
+def ingest_pdf(source, extract=True, render=True, page_number=0):
+    """Open the PDF once and ingest a single page (the first by default)
+
+    Recorder exports are accepted too and always have one page.
+    """
+    if is_recorder_data(source):
+        return ingest_recording(source)
+    with open_pdf(source) as doc:
+        return ingest_page(doc[page_number], extract=extract, render=render)
+
+def iter_pages(source, extract=True, render=True):
+    """Yield every page of the PDF in turn from one open document
+
+    Only the current page's bitmap is alive at a time: callers should
+    drop each GraphDocument before asking for the next one.
+    """
+    if is_recorder_data(source):
+        yield ingest_recording(source)
+        return
+    with open_pdf(source) as doc:
+        for page_number in range(doc.page_count):
+            # Yield without keeping a reference here, so the caller controls its lifetime
+            yield ingest_page(doc.load_page(page_number), extract=extract, render=render)
+
+# Peak bytes per rendered pixel while a page is analyzed: the bitmap, the
+# trace extraction arrays and the model image (about 22 measured on raster pages)
+ANALYSIS_BYTES_PER_PIXEL = 24
+
+def estimate_memory(source):
+    """Bytes the largest page of a PDF or recorder export (path or bytes) takes while it is analyzed"""
+    if is_recorder_data(source):
+        width, height = RENDER_SIZE
+        size = os.path.getsize(source) if isinstance(source, (str, os.PathLike)) else len(source)
+        return width * height * ANALYSIS_BYTES_PER_PIXEL + 2 * size  # parsed columns
+    with open_pdf(source) as doc:
+        pixels = max((page.rect.width * page.rect.height * render_zoom(page.rect) ** 2 for page in doc),
+                     default=0)
+    return int(pixels * ANALYSIS_BYTES_PER_PIXEL)
+
+def count_pages(source):
+    if is_recorder_data(source):
+        return 1
+    with open_pdf(source) as doc:
+        return doc.page_count
+
+# --- Analysis Prompt ---
+MODEL_NAME = "gemini-2.5-flash"
+
+ANALYSIS_PROMPT = """
+You are an expert railway braking systems analyst and WSP (Wheel Slide Protection) system engineer.
+
+CRITICAL: You MUST answer with a single JSON object in the EXACT structure specified below.
+
+====================
+REQUIRED OUTPUT FORMAT
+====================
+
+{
+  "summary": "[Brief 3-4 sentence overview of the operational period, key findings, and critical issues if any]",
+  "axles": [
+    {"axle": 1, "condition": "[Observed Speed Condition]", "phase": "[Phase of Anomaly]", "conclusion": "[Conclusion]"},
+    ... one object for each of axles 1 (Green), 2 (Yellow), 3 (Blue) and 4 (Pink)
+  ],
+  "wsp": [
+    {"axle": 1, "bv": "[Dump Valve Activation (BV)]", "ev": "[Dump Valve Closure (EV)]", "status": "[WSP System Status]"},
+    ... one object for each of axles 1-4
+  ],
+  "diagnosis": "[Detailed technical diagnosis based on observations. Include specific timestamps and measurements where visible]",
+  "recommendations": ["[Specific, actionable maintenance recommendation]", "..."]
+}
+
+====================
+TECHNICAL REFERENCE (Use this to fill the fields)
+====================
+
+LINE COLOR DEFINITIONS:
+- Red line (#FE0000): Reference Speed (train reference speed)
+- Green line (#00FF01): Axle 1 Speed
+- Yellow line (#FFFF00): Axle 2 Speed
+- Blue line (#0000FE): Axle 3 Speed
+- Pink line (#FF00FE): Axle 4 Speed
+
+DUMP VALVE COLOR CODING:
+- #9A99FF: Dump valve activation for Axle 1
+- #6599FF: Dump valve activation for Axle 2
+- #6665FE: Dump valve activation for Axle 3
+- #3401CC: Dump valve activation for Axle 4
+
+ANALYSIS RULES:
+
+For "Observed Speed Condition":
+- "Tracking reference speed smoothly" if axle follows red line
+- "Fluctuating with deviations" if axle shows variations
+- "Severe drops below reference" if axle drops significantly
+- "Complete wheel lock" if speed drops to zero
+
+For "Phase of Anomaly":
+- Specify time range (e.g., "16.00s - 30.75s")
+- Use "None" if no anomaly detected
+- Use "Multiple periods" if anomalies occur at different times
+
+For "Conclusion":
+- "Normal Operation" if tracking reference smoothly
+- "Affected - Minor" for small deviations with quick recovery
+- "Affected - Moderate" for repeated fluctuations
+- "Severely Affected" for prolonged wheel lock or major deviations
+
+For "Dump Valve Activation (BV)":
+- "Not required - no wheel slide" if there is no wheel slide and no BV signal
+- "Activated immediately" if BV responds when needed
+- "Multiple rapid activations" for frequent cycling
+- "Sustained activation" for prolonged pressure dump
+- "No activation detected" if no BV signal when needed
+
+For "Dump Valve Closure (EV)":
+- "Not required" if BV was not required
+- "Proper closure after recovery" if EV follows BV correctly
+- "Rapid cycling" for quick open-close patterns
+- "Delayed closure" if EV timing is off
+- "No closure signal" if missing
+
+For "WSP System Status":
+- "Functioning Correctly" if BV activates when needed and EV follows properly
+- "Partially Effective" if system responds but with delays
+- "Malfunction Suspected" if no BV activation despite wheel slip
+- "Requires Maintenance" if system shows irregular behavior
+
+====================
+CRITICAL INSTRUCTIONS
+====================
+
+1. Use ONLY the fields shown above; output JSON only, with no markdown or commentary
+2. Give exactly one entry per axle (1-4) in BOTH "axles" and "wsp"
+3. Use the exact wording from the rules above for condition, conclusion, bv, ev and status
+4. Base your analysis ONLY on what you observe in the graph
+5. Do not add extra fields
+6. Use professional railway engineering terminology
+7. Be concise but technically accurate
+8. If you cannot determine something, state "Cannot determine from graph" rather than guessing
+"""
+# --- Model Configuration ---
+# Constrain the answer to the report schema so it is parsed once, as JSON.
+# A plain dict, so building it does not import the Gemini SDK.
+GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": RESPONSE_SCHEMA,
+}
+
+_models = {}  # (model name, API key) -> GenerativeModel, or KeyedModel for a key of the pool; key None is the default
+_clients = {}  # API key -> GenerativeServiceClient
+_models_lock = threading.Lock()
+_api_key = None
+_configured_key = None
+_scheduler = None
+
+def configure(api_key=None):
+    """Set the Gemini API key, falling back to the GEMINI_API_KEY env var
+
+    The SDK (the slowest import of the pipeline) is only loaded when the
+    first model is created. Keys in GEMINI_API_KEYS join the scheduler's pool.
+    """
+    global _api_key, _scheduler
+    api_key = api_key or os.getenv("GEMINI_API_KEY")
+    if api_key and api_key != "YOUR_API_KEY_HERE":
+        with _models_lock:
+            if api_key != _api_key:
+                _api_key = api_key
+                _models.clear()
+                _clients.clear()
+                _scheduler = None
+        return api_key
+    return None
+
+def _genai():
+    """The configured google.generativeai module; call with _models_lock held"""
+    global _configured_key
+    import google.generativeai as genai
+    if _api_key and _api_key != _configured_key:
+        genai.configure(api_key=_api_key)
+        _configured_key = _api_key
+    return genai
+
+def _client(api_key):
+    """Client bound to one API key, or to WSP_GEMINI_ENDPOINT (e.g. a local fake server) when set"""
+    client = _clients.get(api_key)
+    if client is None:
+        from google.ai import generativelanguage as glm
+        endpoint = os.getenv("WSP_GEMINI_ENDPOINT")
+        if endpoint:
+            from google.ai.generativelanguage_v1beta.services.generative_service.transports.rest import (
+                GenerativeServiceRestTransport)
+            from google.auth.api_key import Credentials
+            scheme, _, host = endpoint.rstrip("/").rpartition("://")
+            transport = GenerativeServiceRestTransport(host=host, url_scheme=scheme or "http",
+                                                       credentials=Credentials(api_key or "-"))
+            client = glm.GenerativeServiceClient(transport=transport)
+        else:
+            client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        _clients[api_key] = client
+    return client
+
+class KeyedModel:
+    """``generate_content`` of one model on a client bound to one API key
+
+    ``genai.configure`` holds a single process-wide key, so requests for the
+    other keys of the pool are built and answered with the SDK's public
+    request and response types on the key's own client. Answers behave like
+    those of ``GenerativeModel.generate_content``, streaming or not.
+    """
+
+    def __init__(self, model_name, client):
+        from google.generativeai.types import generation_types
+        self.model_name = model_name if "/" in model_name else f"models/{model_name}"
+        self.client = client
+        self.generation_config = generation_types.to_generation_config_dict(GENERATION_CONFIG)
+
+    def generate_content(self, contents, stream=False, request_options=None):
+        from google.generativeai import protos
+        from google.generativeai.types import content_types, generation_types
+        request = protos.GenerateContentRequest(model=self.model_name, contents=content_types.to_contents(contents),
+                                                generation_config=self.generation_config)
+        if request.contents and not request.contents[-1].role:
+            request.contents[-1].role = "user"
+        if stream:
+            with generation_types.rewrite_stream_error():
+                iterator = self.client.stream_generate_content(request, **(request_options or {}))
+            return generation_types.GenerateContentResponse.from_iterator(iterator)
+        response = self.client.generate_content(request, **(request_options or {}))
+        return generation_types.GenerateContentResponse.from_response(response)
+
+def get_model(model_name=MODEL_NAME, api_key=None):
+    """Shared model per (name, key), so every request reuses one client and its connections
+
+    Without a key (or fake endpoint) this is the SDK's GenerativeModel on the
+    configured key. A model installed under key None (e.g. a stand-in)
+    serves every key.
+    """
+    with _models_lock:
+        model = _models.get((model_name, api_key)) or _models.get((model_name, None))
+        if model is None:
+            if api_key or os.getenv("WSP_GEMINI_ENDPOINT"):
+                model = KeyedModel(model_name, _client(api_key))
+            else:
+                model = _genai().GenerativeModel(model_name, generation_config=GENERATION_CONFIG)
+            _models[model_name, api_key] = model
+        return model
+
+def get_scheduler():
+    """The process-wide ModelScheduler over the configured keys and fallback models (see scheduler.py)"""
+    global _scheduler
+    with _models_lock:
+        if _scheduler is None:
+            _scheduler = ModelScheduler.from_env(get_model, _api_key)
+        return _scheduler
+
+def list_models():
+    """Names of the models that support generateContent"""
+    with _models_lock:
+        genai = _genai()
+    return [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+
+# --- Model Call ---
+def build_contents(image, traces=None):
+    """Prompt parts for one graph, with locally measured timings when available
+
+    The image is cropped, palette-quantized and sent as a palettized PNG
+    unless WSP_PREPROCESS=0.
+    """
+    with span("prepare_image"):
+        image_part = model_image(image)
+    if isinstance(image_part, dict):
+        count("model_image_bytes", len(image_part["data"]))
+    contents = [ANALYSIS_PROMPT, image_part]
+    if traces is not None:
+        contents.append(
+            "MEASURED DATA (extracted locally from the trace colours; use these timings "
+            "for \"Phase of Anomaly\" and dump valve behaviour where they agree with the graph):\n"
+            + describe_traces(traces)
+        )
+    return contents
+
+def generate_report(image, model_name=MODEL_NAME, traces=None, priority=BATCH, on_answer=None):
+    """Run the analysis prompt on a graph image and return the validated AnalysisReport
+
+    The request is queued at ``priority`` and may be answered by a fallback
+    model, whose name is passed to ``on_answer``. Raises ModelUnavailable when every key and model is throttled,
+    other API errors as they are, and ReportFormatError on answers that
+    break the schema.
+    """
+    contents = build_contents(image, traces)
+    with span("model_total"):
+        response = get_scheduler().call(
+            lambda model, timeout: model.generate_content(contents, request_options={"timeout": timeout}),
+            model_name, priority, on_answer)
+    if not response or not response.text:
+        raise ValueError("Empty response from AI")
+    count_tokens(response)
+    with span("parse"):
+        return parse_report(response.text)
+
+def count_tokens(response):
+    """Add a response's prompt/output token usage to the metrics"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        count("model_tokens", getattr(usage, "prompt_token_count", 0) or 0, kind="prompt")
+        count("model_tokens", getattr(usage, "candidates_token_count", 0) or 0, kind="output")
+
+def _abort_stream(response):
+    """Cancel the underlying gRPC/HTTP stream of a streaming response"""
+    iterator = getattr(response, "_iterator", None)
+    stop = getattr(iterator, "cancel", None) or getattr(iterator, "close", None)
+    if stop:
+        try:
+            stop()
+        except Exception:
+            pass
+
+def stream_report(image, model_name=MODEL_NAME, traces=None, cancel_event=None, on_answer=None):
+    """Yield the report's JSON text as the model streams it; raises on API errors
+
+    Join the chunks and pass them to ``parse_report`` once the stream ends.
+    ``on_answer`` gets the name of the model answering, maybe a fallback.
+
+    Setting ``cancel_event`` (or closing the generator) cancels the request
+    itself rather than just ignoring the rest of the stream. Someone is
+    watching, so the request goes ahead of queued batch pages.
+    """
+    contents = build_contents(image, traces)
+    started = time.perf_counter()
+    response = get_scheduler().call(
+        lambda model, timeout: model.generate_content(contents, stream=True, request_options={"timeout": timeout}),
+        model_name, INTERACTIVE, on_answer)
+    # The request (image included) is sent by the time the stream object exists
+    record_span("model_upload", time.perf_counter() - started, started)
+    produced = False
+    try:
+        for chunk in response:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            try:
+                text = chunk.text
+            except ValueError:
+                continue  # chunk without text parts, e.g. the final usage chunk
+            if text:
+                if not produced:
+                    record_span("model_first_token", time.perf_counter() - started, started)
+                produced = True
+                yield text
+        record_span("model_total", time.perf_counter() - started, started)
+        count_tokens(response)
+    finally:
+        if not getattr(response, "_done", True):
+            _abort_stream(response)
+    if not produced:
+        raise ValueError("Empty response from AI")
+
+# --- Analysis Logic (FIXED) ---
+def analyze_pdf(image, traces=None):
+    """AnalysisReport for one graph image, or an error message string"""
+    try:
+        if image is None:
+            return "Error: Could not extract image from PDF"
+
+        return generate_report(image, traces=traces, priority=INTERACTIVE)
+    except (ValueError, ModelUnavailable) as e:
+        return f"Error: {e}"
+    except Exception as e:
+        return f"An error occurred: {str(e)}"
+
+def analyze_page(graph, fast_path=True):
+    """Report one page, by local rules when clearly normal; returns (report, engine)
+
+    Model reports carry the measured slip phases and valve timings.
+    """
+    if fast_path:
+        report = fast_path_report(graph.traces)
+        if report:
+            return report, "Rules"
+    report = analyze_pdf(graph.image, traces=graph.traces)
+    if isinstance(report, AnalysisReport):
+        report = with_measurements(report, graph.traces)
+    return report, "Gemini"
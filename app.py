@@ -1,17 +1,16 @@
 import streamlit as st
 import os
-import google.generativeai as genai
-import tempfile
 
-from fpdf import FPDF
-from PIL import Image
-import fitz  # PyMuPDF for PDF to image conversion
-from datetime import datetime
-import re
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-# Configure Gemini API
-genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
+# Only light modules here: the analysis pipeline (PyMuPDF, OpenCV, fpdf, the
+# Gemini SDK) is imported where it is used and preloaded in the background
+from history import AnalysisHistory
+from metrics import REGISTRY
+from report_schema import AXLES, CONCLUSIONS, WSP_STATUSES, to_markdown
+from result_cache import ResultCache
+from warmup import warm_up_in_background
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -28,6 +27,20 @@ elif os.getenv("GEMINI_API_KEY"):
 else:
     API_KEY = "YOUR_API_KEY_HERE"
 
+# --- Pipeline Warm-Up ---
+@st.cache_resource
+def start_warm_up():
+    """Load the analysis pipeline once per process while the first page renders"""
+    return warm_up_in_background()
+
+@st.cache_resource
+def configure_model(api_key):
+    """Configure Gemini API"""
+    from analyzer import configure
+    return configure(api_key)
+
+start_warm_up()
+
 # --- Sidebar ---
 with st.sidebar:
     st.header("System Logic")
@@ -44,16 +57,47 @@ with st.sidebar:
     else:
         st.error("System Status: Offline 🔴")
     
+    fast_path = st.checkbox(
+        "Skip the model for clearly normal graphs",
+        value=True,
+        help="Graphs where every axle tracks the reference with no dump valve activity "
+             "are reported by local rules instead of a Gemini call.",
+    )
+    
+    # Debug: Stage timings of the last analysis and process-wide totals
+    if st.checkbox("Show Stage Timings (Debug)"):
+        debug_job = st.session_state.get("analysis_job")
+        trace = debug_job.trace if debug_job is not None else None
+        if trace is not None:
+            st.write(f"**Last analysis:** {trace.name}")
+            st.dataframe(
+                [{"Stage": stage, "Seconds": round(seconds, 3)} for stage, seconds in trace.stage_totals().items()],
+                hide_index=True, use_container_width=True,
+            )
+            if trace.counts:
+                st.json(trace.counts)
+        else:
+            st.caption("Run an analysis to see its stage timings")
+        st.write("**This process:**")
+        st.dataframe(
+            [{"Stage": stage, "Calls": calls, "Mean s": round(total / calls, 3)}
+             for stage, (calls, total) in sorted(REGISTRY.stage_summary().items())],
+            hide_index=True, use_container_width=True,
+        )
+        counters = REGISTRY.counters()
+        if counters:
+            st.json(counters)
+    
     # Debug: Show available models
     if st.checkbox("Show Available Models (Debug)"):
         with st.spinner("Fetching models..."):
             try:
+                from analyzer import list_models
+                configure_model(API_KEY)
                 st.write("**Available Gemini Models:**")
-                models_found = []
-                for m in genai.list_models():
-                    if 'generateContent' in m.supported_generation_methods:
-                        models_found.append(m.name)
-                        st.write(f"✅ `{m.name}`")
+                models_found = list_models()
+                for name in models_found:
+                    st.write(f"✅ `{name}`")
                 
                 if not models_found:
                     st.error("⚠️ No models found!")
@@ -61,551 +105,258 @@ with st.sidebar:
             except Exception as e:
                 st.error(f"Could not list models: {e}")
 
-# --- Helper: Convert PDF to Image ---
-def pdf_to_image(pdf_path):
-    """Convert first page of PDF to image"""
-    try:
-        doc = fitz.open(pdf_path)
-        page = doc[0]
-        mat = fitz.Matrix(2, 2)
-        pix = page.get_pixmap(matrix=mat)
-        img_data = pix.tobytes("png")
-        img = Image.open(BytesIO(img_data))
-        doc.close()
-        return img
-    except Exception as e:
-        st.error(f"Error converting PDF to image: {e}")
-        return None
+# --- Main Interface ---
+st.title("🚄 WSP Operational Graph Analyzer")
+mode = st.radio("Mode", ["Single Report", "Batch", "History"], horizontal=True)
 
-# --- Helper: Extract Graph Period from PDF ---
-def extract_graph_period(pdf_path):
-    """Extract graph period from PDF using text extraction"""
-    try:
-        doc = fitz.open(pdf_path)
-        page = doc[0]
-        text = page.get_text()
-        
-        # Look for date patterns like "18.01.25 07:10:24"
-        date_pattern = r'\d{2}\.\d{2}\.\d{2}\s+\d{2}:\d{2}:\d{2}'
-        dates = re.findall(date_pattern, text)
-        
-        if len(dates) >= 2:
-            return f"{dates[0]} to {dates[-1]}"
-        elif len(dates) == 1:
-            return dates[0]
-        
-        doc.close()
-        return "Not Available"
-    except:
-        return "Not Available"
+uploaded_file = None
+uploaded_files = []
+if mode == "Single Report":
+    uploaded_file = st.file_uploader(
+        "Choose a PDF Graph file or a recorder export (CSV/NPY)", type=["pdf", "csv", "npy"]
+    )
+elif mode == "Batch":
+    uploaded_files = st.file_uploader(
+        "Choose PDF Graph files or recorder exports (CSV/NPY)", type=["pdf", "csv", "npy"],
+        accept_multiple_files=True
+    )
 
-# --- Enhanced PDF Class with Table Support ---
-class EnhancedPDF(FPDF):
-    def header(self):
-        if self.page_no() > 2:  # Skip header for cover and image pages
-            self.set_font('Arial', 'I', 8)
-            self.set_text_color(128, 128, 128)
-            self.cell(0, 10, f'WSP Graph Analyzer - Page {self.page_no() - 2}', 0, 0, 'R')
-            self.ln(10)
+# --- Result Cache ---
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+@st.cache_resource
+def get_history():
+    return AnalysisHistory()
+
+@st.cache_resource
+def get_stage_store():
+    from stages import StageStore
+    return StageStore()
+
+# --- Background Jobs ---
+@st.cache_resource
+def get_job_executor():
+    """Process-wide pool so concurrent sessions share a bounded number of workers"""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="wsp-job")
+
+def deferred_artifact(job, name):
+    """Download callback that builds one of the job's artifacts on first click"""
+    def build():
+        data = job.artifacts.get(name)
+        if data is None:
+            raise RuntimeError(f"{name} could not be built: {job.artifacts.errors.get(name)}")
+        return data
+    return build
+
+def render_results(job):
+    """Show a finished job's report and download buttons"""
+    from jobs import CANCELLED, FAILED
     
-    def add_heading(self, text, level=1):
-        """Add formatted heading"""
-        self.ln(3)
-        if level == 1:
-            self.set_font('Arial', 'B', 14)
-            self.set_fill_color(52, 152, 219)
-            self.set_text_color(255, 255, 255)
-            safe_text = text.encode('ascii', 'ignore').decode('ascii')
-            self.cell(0, 10, safe_text, 0, 1, 'L', True)
-        elif level == 2:
-            self.set_font('Arial', 'B', 12)
-            self.set_text_color(0, 0, 0)
-            safe_text = text.encode('ascii', 'ignore').decode('ascii')
-            self.cell(0, 8, safe_text, 0, 1, 'L')
-        self.set_text_color(0, 0, 0)
-        self.ln(2)
+    if job.status == CANCELLED:
+        st.warning("Analysis cancelled")
+        return
+    if job.status == FAILED or job.report is None:
+        st.error(job.error or "Analysis failed - No response received")
+        return
     
-    def add_paragraph(self, text):
-        """Add paragraph text"""
-        self.set_font('Arial', '', 10)
-        # Clean special characters
-        text = text.replace('\u2019', "'").replace('\u2018', "'")
-        text = text.replace('\u201c', '"').replace('\u201d', '"')
-        text = text.replace('\u2013', '-').replace('\u2014', '-')
-        text = text.replace('**', '')
-        safe_text = text.encode('ascii', 'ignore').decode('ascii')
-        self.multi_cell(0, 5, safe_text)
-        self.ln(2)
+    if job.from_cache:
+        st.caption("⚡ Loaded from cache - this recording was analyzed before")
+    elif job.coalesced:
+        st.caption("⚡ Shared result - this recording was already being analyzed for another upload")
+    elif job.rules_only:
+        st.caption("⚡ Clearly normal graph - report generated by local rules without a model call")
     
-    def add_table(self, headers, rows):
-        """Add formatted table with dynamic sizing"""
-        num_cols = len(headers)
-        available_width = self.w - 20
-        
-        # Calculate optimal column widths
-        max_content_lengths = []
-        for col_idx in range(num_cols):
-            max_len = len(str(headers[col_idx]))
-            for row in rows:
-                if col_idx < len(row):
-                    max_len = max(max_len, len(str(row[col_idx])))
-            max_content_lengths.append(max_len)
-        
-        total_content = sum(max_content_lengths)
-        if total_content > 0:
-            col_widths = [(length / total_content) * available_width for length in max_content_lengths]
-            col_widths = [max(20, w) for w in col_widths]
-            total_width = sum(col_widths)
-            if total_width > available_width:
-                scale = available_width / total_width
-                col_widths = [w * scale for w in col_widths]
-        else:
-            col_widths = [available_width / num_cols] * num_cols
-        
-        # Check if table fits on page
-        if self.get_y() + 20 > self.h - 30:
-            self.add_page()
-        
-        # Draw header
-        self.set_font('Arial', 'B', 9)
-        self.set_fill_color(52, 152, 219)
-        self.set_text_color(255, 255, 255)
-        
-        header_height = 10
-        max_header_lines = 1
-        for i, header in enumerate(headers):
-            clean_header = str(header).replace('**', '').strip()
-            chars_per_line = int(col_widths[i] * 2.2)
-            lines_needed = max(1, (len(clean_header) // chars_per_line) + 1)
-            max_header_lines = max(max_header_lines, lines_needed)
-        header_height = max(10, max_header_lines * 5)
-        
-        x_start = self.get_x()
-        y_start = self.get_y()
-        
-        for i, header in enumerate(headers):
-            clean_header = str(header).replace('**', '').strip()
-            clean_header = clean_header.encode('ascii', 'ignore').decode('ascii')
-            
-            self.set_xy(x_start + sum(col_widths[:i]), y_start)
-            self.cell(col_widths[i], header_height, '', 1, 0, 'C', True)
-            
-            self.set_xy(x_start + sum(col_widths[:i]) + 1, y_start + 1)
-            self.multi_cell(col_widths[i] - 2, 4, clean_header, 0, 'C')
-        
-        self.set_xy(x_start, y_start + header_height)
-        
-        # Draw rows
-        self.set_font('Arial', '', 8)
-        self.set_text_color(0, 0, 0)
-        
-        for row_idx, row in enumerate(rows):
-            cleaned_cells = []
-            cell_line_counts = []
-            
-            for i, cell in enumerate(row):
-                clean_cell = str(cell).replace('**', '').strip()
-                clean_cell = clean_cell.replace('\u2019', "'").replace('\u2018', "'")
-                clean_cell = clean_cell.replace('\u201c', '"').replace('\u201d', '"')
-                clean_cell = clean_cell.replace('\u2013', '-').replace('\u2014', '-')
-                safe_cell = clean_cell.encode('ascii', 'ignore').decode('ascii')
-                cleaned_cells.append(safe_cell)
-                
-                chars_per_line = int(col_widths[i] * 2.2)
-                words = safe_cell.split()
-                lines = []
-                current_line = ""
-                
-                for word in words:
-                    test_line = current_line + " " + word if current_line else word
-                    if len(test_line) <= chars_per_line:
-                        current_line = test_line
-                    else:
-                        if current_line:
-                            lines.append(current_line)
-                        current_line = word
-                
-                if current_line:
-                    lines.append(current_line)
-                
-                cell_line_counts.append(max(1, len(lines)))
-            
-            max_lines = max(cell_line_counts) if cell_line_counts else 1
-            row_height = max(10, max_lines * 4 + 2)
-            
-            if self.get_y() + row_height > self.h - 20:
-                self.add_page()
-                self.set_xy(x_start, self.get_y())
-            
-            if row_idx % 2 == 0:
-                self.set_fill_color(255, 255, 255)
-            else:
-                self.set_fill_color(245, 245, 245)
-            
-            x_pos = self.get_x()
-            y_pos = self.get_y()
-            
-            for i in range(len(cleaned_cells)):
-                self.set_xy(x_pos + sum(col_widths[:i]), y_pos)
-                self.cell(col_widths[i], row_height, '', 1, 0, 'L', True)
-            
-            for i, cell_text in enumerate(cleaned_cells):
-                cell_x = x_pos + sum(col_widths[:i]) + 1
-                cell_y = y_pos + 1
-                
-                self.set_xy(cell_x, cell_y)
-                self.multi_cell(col_widths[i] - 2, 3.5, cell_text, 0, 'L')
-            
-            self.set_xy(x_pos, y_pos + row_height)
-        
-        self.ln(5)
-
-# --- Helper: Create PDF with Table Parsing ---
-def create_pdf_with_image(text_content, image_path, graph_period):
-    """Create PDF report with proper markdown parsing"""
-    pdf = EnhancedPDF()
+    col_meta1, col_meta2 = st.columns(2)
+    with col_meta1:
+        st.info(f"**Generated Time:** {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
+    with col_meta2:
+        st.info(f"**Graph Timestamp:** {job.graph_period}")
     
-    # COVER PAGE
-    pdf.add_page()
-    generated_time = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+    st.divider()
     
-    pdf.set_fill_color(70, 130, 180)
-    pdf.rect(0, 0, pdf.w, pdf.h, style='F')
-    pdf.set_text_color(255, 255, 255)
+    if job.png_bytes:
+        st.subheader("📊 Uploaded Graph")
+        st.image(job.png_bytes, caption="WSP Operational Graph", use_container_width=True)
+        st.divider()
     
-    pdf.set_y(pdf.h / 2 - 30)
-    pdf.set_font('Arial', 'B', 24)
-    pdf.ln(20)
-    pdf.cell(0, 15, 'WSP GRAPH SUMMARY', 0, 1, 'C')
-    pdf.ln(10)
+    st.subheader("📋 Analysis Result")
+    st.markdown(to_markdown(job.report))
+    st.divider()
     
-    pdf.set_font('Arial', '', 12)
-    pdf.cell(0, 8, f'Generated Time : {generated_time}', 0, 1, 'C')
-    pdf.cell(0, 8, f'Graph Timestamp : {graph_period}', 0, 1, 'C')
-    pdf.ln(30)
+    st.subheader("📥 Download Options")
+    col1, col2, col3 = st.columns(3)
     
-    pdf.set_font("Arial", 'I', size=9)
-    pdf.cell(0, 5, "This report is generated by Premade Innovations Pvt. Ltd.", 0, 1, 'C')
+    if job.png_bytes:
+        with col1:
+            st.download_button(
+                label="🖼️ Download Graph (.png)",
+                data=job.png_bytes,
+                file_name="WSP_Graph.png",
+                mime="image/png",
+            )
     
-    # GRAPH IMAGE PAGE
-    pdf.add_page()
-    pdf.set_text_color(0, 0, 0)
+    # TXT/PDF are built only when their button is clicked, on Streamlit's download thread
+    with col2:
+        st.download_button(
+            label="📄 Download Report (.txt)",
+            data=deferred_artifact(job, "report.txt"),
+            file_name="WSP_Analysis_Report.txt",
+            mime="text/plain",
+        )
     
-    if image_path and os.path.exists(image_path):
-        try:
-            img = Image.open(image_path)
-            img_width, img_height = img.size
-            page_width = pdf.w - 20
-            scale_factor = page_width / img_width
-            scaled_height_px = img_height * scale_factor
-            scaled_height_mm = (scaled_height_px / 96) * 25.4
-            
-            current_y = pdf.get_y()
-            max_height = pdf.h - current_y - 30
-            
-            if scaled_height_mm > max_height:
-                scale_factor_height = max_height / scaled_height_mm
-                final_width = page_width * scale_factor_height
-                pdf.image(image_path, x=10 + (page_width - final_width) / 2, y=current_y, w=final_width)
-            else:
-                pdf.image(image_path, x=10, y=current_y, w=page_width)
-        except Exception as e:
-            pdf.set_font('Arial', '', 10)
-            pdf.cell(0, 10, f'[Image could not be embedded: {e}]', 0, 1)
-    
-    # ANALYSIS CONTENT PAGE
-    pdf.add_page()
-    pdf.add_heading('Analysis Report', level=1)
-    
-    current_date = datetime.now().strftime("%d-%m-%Y")
+    with col3:
+        if job.pdf_error is None:
+            st.download_button(
+                label="📕 Download Full Report (.pdf)",
+                data=deferred_artifact(job, "report.pdf"),
+                file_name="WSP_Analysis_Report.pdf",
+                mime="application/pdf",
+            )
+        else:
+            st.warning(f"PDF generation failed: {job.pdf_error}")
+
+@st.fragment(run_every=0.5)
+def show_job_progress():
+    """Poll the running job and stream its partial report into the page"""
+    job = st.session_state.get("analysis_job")
+    if job is None or job.finished:
+        st.rerun()
     
-    pdf.add_heading('Date of Analysis', level=2)
-    pdf.add_paragraph(current_date)
-    pdf.add_heading('Graph Timestamp', level=2)
-    pdf.add_paragraph(graph_period)
+    col_status, col_cancel = st.columns([4, 1])
+    with col_status:
+        st.info(f"⏳ {job.progress}")
+    with col_cancel:
+        if st.button("Cancel", key=f"cancel_{job.id}"):
+            job.cancel()
     
-    # Parse content
-    lines = text_content.split('\n')
-    table_data = []
-    in_table = False
-    skip_date_section = False
+    partial = job.partial_report
+    if partial:
+        st.subheader("📋 Analysis Result (streaming)")
+        st.code(partial, language="json")
+
+# --- Execution ---
+if uploaded_file and st.button("Generate Diagnostic Report"):
+    from jobs import AnalysisJob, start_job
+    configure_model(API_KEY)
+    previous = st.session_state.get("analysis_job")
+    if previous is not None and not previous.finished:
+        previous.cancel()
+    st.session_state["analysis_job"] = start_job(
+        AnalysisJob(uploaded_file.getvalue(), uploaded_file.name,
+                    cache=get_result_cache(), fast_path=fast_path, history=get_history()),
+        get_job_executor(),
+    )
+
+job = st.session_state.get("analysis_job")
+if job is not None and mode == "Single Report":
+    if job.finished:
+        render_results(job)
+    else:
+        show_job_progress()
+
+# --- Batch Execution ---
+def render_batch_results(results):
+    """Summary and downloads of the last batch run; kept in the session so downloads survive reruns"""
+    from batch import build_zip, summary_row
+    from fleet_report import build_fleet_report
     
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        
-        if line.startswith('|') and all(c in '|:-' for c in line.replace(' ', '')):
-            continue
-        
-        if line.startswith('##'):
-            if in_table and len(table_data) > 1:
-                pdf.add_table(table_data[0], table_data[1:])
-                in_table = False
-                table_data = []
-            
-            heading_text = line.replace('##', '').strip()
-            
-            if 'Date of Analysis' in heading_text or heading_text.startswith('Date'):
-                skip_date_section = True
-                continue
-            
-            skip_date_section = False
-            pdf.add_heading(heading_text, level=2)
-        
-        elif '|' in line and not skip_date_section:
-            parts = [p.strip() for p in line.split('|') if p.strip()]
-            if parts:
-                if not in_table:
-                    in_table = True
-                    table_data = [parts]
-                else:
-                    table_data.append(parts)
-        
-        else:
-            if not skip_date_section:
-                if in_table and len(table_data) > 1:
-                    pdf.add_table(table_data[0], table_data[1:])
-                    in_table = False
-                    table_data = []
-                
-                if not line.startswith('---') and line:
-                    pdf.add_paragraph(line)
+    st.dataframe([summary_row(r) for r in results], use_container_width=True)
+    failed = sum(1 for r in results if not r.ok)
+    if failed:
+        st.warning(f"{failed} of {len(results)} recordings failed - see the Status column")
+    else:
+        st.success(f"All {len(results)} recordings analyzed")
     
-    if in_table and len(table_data) > 1:
-        pdf.add_table(table_data[0], table_data[1:])
+    col_zip, col_fleet = st.columns(2)
+    with col_zip:
+        st.download_button(
+            label="🗂️ Download All Reports (.zip)",
+            data=lambda: build_zip(results),
+            file_name="WSP_Batch_Reports.zip",
+            mime="application/zip",
+        )
+    with col_fleet:
+        st.download_button(
+            label="📚 Download Fleet Report (.pdf)",
+            data=lambda: build_fleet_report(results),
+            file_name="WSP_Fleet_Report.pdf",
+            mime="application/pdf",
+        )
+
+if uploaded_files and st.button("Run Batch Analysis"):
+    from batch import run_batch, summary_row
+    configure_model(API_KEY)
+    st.session_state.pop("batch_results", None)
+    results = []
+    progress = st.progress(0.0, text="Starting batch...")
+    summary_table = st.empty()
+    sources = ((f.name, f.getvalue()) for f in uploaded_files)
     
-    return pdf.output(dest='S').encode('latin-1')
-
-# --- Helper: Create Text File ---
-def create_text_with_image_info(text_content, image_path, graph_period):
-    """Create text file with image reference"""
-    generated_time = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+    for result in run_batch(sources, cache=get_result_cache(), fast_path=fast_path, stages=get_stage_store()):
+        results.append(result)
+        progress.progress(
+            len(results) / len(uploaded_files),
+            text=f"Analyzed {len(results)} of {len(uploaded_files)}: {result.name}",
+        )
+        summary_table.dataframe([summary_row(r) for r in results], use_container_width=True)
     
-    output = "=" * 70 + "\n"
-    output += "WSP GRAPH SUMMARY\n"
-    output += "=" * 70 + "\n\n"
-    output += f"Generated Time : {generated_time}\n"
-    output += f"Graph Timestamp : {graph_period}\n\n"
+    get_history().add_results(results)
+    progress.empty()
+    summary_table.empty()
+    st.session_state["batch_results"] = results
+
+batch_results = st.session_state.get("batch_results")
+if batch_results and mode == "Batch":
+    render_batch_results(batch_results)
+
+# --- History ---
+def render_history(history):
+    """Trend chart and per-axle search over every recorded analysis"""
+    st.subheader("📈 Analysis History")
+    st.caption(f"{history.count()} recordings analyzed")
     
-    if image_path and os.path.exists(image_path):
-        output += "[GRAPH IMAGE INCLUDED - See PDF version for visual reference]\n\n"
+    col_axle, col_field, col_by = st.columns(3)
+    with col_axle:
+        axle = st.selectbox("Axle", ["All", *AXLES])
+    with col_field:
+        field_label = st.selectbox("Count", ["Conclusion", "WSP System Status"])
+    with col_by:
+        by = st.selectbox("Per", ["month", "week", "day"])
+    dates = st.date_input("Recording dates", value=(datetime.now() - timedelta(days=365), datetime.now()))
+    if len(dates) != 2:
+        st.info("Select the last recording date")
+        return
+    since, until = dates[0].isoformat(), (dates[1] + timedelta(days=1)).isoformat()
+    axle = None if axle == "All" else axle
     
-    output += "-" * 70 + "\n"
-    output += "ANALYSIS REPORT\n"
-    output += "-" * 70 + "\n\n"
-    output += text_content
-    output += "\n\n" + "=" * 70 + "\n"
-    output += "This report is generated by Premade Innovations Pvt. Ltd.\n"
-    output += "=" * 70 + "\n"
+    field = "conclusion" if field_label == "Conclusion" else "wsp_status"
+    trend = history.trend(axle, by, field, since, until)
+    if trend:
+        st.bar_chart(trend, x="period", y="count", color=field)
+    else:
+        st.info("No analyses recorded for these dates")
     
-    return output
-
-# --- Main Interface ---
-st.title("🚄 WSP Operational Graph Analyzer")
-uploaded_file = st.file_uploader("Choose a PDF Graph file", type=["pdf"])
-
-# --- Analysis Logic (FIXED) ---
-def analyze_pdf(file_path):
-    try:
-        # Convert PDF to image for analysis
-        image = pdf_to_image(file_path)
-        if image is None:
-            return "Error: Could not extract image from PDF"
-
-        prompt = """
-You are an expert railway braking systems analyst and WSP (Wheel Slide Protection) system engineer.
-
-CRITICAL: You MUST follow the EXACT format specified below. Do not add, remove, or modify any sections.
-
-====================
-REQUIRED OUTPUT FORMAT
-====================
-
-You MUST generate your report in EXACTLY this format:
-
-## Date of Analysis
-[Current date in DD-MM-YYYY format]
-
-## 1. Executive Summary
-[Provide a brief 3-4 sentence overview of the operational period, key findings, and critical issues if any]
-
-## 2. Speed and Axle Deviation Analysis
-
-| Axle No. | Line Color | Observed Speed Condition | Phase of Anomaly | Conclusion |
-|----------|------------|-------------------------|------------------|------------|
-| Axle 1 | Green | [Description] | [Time period] | [Status] |
-| Axle 2 | Yellow | [Description] | [Time period] | [Status] |
-| Axle 3 | Blue | [Description] | [Time period] | [Status] |
-| Axle 4 | Pink | [Description] | [Time period] | [Status] |
-
-## 3. Wheel Slide Protection (WSP) System Response Analysis
-
-| Axle No. | Dump Valve Activation (BV) | Dump Valve Closure (EV) | WSP System Status |
-|----------|---------------------------|------------------------|-------------------|
-| Axle 1 | [Description] | [Description] | [Status] |
-| Axle 2 | [Description] | [Description] | [Status] |
-| Axle 3 | [Description] | [Description] | [Status] |
-| Axle 4 | [Description] | [Description] | [Status] |
-
-## 4. Diagnosis
-[Provide detailed technical diagnosis based on observations. Include specific timestamps and measurements where visible]
-
-## 5. Recommendations
-[List specific, actionable maintenance recommendations based on the diagnosis]
-
-====================
-TECHNICAL REFERENCE (Use this to fill the tables)
-====================
-
-LINE COLOR DEFINITIONS:
-- Red line (#FE0000): Reference Speed (train reference speed)
-- Green line (#00FF01): Axle 1 Speed
-- Yellow line (#FFFF00): Axle 2 Speed
-- Blue line (#0000FE): Axle 3 Speed
-- Pink line (#FF00FE): Axle 4 Speed
-
-DUMP VALVE COLOR CODING:
-- #9A99FF: Dump valve activation for Axle 1
-- #6599FF: Dump valve activation for Axle 2
-- #6665FE: Dump valve activation for Axle 3
-- #3401CC: Dump valve activation for Axle 4
-
-ANALYSIS RULES:
-
-For "Observed Speed Condition":
-- "Tracking reference speed smoothly" if axle follows red line
-- "Fluctuating with deviations" if axle shows variations
-- "Severe drops below reference" if axle drops significantly
-- "Complete wheel lock" if speed drops to zero
-
-For "Phase of Anomaly":
-- Specify time range (e.g., "16.00s - 30.75s")
-- Use "None" if no anomaly detected
-- Use "Multiple periods" if anomalies occur at different times
-
-For "Conclusion":
-- "Normal Operation" if tracking reference smoothly
-- "Affected - Minor" for small deviations with quick recovery
-- "Affected - Moderate" for repeated fluctuations
-- "Severely Affected" for prolonged wheel lock or major deviations
-
-For "Dump Valve Activation (BV)":
-- "Activated immediately" if BV responds when needed
-- "Multiple rapid activations" for frequent cycling
-- "Sustained activation" for prolonged pressure dump
-- "No activation detected" if no BV signal when needed
-
-For "Dump Valve Closure (EV)":
-- "Proper closure after recovery" if EV follows BV correctly
-- "Rapid cycling" for quick open-close patterns
-- "Delayed closure" if EV timing is off
-- "No closure signal" if missing
-
-For "WSP System Status":
-- "Functioning Correctly" if BV activates when needed and EV follows properly
-- "Partially Effective" if system responds but with delays
-- "Malfunction Suspected" if no BV activation despite wheel slip
-- "Requires Maintenance" if system shows irregular behavior
-
-====================
-CRITICAL INSTRUCTIONS
-====================
-
-1. Use ONLY the section headings provided above
-2. Fill ALL four rows in BOTH tables (one row per axle)
-3. Keep table format EXACTLY as shown with pipe separators
-4. Base your analysis ONLY on what you observe in the graph
-5. Do not add extra sections or subsections
-6. Use professional railway engineering terminology
-7. Be concise but technically accurate
-8. If you cannot determine something, state "Cannot determine from graph" rather than guessing
-"""
-
-        # Use the correct API method
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content([prompt, image])
-        
-        if response and response.text:
-            return response.text
-        else:
-            return "Error: Empty response from AI"
-            
-    except Exception as e:
-        return f"An error occurred: {str(e)}"
-
-# --- Execution ---
-if uploaded_file and st.button("Generate Diagnostic Report"):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-        tmp_file.write(uploaded_file.getvalue())
-        tmp_path = tmp_file.name
+    st.divider()
+    st.subheader("🔎 Find Recordings")
+    col_conclusion, col_status = st.columns(2)
+    with col_conclusion:
+        conclusion = st.selectbox("Conclusion", ["Any", *CONCLUSIONS])
+    with col_status:
+        wsp_status = st.selectbox("WSP System Status", ["Any", *WSP_STATUSES])
+    rows = history.find(
+        axle,
+        None if conclusion == "Any" else conclusion,
+        None if wsp_status == "Any" else wsp_status,
+        since, until, limit=1000,
+    )
+    st.dataframe(
+        [{"Recording": r["file_name"] or r["pdf_sha256"][:16], "Graph Period": r["graph_period"],
+          "Axle": r["axle"], "Conclusion": r["conclusion"], "WSP System Status": r["wsp_status"],
+          "Analyzed By": r["engine"]} for r in rows],
+        use_container_width=True,
+    )
 
-    with st.spinner("Analyzing with Gemini..."):
-        graph_period = extract_graph_period(tmp_path)
-        graph_image = pdf_to_image(tmp_path)
-        
-        img_temp_path = None
-        if graph_image:
-            img_temp_path = tempfile.NamedTemporaryFile(delete=False, suffix=".png").name
-            graph_image.save(img_temp_path)
-        
-        report = analyze_pdf(tmp_path)
-        
-        if report is None or "Error" in str(report):
-            st.error(report if report else "Analysis failed - No response received")
-        else:
-            col_meta1, col_meta2 = st.columns(2)
-            with col_meta1:
-                st.info(f"**Generated Time:** {datetime.now().strftime('%d-%m-%Y %H:%M:%S')}")
-            with col_meta2:
-                st.info(f"**Graph Timestamp:** {graph_period}")
-            
-            st.divider()
-            
-            if graph_image:
-                st.subheader("📊 Uploaded Graph")
-                st.image(graph_image, caption="WSP Operational Graph", use_container_width=True)
-                st.divider()
-            
-            st.subheader("📋 Analysis Result")
-            st.markdown(report)
-            st.divider()
-            
-            st.subheader("📥 Download Options")
-            col1, col2, col3 = st.columns(3)
-            
-            if graph_image and img_temp_path:
-                with col1:
-                    with open(img_temp_path, "rb") as img_file:
-                        st.download_button(
-                            label="🖼️ Download Graph (.png)",
-                            data=img_file.read(),
-                            file_name="WSP_Graph.png",
-                            mime="image/png",
-                        )
-            
-            with col2:
-                text_content = create_text_with_image_info(report, img_temp_path, graph_period)
-                st.download_button(
-                    label="📄 Download Report (.txt)",
-                    data=text_content,
-                    file_name="WSP_Analysis_Report.txt",
-                    mime="text/plain",
-                )
-            
-            with col3:
-                try:
-                    pdf_data = create_pdf_with_image(report, img_temp_path, graph_period)
-                    st.download_button(
-                        label="📕 Download Full Report (.pdf)",
-                        data=pdf_data,
-                        file_name="WSP_Analysis_Report.pdf",
-                        mime="application/pdf",
-                    )
-                except Exception as e:
-                    st.warning(f"PDF generation failed: {e}")
-        
-        if img_temp_path and os.path.exists(img_temp_path):
-            os.unlink(img_temp_path)
-    
-    os.unlink(tmp_path)
+if mode == "History":
+    render_history(get_history())
@@ -0,0 +1,460 @@
+"""Batch analysis of many WSP graph PDFs.
+
+PDFs are rendered in a process pool, which hands pages back as PNG bytes
+(a raw recording as its traces); Gemini calls run in a bounded thread pool,
+each decoding its page within the process memory budget (memory_budget.py),
+at batch priority through the model scheduler (per-key quotas, 429
+handling and model fallback; see scheduler.py), and results are yielded as
+soon as each recording finishes. ``--rpm`` additionally caps the whole run.
+The TXT/PDF reports are built in the same process pool as the pages, so
+FPDF runs in parallel rather than on the thread yielding results, and
+recordings with identical reports share one build.
+
+Usage:
+    python batch.py graphs/ --out reports.zip --workers 4
+"""
+import argparse
+import csv
+import io
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from google.api_core import exceptions as api_exceptions
+from PIL import Image
+
+import metrics
+from analyzer import ANALYSIS_BYTES_PER_PIXEL, MODEL_NAME, configure, count_pages, generate_report
+from history import AnalysisHistory
+from memory_budget import BUDGET
+from multipage import PageReport, merge_page_reports, recording_period
+from recorder_data import RECORDER_SUFFIXES, RENDER_SIZE
+from report_schema import AnalysisReport, to_markdown
+from reports import ARTIFACT_BUILDERS
+from result_cache import ResultCache, cache_key
+from scheduler import BATCH, ModelUnavailable
+from slip_analysis import with_measurements
+from stages import (StageStore, ingest_stage, model_key, page_image, pipeline_fingerprint, report_key,
+                    report_stage, rules_stage, save_answer, stored_answer, stored_reports)
+
+DEFAULT_WORKERS = 4
+DEFAULT_RPM = None  # per-key quotas are the scheduler's; this caps the whole run
+MAX_RETRIES = 5
+
+# Errors worth retrying: quota exhaustion, timeouts and transient server faults.
+# The scheduler already retries these on other keys and models, so here they
+# mean the whole pool was busy and a batch page can wait for it.
+RETRYABLE_ERRORS = (
+    ModelUnavailable,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.TooManyRequests,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.InternalServerError,
+    ConnectionError,
+    TimeoutError,
+)
+
+
+@dataclass
+class BatchResult:
+    """Outcome of one recording in a batch run"""
+    name: str
+    graph_period: str = "Not Available"
+    report: AnalysisReport = None
+    error: str = None
+    cached: bool = False
+    engine: str = "-"
+    seconds: float = 0.0
+    artifacts: dict = field(default_factory=dict)
+    pdf_sha256: str = None
+    fallback_model: str = None  # answered (in part) by this model instead of the requested one; not cached
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+# --- Rate Limiting ---
+class RateLimiter:
+    """Thread-safe limiter that spaces calls evenly to N requests per minute"""
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_for = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait_for > 0:
+            time.sleep(wait_for)
+
+
+def call_with_retry(func, *args, retries=MAX_RETRIES, base_delay=2.0, max_delay=60.0,
+                    limiter=None, retry_on=RETRYABLE_ERRORS):
+    """Call func, retrying transient API errors with exponential backoff and jitter"""
+    for attempt in range(retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            return func(*args)
+        except retry_on:
+            if attempt == retries:
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+
+def _page_memory(page):
+    """Bytes the model call of an ingested page reserves from the process budget"""
+    if page.png_bytes is None:
+        width, height = RENDER_SIZE
+    else:
+        width, height = Image.open(io.BytesIO(page.png_bytes)).size  # header only
+    return width * height * ANALYSIS_BYTES_PER_PIXEL
+
+
+def analyze_page(page, model_name=MODEL_NAME, limiter=None):
+    """(model answer, model that gave it) for an ingested page, decoded here within the memory budget"""
+    answered = []
+    with BUDGET.reserve(_page_memory(page)):
+        image = page_image(page)
+        report = call_with_retry(generate_report, image, model_name, page.graph.traces, BATCH, answered.append,
+                                 limiter=limiter)
+    return report, answered[-1]
+
+
+# --- Batch Runner ---
+REPORT_ARTIFACTS = tuple(ARTIFACT_BUILDERS)  # built in the worker processes
+
+
+def _base_artifacts(report, png_bytes):
+    """The artifacts that need no rendering: JSON/markdown report and graph PNG"""
+    return {"report.json": report.to_json(), "report.md": to_markdown(report), "graph.png": png_bytes}
+
+
+class _Recording:
+    """Per-document state while its pages move through the pipeline"""
+
+    def __init__(self, name, key, key_parts, page_count, started):
+        self.name = name
+        self.key = key
+        self.key_parts = key_parts
+        self.page_count = page_count
+        self.started = started
+        self.pages = {}
+        self.errors = []
+        self.first_png = None
+        self.fallback_model = None
+
+    @property
+    def done(self):
+        return len(self.pages) + len(self.errors) == self.page_count
+
+    def graph_period(self):
+        return recording_period([self.pages[i] for i in sorted(self.pages)]) if self.pages else "Not Available"
+
+
+def _merge(recording):
+    """BatchResult of a recording whose pages are all done, still without its TXT/PDF"""
+    graph_period = recording.graph_period()
+    if recording.errors:
+        return BatchResult(name=recording.name, graph_period=graph_period, error=recording.errors[0],
+                           seconds=time.perf_counter() - recording.started)
+
+    page_reports = [recording.pages[i] for i in sorted(recording.pages)]
+    report = merge_page_reports(page_reports)
+    engines = {p.engine for p in page_reports}
+    return BatchResult(name=recording.name, graph_period=graph_period, report=report,
+                       pdf_sha256=recording.key_parts[0],
+                       engine=engines.pop() if len(engines) == 1 else "Mixed",
+                       artifacts=_base_artifacts(report, recording.first_png),
+                       fallback_model=recording.fallback_model)
+
+
+def _complete(result, started, key, key_parts, rendered, cache):
+    """Attach the rendered TXT/PDF (or the error building them) and store the result in the cache
+
+    ``key_parts`` is None for cache hits that only lacked the TXT/PDF. The
+    cache key names the requested model, so a fallback model's report is
+    left out.
+    """
+    if isinstance(rendered, Exception):
+        result.error = f"Report generation failed: {rendered}"
+    else:
+        result.artifacts.update(rendered)
+        if cache and result.fallback_model:
+            metrics.count("cache_skipped", reason="fallback_model")
+        elif cache and key_parts is None:
+            for name in REPORT_ARTIFACTS:
+                cache.add_artifact(key, name, rendered[name])
+        elif cache:
+            cache.put(key, key_parts, result.graph_period, result.artifacts)
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def run_batch(sources, workers=DEFAULT_WORKERS, render_workers=None, requests_per_minute=DEFAULT_RPM,
+              cache=None, model_name=MODEL_NAME, fast_path=True, stages=None):
+    """Analyze (name, pdf_bytes) pairs concurrently, yielding BatchResult as each finishes
+
+    Pages are the unit of work: each page is rendered, analyzed and released
+    on its own, so memory is bounded by the in-flight window rather than by
+    the length of any recording. With ``fast_path`` clearly normal pages are
+    reported by the local rules and never reach the model pool. With a
+    ``stages`` StageStore every stage reuses stored outputs of unchanged
+    inputs (see stages.py), so re-runs after a prompt, rules or layout
+    change only redo the affected stages.
+    """
+    limiter = RateLimiter(requests_per_minute)
+    max_in_flight = max(2, workers * 2)
+    pending = {}
+    report_builds = {}  # report stage key -> future building the TXT/PDF
+    fingerprint = pipeline_fingerprint(fast_path=fast_path)
+
+    def build_reports(result, started, key, key_parts):
+        """Queue a result's TXT/PDF on the worker processes, joining the build of an identical report
+
+        Returns the finished result instead when the stage store already has them.
+        """
+        png_bytes = result.artifacts.get("graph.png")
+        identity = report_key(result.report, png_bytes, result.graph_period)
+        future = report_builds.get(identity)
+        if future is None:
+            stored = stored_reports(stages, identity)
+            if stored:
+                return _complete(result, started, key, key_parts, stored, cache)
+            future = report_builds[identity] = render_pool.submit(
+                report_stage, stages, identity, result.report, png_bytes, result.graph_period)
+            pending[future] = ("report", [], None, identity)
+        pending[future][1].append((result, started, key, key_parts))
+        return None
+
+    def page_jobs():
+        """Yield finished BatchResults for cache hits/unreadable files, else page jobs"""
+        for name, pdf_bytes in sources:
+            started = time.perf_counter()
+            key, key_parts = cache_key(pdf_bytes, fingerprint, model_name)
+            cached = cache.get(key) if cache else None
+            hit = cached is not None and "report.json" in cached["artifacts"]
+            if cache:
+                metrics.count("cache_requests", result="hit" if hit else "miss")
+            if hit:
+                artifacts = cached["artifacts"]
+                result = BatchResult(
+                    name=name,
+                    graph_period=cached["graph_period"] or "Not Available",
+                    report=AnalysisReport.from_json(artifacts["report.json"]),
+                    cached=True,
+                    engine="Cache",
+                    seconds=time.perf_counter() - started,
+                    artifacts=artifacts,
+                    pdf_sha256=key_parts[0],
+                )
+                if all(artifact in artifacts for artifact in REPORT_ARTIFACTS):
+                    yield result
+                else:
+                    # Analyzed by a single-report job whose downloads were never built
+                    finished = build_reports(result, started, key, None)
+                    if finished:
+                        yield finished
+                continue
+            try:
+                page_count = count_pages(pdf_bytes)
+            except Exception as e:
+                yield BatchResult(name=name, error=f"Render failed: {e}",
+                                  seconds=time.perf_counter() - started)
+                continue
+            recording = _Recording(name, key, key_parts, page_count, started)
+            for page_number in range(page_count):
+                yield recording, pdf_bytes, page_number
+
+    jobs = page_jobs()
+
+    # spawn keeps workers independent of the (possibly multi-threaded) parent, e.g. Streamlit
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(render_workers, mp_context=mp_context) as render_pool, \
+            ThreadPoolExecutor(workers) as model_pool:
+
+        def submit_next():
+            """Queue page renders until the in-flight window is full"""
+            while len(pending) < max_in_flight:
+                job = next(jobs, None)
+                if job is None:
+                    return
+                if isinstance(job, BatchResult):
+                    yield job
+                    continue
+                recording, pdf_bytes, page_number = job
+                # The first page's PNG goes into the PDF report and the zip
+                future = render_pool.submit(ingest_stage, stages, recording.key_parts[0], pdf_bytes, page_number,
+                                            page_number == 0)
+                pending[future] = ("render", recording, page_number, None)
+
+        yield from submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, recording, page_number, context = pending.pop(future)
+                if stage == "report":
+                    del report_builds[context]
+                    try:
+                        rendered = future.result()
+                    except Exception as e:
+                        rendered = e
+                    for waiting in recording:  # every result with this report
+                        yield _complete(*waiting, rendered, cache)
+                    continue
+                try:
+                    value = future.result()
+                except Exception as e:
+                    prefix = "Render failed" if stage == "render" else "Analysis failed"
+                    recording.errors.append(f"{prefix} on page {page_number + 1}: {e}")
+                    value = None
+
+                if value is not None and stage == "render":
+                    page, graph = value, value.graph
+                    if stages is not None:
+                        stages.record("ingest", page.reused)
+                    if page_number == 0:
+                        recording.first_png = page.png_bytes
+                    local_report = rules_stage(stages, page) if fast_path else None
+                    answer_key = model_key(page, model_name)
+                    answer = None if local_report else stored_answer(stages, answer_key)
+                    if local_report:
+                        metrics.count("pages", engine="Rules")
+                        recording.pages[page_number] = PageReport(
+                            page_number, graph.graph_period, local_report, "Rules")
+                    elif answer:
+                        metrics.count("pages", engine="Gemini")
+                        recording.pages[page_number] = PageReport(
+                            page_number, graph.graph_period, with_measurements(answer, graph.traces), "Gemini")
+                    else:
+                        analysis = model_pool.submit(analyze_page, page, model_name, limiter)
+                        # Keep the period and traces; the PNG is released once the model call returns
+                        pending[analysis] = ("analyze", recording, page_number,
+                                             (graph.graph_period, answer_key, graph.traces))
+                        continue
+                elif value is not None:
+                    graph_period, answer_key, traces = context
+                    answer, answered_by = value
+                    if answered_by == model_name:
+                        save_answer(stages, answer_key, answer)
+                    else:
+                        recording.fallback_model = answered_by
+                    metrics.count("pages", engine="Gemini")
+                    recording.pages[page_number] = PageReport(
+                        page_number, graph_period, with_measurements(answer, traces), "Gemini")
+
+                if recording.done:
+                    result = _merge(recording)
+                    if result.ok:
+                        result = build_reports(result, recording.started, recording.key, recording.key_parts)
+                    if result:
+                        yield result
+            yield from submit_next()
+
+
+# --- Summary and Export ---
+SUMMARY_COLUMNS = ["File", "Graph Period", "Status", "Engine", "Seconds"]
+
+
+def summary_row(result):
+    """One row of the batch summary table"""
+    return {
+        "File": result.name,
+        "Graph Period": result.graph_period,
+        "Status": "OK" if result.ok else result.error,
+        "Engine": result.engine,
+        "Seconds": round(result.seconds, 2),
+    }
+
+
+def build_zip(results):
+    """Bundle every report plus a summary.csv into one zip archive"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        summary = io.StringIO()
+        writer = csv.DictWriter(summary, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        for result in results:
+            writer.writerow(summary_row(result))
+            stem = os.path.splitext(result.name)[0]
+            for artifact_name, data in result.artifacts.items():
+                if data is None:
+                    continue
+                suffix = os.path.splitext(artifact_name)[1]
+                label = "WSP_Graph" if suffix == ".png" else "WSP_Analysis_Report"
+                zf.writestr(f"{stem}/{label}{suffix}", data)
+        zf.writestr("summary.csv", summary.getvalue())
+    return buffer.getvalue()
+
+
+# --- CLI ---
+def iter_pdf_files(paths):
+    """Yield (name, bytes) for every PDF or recorder export in the given files/directories"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for file_name in sorted(files):
+                    if file_name.lower().endswith((".pdf",) + RECORDER_SUFFIXES):
+                        full_path = os.path.join(root, file_name)
+                        with open(full_path, "rb") as f:
+                            yield os.path.relpath(full_path, path), f.read()
+        else:
+            with open(path, "rb") as f:
+                yield os.path.basename(path), f.read()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze many WSP graph PDFs concurrently")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories containing PDFs")
+    parser.add_argument("--out", default="WSP_Batch_Reports.zip", help="Zip file to write")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent model calls")
+    parser.add_argument("--render-workers", type=int, default=None, help="Processes used for rendering")
+    parser.add_argument("--rpm", type=float, default=DEFAULT_RPM,
+                        help="Cap on model requests per minute for the whole run (default: per-key quotas only)")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the result cache")
+    parser.add_argument("--no-fast-path", action="store_true",
+                        help="Send every graph to the model, even clearly normal ones")
+    parser.add_argument("--no-history", action="store_true", help="Do not record results in the history")
+    parser.add_argument("--no-stage-store", action="store_true",
+                        help="Do not reuse or store intermediate stage outputs")
+    args = parser.parse_args(argv)
+
+    if not configure():
+        parser.error("set GEMINI_API_KEY (and optionally GEMINI_API_KEYS) in the environment")
+
+    cache = None if args.no_cache else ResultCache()
+    stages = None if args.no_stage_store else StageStore()
+    results = []
+    for result in run_batch(iter_pdf_files(args.paths), workers=args.workers,
+                            render_workers=args.render_workers,
+                            requests_per_minute=args.rpm, cache=cache,
+                            fast_path=not args.no_fast_path, stages=stages):
+        results.append(result)
+        status = f"ok via {result.engine}" if result.ok else result.error
+        print(f"[{len(results)}] {result.name}: {status} ({result.seconds:.1f}s)", flush=True)
+
+    with open(args.out, "wb") as f:
+        f.write(build_zip(results))
+    if not args.no_history:
+        AnalysisHistory().add_results(results)
+    failed = sum(1 for r in results if not r.ok)
+    print(f"Wrote {args.out}: {len(results)} recordings, {failed} failed")
+    if stages is not None and stages.tally:
+        print(f"Reused stage outputs: {stages.reuse_summary()}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,336 @@
+"""Benchmarks for the ingestion, analysis and report-generation hot paths.
+
+Every scenario runs on synthetic recordings (see synthetic.py) with the
+Gemini model replaced by a local stand-in, so numbers are reproducible and
+need no network. Each scenario runs in a fresh process: it is set up, warmed
+up once, then timed ``--repeat`` times, and its peak RSS is that process's
+high-water mark. Results can be saved as a baseline and later runs compared
+against it; a slowdown or memory growth beyond the tolerance is flagged and
+makes the run exit non-zero.
+
+Usage:
+    python benchmarks.py run --save baseline.json
+    python benchmarks.py run --compare baseline.json
+    python benchmarks.py run --profile full --stage add_table --stage analyze
+    python benchmarks.py list
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from multiprocessing import get_context
+
+DEFAULT_REPEAT = 5
+DEFAULT_TIME_TOLERANCE = 0.15
+DEFAULT_RSS_TOLERANCE = 0.10
+
+
+@dataclass
+class Scenario:
+    stage: str
+    params: dict = field(default_factory=dict)
+
+    @property
+    def key(self):
+        return self.stage + "[" + ",".join(f"{k}={v}" for k, v in sorted(self.params.items())) + "]"
+
+
+@dataclass
+class StageResult:
+    key: str
+    stage: str
+    params: dict
+    seconds: float  # median over the timed runs
+    min_seconds: float
+    items: int
+    unit: str
+    peak_rss_mb: float
+
+    @property
+    def throughput(self):
+        return self.items / self.seconds if self.seconds else float("inf")
+
+
+# --- Stages ---
+# Each stage sets up its input and returns (run, items, unit); only run() is timed.
+# Inputs are sized so one run takes long enough (~0.1 s) to time reliably.
+def _recording(pages=1, points=400, anomaly_rate=0.3):
+    from synthetic import make_recording
+    return make_recording(pages=pages, points=points, anomaly_rate=anomaly_rate, seed=pages * 1000 + points)
+
+
+def stage_pdf_to_image(pages=1, points=400):
+    from analyzer import open_pdf, pdf_to_image
+    pdf = _recording(pages, points)
+
+    def run():
+        with open_pdf(pdf) as doc:
+            for page in doc:
+                pdf_to_image(page)
+    return run, pages, "pages"
+
+
+def stage_extract_graph_period(pages=4, repeat=20000):
+    from analyzer import extract_graph_period, open_pdf
+    with open_pdf(_recording(pages, 50)) as doc:
+        texts = [page.get_text() for page in doc]
+
+    def run():
+        for _ in range(repeat):
+            for text in texts:
+                extract_graph_period(text)
+    return run, pages * repeat, "texts"
+
+
+def stage_ingest(pages=1, points=400):
+    from analyzer import iter_pages
+
+    pdf = _recording(pages, points)
+
+    def run():
+        for graph in iter_pages(pdf):
+            del graph
+    return run, pages, "pages"
+
+
+def stage_analyze(pages=1, points=400, latency=0.05):
+    """The whole single-report job with the model stubbed out: ingest, model, merge, artifacts"""
+    from jobs import DONE, AnalysisJob
+    from synthetic import FakeGeminiModel, install_fake_model
+
+    install_fake_model(FakeGeminiModel(latency=latency))
+    pdf = _recording(pages, points)
+
+    def run():
+        job = AnalysisJob(pdf, "bench.pdf", fast_path=False)
+        job.run()
+        if job.status != DONE:
+            raise RuntimeError(job.error or job.status)
+    return run, pages, "pages"
+
+
+def stage_slip_analysis(samples=1_000_000, axles=4):
+    """Slip phases and valve matching on long synthetic series (no rendering involved)"""
+    import numpy as np
+    from slip_analysis import measure_axle
+    rng = np.random.default_rng(samples)
+    times = np.linspace(0.0, samples / 1000, samples)
+    reference = np.linspace(80.0, 0.0, samples)
+    speeds = [reference * (1 - np.abs(rng.normal(0, 0.06, samples))) for _ in range(axles)]
+    pulses = np.sort(rng.uniform(0.0, times[-1], 2000)).reshape(-1, 2)
+
+    def run():
+        for axle, speed in enumerate(speeds, 1):
+            measure_axle(times, speed, reference, pulses, axle)
+    return run, samples * axles, "samples"
+
+
+def stage_add_table(rows=1000):
+    from reports import EnhancedPDF
+    headers = ['File', 'Graph Period', 'Status', 'Engine', 'Seconds']
+    table = [[f'recording_{i:05d}.pdf', '18.01.25 07:10:24 to 18.01.25 07:12:54',
+              'Severely Affected' if i % 7 == 0 else 'Normal Operation - no deviation',
+              'Gemini' if i % 3 else 'Rules', f'{i % 40 + 0.5:.1f}'] for i in range(rows)]
+
+    def run():
+        pdf = EnhancedPDF()
+        pdf.add_page()
+        pdf.add_table(headers, table)
+        pdf.output(dest='S')
+    return run, rows, "rows"
+
+
+def _report_inputs(points):
+    import io
+    from analyzer import ingest_pdf
+    from synthetic import canned_report
+    graph = ingest_pdf(_recording(1, points), extract=False)
+    buffer = io.BytesIO()
+    graph.image.save(buffer, format="PNG")
+    return canned_report(), buffer.getvalue(), graph.graph_period
+
+
+def stage_create_pdf_with_image(points=400, repeat=50):
+    from reports import create_pdf_with_image
+    report, png_bytes, graph_period = _report_inputs(points)
+
+    def run():
+        for _ in range(repeat):
+            create_pdf_with_image(report, png_bytes, graph_period)
+    return run, repeat, "reports"
+
+
+def stage_create_text_with_image_info(repeat=10000):
+    from reports import create_text_with_image_info
+    report, png_bytes, graph_period = _report_inputs(50)
+
+    def run():
+        for _ in range(repeat):
+            create_text_with_image_info(report, png_bytes, graph_period)
+    return run, repeat, "reports"
+
+
+def stage_cold_start(warm=False):
+    """A fresh interpreter importing what the app needs for its first page, plus the full warm-up if warm"""
+    code = "import history, metrics, report_schema, result_cache, warmup"
+    if warm:
+        code += "; warmup.warm_up()"
+
+    def run():
+        subprocess.run([sys.executable, "-W", "ignore", "-c", code], check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+    return run, 1, "starts"
+
+
+STAGES = {
+    "pdf_to_image": stage_pdf_to_image,
+    "extract_graph_period": stage_extract_graph_period,
+    "ingest": stage_ingest,
+    "analyze": stage_analyze,
+    "slip_analysis": stage_slip_analysis,
+    "add_table": stage_add_table,
+    "create_pdf_with_image": stage_create_pdf_with_image,
+    "create_text_with_image_info": stage_create_text_with_image_info,
+    "cold_start": stage_cold_start,
+}
+
+PROFILES = {
+    "quick": [
+        Scenario("pdf_to_image", {"pages": 1, "points": 400}),
+        Scenario("pdf_to_image", {"pages": 4, "points": 4000}),
+        Scenario("extract_graph_period", {"pages": 4, "repeat": 20000}),
+        Scenario("ingest", {"pages": 4, "points": 4000}),
+        Scenario("analyze", {"pages": 3, "points": 800, "latency": 0.05}),
+        Scenario("slip_analysis", {"samples": 1_000_000, "axles": 4}),
+        Scenario("add_table", {"rows": 1000}),
+        Scenario("create_pdf_with_image", {"points": 400, "repeat": 50}),
+        Scenario("create_text_with_image_info", {"repeat": 10000}),
+        Scenario("cold_start", {"warm": False}),
+        Scenario("cold_start", {"warm": True}),
+    ],
+}
+PROFILES["full"] = PROFILES["quick"] + [
+    Scenario("pdf_to_image", {"pages": 16, "points": 400}),
+    Scenario("pdf_to_image", {"pages": 4, "points": 20000}),
+    Scenario("ingest", {"pages": 16, "points": 400}),
+    Scenario("ingest", {"pages": 4, "points": 20000}),
+    Scenario("analyze", {"pages": 10, "points": 4000, "latency": 0.2}),
+    Scenario("add_table", {"rows": 10000}),
+    Scenario("create_pdf_with_image", {"points": 20000, "repeat": 50}),
+]
+
+
+# --- Runner ---
+def measure(scenario, repeat=DEFAULT_REPEAT):
+    """Set up, warm up and time one scenario in the current process"""
+    run, items, unit = STAGES[scenario.stage](**scenario.params)
+    run()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    if sys.platform == "darwin":
+        peak_rss_mb /= 1024  # bytes on macOS
+    return StageResult(scenario.key, scenario.stage, scenario.params, statistics.median(timings), min(timings),
+                       items, unit, round(peak_rss_mb, 1))
+
+
+def run_scenarios(scenarios, repeat=DEFAULT_REPEAT, isolate=True):
+    """Measure scenarios one after another, each in a fresh process unless isolate is False"""
+    for scenario in scenarios:
+        if not isolate:
+            yield measure(scenario, repeat)
+            continue
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            yield executor.submit(measure, scenario, repeat).result()
+
+
+def compare(result, baseline, time_tolerance=DEFAULT_TIME_TOLERANCE, rss_tolerance=DEFAULT_RSS_TOLERANCE):
+    """(time ratio, RSS ratio, regressed) against the baseline entry for the same scenario
+
+    Times are compared on the fastest run, which is the least disturbed by other load.
+    """
+    time_ratio = result.min_seconds / baseline["min_seconds"] if baseline["min_seconds"] else 1.0
+    rss_ratio = result.peak_rss_mb / baseline["peak_rss_mb"] if baseline["peak_rss_mb"] else 1.0
+    return time_ratio, rss_ratio, time_ratio > 1 + time_tolerance or rss_ratio > 1 + rss_tolerance
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return {entry["key"]: entry for entry in json.load(f)["results"]}
+
+
+def save_results(path, results, profile):
+    document = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "profile": profile,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [asdict(r) for r in results],
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the WSP analyzer hot paths")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="Run a benchmark profile")
+    run.add_argument("--profile", choices=list(PROFILES), default="quick")
+    run.add_argument("--stage", action="append", choices=list(STAGES), help="Only run these stages")
+    run.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed runs per scenario")
+    run.add_argument("--in-process", action="store_true",
+                     help="Run every scenario in this process (peak RSS is then cumulative)")
+    run.add_argument("--save", metavar="JSON", help="Write the results (e.g. as a new baseline)")
+    run.add_argument("--compare", metavar="JSON", help="Compare against a saved baseline")
+    run.add_argument("--time-tolerance", type=float, default=DEFAULT_TIME_TOLERANCE)
+    run.add_argument("--rss-tolerance", type=float, default=DEFAULT_RSS_TOLERANCE)
+    sub.add_parser("list", help="List the scenarios of every profile")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for name, scenarios in PROFILES.items():
+            print(f"{name}:")
+            for scenario in scenarios:
+                print(f"  {scenario.key}")
+        return 0
+
+    scenarios = [s for s in PROFILES[args.profile] if not args.stage or s.stage in args.stage]
+    baseline = load_baseline(args.compare) if args.compare else {}
+    results, regressions = [], 0
+    print(f"{'Scenario':<58} {'Median s':>9} {'Throughput':>21} {'Peak RSS':>10}  Baseline")
+    for result in run_scenarios(scenarios, args.repeat, isolate=not args.in_process):
+        results.append(result)
+        versus = ""
+        if result.key in baseline:
+            time_ratio, rss_ratio, regressed = compare(result, baseline[result.key],
+                                                       args.time_tolerance, args.rss_tolerance)
+            regressions += regressed
+            versus = f"time {time_ratio - 1:+.1%}, RSS {rss_ratio - 1:+.1%}" + ("  REGRESSION" if regressed else "")
+        elif baseline:
+            versus = "new"
+        print(f"{result.key:<58} {result.seconds:>9.3f} {result.throughput:>11.1f} {result.unit + '/s':<9} "
+              f"{result.peak_rss_mb:>7.1f} MB  {versus}", flush=True)
+
+    if args.save:
+        save_results(args.save, results, args.profile)
+        print(f"Saved {len(results)} results to {args.save}")
+    if regressions:
+        print(f"{regressions} scenario{'' if regressions == 1 else 's'} regressed beyond tolerance")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""Rule-based fast path for WSP graphs.
+
+Applies the analysis rules from the prompt to the numeric traces extracted
+locally. When every axle clearly tracks the reference with no dump-valve
+activity, the report record is built directly and the model call is
+skipped; anomalous or uncertain graphs are escalated to Gemini.
+"""
+import warnings
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from report_schema import AnalysisReport, AxleRow, WspRow
+from trace_extraction import AXLE_COLORS, format_intervals, on_intervals
+
+# Bump when the rules below change, so stored verdicts are re-evaluated
+RULES_VERSION = 1
+
+NORMAL = "normal"
+ANOMALOUS = "anomalous"
+UNCERTAIN = "uncertain"
+
+
+@dataclass
+class Thresholds:
+    """Tunable limits for the rules; speeds are in the trace speed unit"""
+    deviation: float = 5.0  # axle vs reference gap that counts as a deviation
+    severe_deviation: float = 20.0  # "Severe drops below reference"
+    lock_speed: float = 2.0  # axle at or below this while the train moves = wheel lock
+    moving_speed: float = 10.0  # reference above this means the train is moving
+    minor_max_duration: float = 2.0  # seconds; single short deviations are "Minor"
+    prolonged_duration: float = 10.0  # seconds; longer deviations are "Severely Affected"
+    rapid_activations: int = 5  # valve activations that count as "Multiple rapid activations"
+    min_coverage: float = 0.6  # share of the plot where speed traces must be visible
+    min_axle_coverage: float = 0.2  # each axle must be visible at least this much
+
+
+@dataclass
+class AxleFinding:
+    axle: int
+    condition: str
+    phase: str
+    conclusion: str
+    bv: str
+    ev: str
+    wsp_status: str
+    deviations: np.ndarray = field(default_factory=lambda: np.empty((0, 2)))
+    valve_intervals: np.ndarray = field(default_factory=lambda: np.empty((0, 2)))
+
+
+@dataclass
+class Classification:
+    verdict: str
+    axles: list
+    reasons: list
+
+    @property
+    def is_normal(self):
+        return self.verdict == NORMAL
+
+
+def effective_reference(traces):
+    """Reference trace, filled where axle lines are drawn over it
+
+    When the axles track the reference exactly they hide the red line, so
+    columns without red pixels fall back to the median of the visible axles.
+    """
+    stack = np.vstack([traces.axles[a] for a in sorted(traces.axles)])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        fallback = np.nanmedian(stack, axis=0)
+    return np.where(np.isnan(traces.reference), fallback, traces.reference)
+
+
+def _total_duration(intervals):
+    return float((intervals[:, 1] - intervals[:, 0]).sum()) if len(intervals) else 0.0
+
+
+def classify_axle(traces, axle, reference, thresholds):
+    """Apply the prompt's 'Observed Speed Condition'/'Conclusion'/WSP rules to one axle"""
+    speed = traces.axles[axle]
+    deviation = np.nan_to_num(np.abs(speed - reference), nan=0.0)
+    deviations = on_intervals(deviation > thresholds.deviation, traces.time)
+    locked = (np.nan_to_num(speed, nan=np.inf) <= thresholds.lock_speed) & (
+        np.nan_to_num(reference, nan=0.0) > thresholds.moving_speed
+    )
+    longest = float((deviations[:, 1] - deviations[:, 0]).max()) if len(deviations) else 0.0
+    valve_intervals = traces.valves.get(axle, np.empty((0, 2)))
+    unit = "s" if traces.calibration.time_range[1] is not None else "px"
+
+    if locked.any():
+        condition, conclusion = "Complete wheel lock", "Severely Affected"
+    elif deviation.max(initial=0.0) > thresholds.severe_deviation:
+        condition, conclusion = "Severe drops below reference", "Severely Affected"
+    elif len(deviations):
+        condition = "Fluctuating with deviations"
+        if longest >= thresholds.prolonged_duration:
+            conclusion = "Severely Affected"
+        elif len(deviations) > 1:
+            conclusion = "Affected - Moderate"
+        elif longest <= thresholds.minor_max_duration:
+            conclusion = "Affected - Minor"
+        else:
+            conclusion = "Affected - Moderate"
+    else:
+        condition, conclusion = "Tracking reference speed smoothly", "Normal Operation"
+
+    if len(deviations) > 1 and unit != "s":
+        phase = "Multiple periods"
+    else:
+        phase = format_intervals(deviations, unit)
+
+    activations = len(valve_intervals)
+    if activations == 0:
+        if len(deviations):
+            bv, ev, wsp_status = "No activation detected", "No closure signal", "Malfunction Suspected"
+        else:
+            bv, ev, wsp_status = "Not required - no wheel slide", "Not required", "Functioning Correctly"
+    elif activations >= thresholds.rapid_activations:
+        bv, ev, wsp_status = "Multiple rapid activations", "Rapid cycling", "Requires Maintenance"
+    elif _total_duration(valve_intervals) >= thresholds.prolonged_duration:
+        bv, ev, wsp_status = "Sustained activation", "Delayed closure", "Partially Effective"
+    else:
+        bv, ev, wsp_status = "Activated immediately", "Proper closure after recovery", "Functioning Correctly"
+
+    return AxleFinding(axle, condition, phase, conclusion, bv, ev, wsp_status, deviations, valve_intervals)
+
+
+def classify(traces, thresholds=None):
+    """Classify a graph as normal, anomalous or uncertain from its extracted traces"""
+    thresholds = thresholds or Thresholds()
+    if traces is None:
+        return Classification(UNCERTAIN, [], ["No traces were extracted"])
+
+    reasons = []
+    visible = np.vstack([np.isfinite(traces.reference)] + [np.isfinite(traces.axles[a]) for a in traces.axles])
+    coverage = float(visible.any(axis=0).mean()) if visible.size else 0.0
+    if coverage < thresholds.min_coverage:
+        reasons.append(f"Speed traces visible over only {coverage:.0%} of the plot")
+    for axle in sorted(AXLE_COLORS):
+        # A missing trace may be hidden under another line or absent; don't guess
+        if traces.coverage.get(axle, 0.0) < thresholds.min_axle_coverage:
+            reasons.append(f"Axle {axle} trace visible over only {traces.coverage.get(axle, 0.0):.0%} of the plot")
+    if reasons:
+        return Classification(UNCERTAIN, [], reasons)
+
+    reference = effective_reference(traces)
+    findings = [classify_axle(traces, axle, reference, thresholds) for axle in sorted(traces.axles)]
+    for finding in findings:
+        if finding.conclusion != "Normal Operation":
+            reasons.append(f"Axle {finding.axle}: {finding.condition.lower()}")
+        if len(finding.valve_intervals):
+            reasons.append(f"Axle {finding.axle}: {len(finding.valve_intervals)} dump valve activations")
+
+    return Classification(ANOMALOUS if reasons else NORMAL, findings, reasons)
+
+
+# --- Local Report ---
+def build_report(classification):
+    """The report record for a normal graph, in the vocabulary the model is asked to use"""
+    findings = classification.axles
+    return AnalysisReport(
+        summary="All four axle speed traces track the reference speed throughout the recorded period. "
+                "No wheel slide, wheel lock or speed deviation beyond the configured tolerance was detected, "
+                "and no dump valve activity was recorded. The WSP system was not required to intervene "
+                "during this operation.",
+        axles=[AxleRow(f.axle, f.condition, f.phase, f.conclusion) for f in findings],
+        wsp=[WspRow(f.axle, f.bv, f.ev, f.wsp_status) for f in findings],
+        diagnosis="Adhesion conditions were adequate for the applied braking effort on every axle. Axle speeds "
+                  "remained within the deviation tolerance of the reference speed for the full recording, so "
+                  "the WSP controller had no reason to vent brake cylinder pressure and both BV and EV valves "
+                  "stayed inactive.",
+        recommendations=[
+            "No corrective maintenance required for the WSP system or speed sensors based on this recording.",
+            "Continue routine inspection of speed sensors, phonic wheels and dump valves per the maintenance "
+            "schedule.",
+        ],
+    )
+
+
+def fast_path_report(traces, thresholds=None):
+    """Return a local AnalysisReport for clearly normal graphs, else None"""
+    classification = classify(traces, thresholds)
+    return build_report(classification) if classification.is_normal else None
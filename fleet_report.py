@@ -0,0 +1,272 @@
+"""Consolidated fleet report: one PDF summarizing many analyses.
+
+The document has a cover, an index with one row per recording, thumbnail
+pages of every graph and a detail section per recording, all in the
+EnhancedPDF styling of the single reports. Recordings are consumed one at a
+time: each section is laid out by FPDF, appended to the output document and
+dropped, so memory holds one index row per recording plus the compressed
+output rather than every page's layout state.
+
+Usage:
+    python fleet_report.py graphs/ --out WSP_Fleet_Report.pdf
+"""
+import argparse
+import io
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import fitz
+from PIL import Image
+
+from multipage import summarize_report
+from preprocessing import ImageOptions, encode_png, preprocess
+from report_schema import AnalysisReport
+from reports import EnhancedPDF, add_cover_page, add_report
+
+THUMBNAIL_WIDTH = 900  # pixels; thumbnails are re-encoded, never the full render
+GALLERY_COLUMNS = 2
+GALLERY_ROWS = 3
+DETAIL_IMAGE_MAX_HEIGHT = 110  # mm
+
+
+class FleetPDF(EnhancedPDF):
+    """EnhancedPDF for one section of the fleet report; page numbers are stamped after assembly"""
+
+    def header(self):
+        pass
+
+
+@dataclass
+class FleetEntry:
+    """Index row of one recording"""
+    name: str
+    graph_period: str
+    status: str
+    engine: str
+    axles_affected: list = field(default_factory=list)
+    wsp_status: str = "-"
+    worst_conclusion: str = "-"
+    page: int = None  # first page of the detail section in the final document
+
+
+def _artifact(result, name):
+    data = result.artifacts.get(name) if result.artifacts else None
+    if isinstance(data, (bytes, bytearray)) and name.endswith((".json", ".md", ".txt")):
+        return data.decode("utf-8")
+    return data
+
+
+def make_thumbnail(png_bytes, width=THUMBNAIL_WIDTH):
+    """Cropped, palettized PNG of a graph image; returns (png bytes, (width, height))"""
+    with Image.open(io.BytesIO(png_bytes)) as image:
+        thumbnail = preprocess(image, ImageOptions(max_width=width))
+    return encode_png(thumbnail), thumbnail.size
+
+
+def _pdf_bytes(pdf):
+    return pdf.output(dest='S').encode('latin-1')
+
+
+def _append(document, pdf_data):
+    """Append an FPDF section to the PyMuPDF output document; returns its first page index"""
+    with fitz.open(stream=pdf_data, filetype="pdf") as section:
+        start = document.page_count
+        document.insert_pdf(section)
+    return start
+
+
+# --- Report Builder ---
+class FleetReportBuilder:
+    """Accumulates analyses one at a time and writes the consolidated PDF"""
+
+    def __init__(self, title="WSP FLEET SUMMARY"):
+        self.title = title
+        self.entries = []
+        self._details = fitz.open()
+        self._gallery = fitz.open()
+        self._thumbnails = []  # waiting for a full gallery page
+
+    def add(self, result):
+        """Add one BatchResult-like object (name, graph_period, report, error, engine, artifacts)"""
+        report = result.report
+        if report is None and _artifact(result, "report.json"):
+            report = AnalysisReport.from_json(_artifact(result, "report.json"))
+        entry = FleetEntry(name=result.name, graph_period=result.graph_period,
+                           status="OK" if result.error is None else result.error, engine=result.engine)
+        self.entries.append(entry)
+        if report is None:
+            return entry
+        summary = summarize_report(report)
+        entry.axles_affected = summary["axles_affected"]
+        entry.wsp_status = summary["wsp_status"]
+        entry.worst_conclusion = summary["worst_conclusion"]
+
+        png = _artifact(result, "graph.png")
+        thumbnail = make_thumbnail(png) if png else None
+        entry.page = self._add_detail(entry, report, thumbnail)
+        if thumbnail:
+            self._thumbnails.append((entry, thumbnail))
+            if len(self._thumbnails) == GALLERY_COLUMNS * GALLERY_ROWS:
+                self._flush_gallery()
+        return entry
+
+    def _add_detail(self, entry, report, thumbnail):
+        pdf = FleetPDF()
+        pdf.add_page()
+        pdf.add_heading(entry.name, level=1)
+        pdf.add_paragraph(f"Graph Timestamp: {entry.graph_period}")
+        pdf.add_paragraph(f"Analyzed By: {entry.engine}")
+        if thumbnail:
+            png, (width_px, height_px) = thumbnail
+            width = pdf.w - 20
+            height = width * height_px / width_px
+            if height > DETAIL_IMAGE_MAX_HEIGHT:
+                width, height = width * DETAIL_IMAGE_MAX_HEIGHT / height, DETAIL_IMAGE_MAX_HEIGHT
+            y = pdf.get_y()
+            pdf.image_from_bytes(png, x=10 + (pdf.w - 20 - width) / 2, y=y, w=width, h=height)
+            pdf.set_y(y + height + 5)
+        add_report(pdf, report)
+        return _append(self._details, _pdf_bytes(pdf))
+
+    def _flush_gallery(self):
+        if not self._thumbnails:
+            return
+        pdf = FleetPDF()
+        pdf.add_page()
+        if self._gallery.page_count == 0:
+            pdf.add_heading('Graph Thumbnails', level=1)
+        top = pdf.get_y()
+        cell_w = (pdf.w - 20) / GALLERY_COLUMNS
+        cell_h = (pdf.h - top - 15) / GALLERY_ROWS
+        for slot, (entry, (png, (width_px, height_px))) in enumerate(self._thumbnails):
+            x = 10 + (slot % GALLERY_COLUMNS) * cell_w
+            y = top + (slot // GALLERY_COLUMNS) * cell_h
+            pdf.set_xy(x + 2, y + 1)
+            pdf.set_font('Arial', 'B', 8)
+            pdf.cell(cell_w - 4, 4, entry.name[:60], 0, 2, 'L')
+            pdf.set_font('Arial', '', 7)
+            pdf.cell(cell_w - 4, 4, f"{entry.worst_conclusion} | {entry.wsp_status}", 0, 0, 'L')
+            image_w, image_h = cell_w - 4, cell_h - 14
+            scale = min(image_w / width_px, image_h / height_px)
+            pdf.image_from_bytes(png, x=x + 2, y=y + 10, w=width_px * scale, h=height_px * scale)
+        _append(self._gallery, _pdf_bytes(pdf))
+        self._thumbnails = []
+
+    def _index_pdf(self, first_detail_page):
+        pdf = FleetPDF()
+        pdf.add_page()
+        pdf.add_heading('Fleet Index', level=1)
+        analyzed = [e for e in self.entries if e.page is not None]
+        affected = sum(1 for e in analyzed if e.axles_affected)
+        failed = len(self.entries) - len(analyzed)
+        pdf.add_paragraph(f"{len(self.entries)} recordings: {affected} with affected axles, "
+                          f"{len(analyzed) - affected} normal, {failed} not analyzed.")
+        rows = []
+        for number, entry in enumerate(self.entries, 1):
+            axles = ", ".join(str(a) for a in entry.axles_affected) or "None"
+            page = str(first_detail_page + entry.page) if entry.page is not None else "-"
+            if entry.page is None:
+                axles, wsp_status, worst = "-", "-", entry.status
+            else:
+                wsp_status, worst = entry.wsp_status, entry.worst_conclusion
+            rows.append([str(number), entry.name, entry.graph_period, axles, wsp_status, worst, page])
+        pdf.add_table(["No.", "Recording", "Graph Period", "Axles Affected", "WSP Status",
+                       "Worst Conclusion", "Page"], rows)
+        return _pdf_bytes(pdf)
+
+    def write(self, out):
+        """Assemble cover, index, thumbnails and details into ``out`` (path or binary file)"""
+        self._flush_gallery()
+
+        cover = FleetPDF()
+        generated_time = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+        add_cover_page(cover, self.title, [
+            f'Generated Time : {generated_time}',
+            f'Recordings : {len(self.entries)}',
+        ])
+
+        # Index page numbers depend on the index's own length; settle it before assembling
+        index_pages = 1
+        while True:
+            first_detail_page = 1 + index_pages + self._gallery.page_count + 1
+            index_data = self._index_pdf(first_detail_page)
+            with fitz.open(stream=index_data, filetype="pdf") as index_doc:
+                if index_doc.page_count == index_pages:
+                    break
+                index_pages = index_doc.page_count
+
+        document = fitz.open()
+        _append(document, _pdf_bytes(cover))
+        _append(document, index_data)
+        toc = [[1, "Cover", 1], [1, "Fleet Index", 2]]
+        if self._gallery.page_count:
+            toc.append([1, "Graph Thumbnails", document.page_count + 1])
+            document.insert_pdf(self._gallery)
+        if self._details.page_count:
+            toc.append([1, "Recordings", document.page_count + 1])
+            toc += [[2, e.name, first_detail_page + e.page] for e in self.entries if e.page is not None]
+            document.insert_pdf(self._details)
+        document.set_toc(toc)
+
+        for page in document.pages(1):
+            label = f"WSP Fleet Report - Page {page.number + 1}"
+            width = fitz.get_text_length(label, fontname="helv", fontsize=8)
+            page.insert_text((page.rect.width - 28 - width, 28), label,
+                             fontname="helv", fontsize=8, color=(0.5, 0.5, 0.5))
+
+        if isinstance(out, str):
+            document.save(out, garbage=3, deflate=True)
+        else:
+            out.write(document.tobytes(garbage=3, deflate=True))
+        document.close()
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        self.write(buffer)
+        return buffer.getvalue()
+
+    def close(self):
+        self._details.close()
+        self._gallery.close()
+
+
+def build_fleet_report(results, out=None, title="WSP FLEET SUMMARY"):
+    """Consolidated PDF of many results; writes to ``out`` if given, else returns the bytes"""
+    builder = FleetReportBuilder(title)
+    try:
+        for result in results:
+            builder.add(result)
+        if out is None:
+            return builder.to_bytes()
+        builder.write(out)
+    finally:
+        builder.close()
+
+
+# --- CLI ---
+def main(argv=None):
+    from analyzer import configure
+    from batch import DEFAULT_RPM, DEFAULT_WORKERS, iter_pdf_files, run_batch
+    from result_cache import ResultCache
+
+    parser = argparse.ArgumentParser(description="Analyze many WSP graph PDFs into one fleet report")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories containing PDFs")
+    parser.add_argument("--out", default="WSP_Fleet_Report.pdf", help="PDF file to write")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent model calls")
+    parser.add_argument("--rpm", type=float, default=DEFAULT_RPM, help="Max model requests per minute")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the result cache")
+    args = parser.parse_args(argv)
+
+    if not configure():
+        parser.error("set GEMINI_API_KEY in the environment")
+    cache = None if args.no_cache else ResultCache()
+    results = run_batch(iter_pdf_files(args.paths), workers=args.workers,
+                        requests_per_minute=args.rpm, cache=cache)
+    build_fleet_report(results, args.out)
+    print(f"Wrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""Queryable history of past WSP analyses.
+
+Every finished analysis is recorded in an embedded SQLite database: the PDF
+hash, the graph period and, per axle, the conclusion and WSP status from the
+two report tables. Per-axle rows are indexed on (axle, conclusion, period)
+and (axle, status, period), so questions like "every recording where Axle 3
+was Severely Affected last month" are answered from an index range scan.
+
+Unlike the result cache, nothing here is evicted.
+
+Usage:
+    python history.py query --axle 3 --conclusion "Severely Affected" --days 30
+    python history.py trend --axle 3 --by month
+    python history.py import-cache
+    python history.py stats
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from datetime import datetime, timedelta
+
+from multipage import DATE_PATTERN
+from report_schema import AXLES, AnalysisReport
+from result_cache import DEFAULT_CACHE_DIR
+
+DEFAULT_HISTORY_PATH = os.getenv("WSP_HISTORY_DB", os.path.join(DEFAULT_CACHE_DIR, "history.sqlite"))
+
+ISO_FORMAT = "%Y-%m-%d %H:%M:%S"
+TREND_BUCKETS = {
+    "day": "substr(r.period_start, 1, 10)",
+    "week": "strftime('%Y-W%W', r.period_start)",
+    "month": "substr(r.period_start, 1, 7)",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    pdf_sha256 TEXT NOT NULL UNIQUE,
+    file_name TEXT,
+    graph_period TEXT,
+    period_start TEXT,
+    period_end TEXT,
+    engine TEXT,
+    analyzed_at REAL NOT NULL,
+    report TEXT NOT NULL
+);
+-- period_start is copied here so per-axle queries are answered by one index
+CREATE TABLE IF NOT EXISTS axle_results (
+    analysis_id INTEGER NOT NULL REFERENCES analyses(id) ON DELETE CASCADE,
+    axle INTEGER NOT NULL,
+    conclusion TEXT NOT NULL,
+    wsp_status TEXT NOT NULL,
+    period_start TEXT,
+    PRIMARY KEY (analysis_id, axle)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_analyses_period ON analyses(period_start);
+CREATE INDEX IF NOT EXISTS idx_axle_conclusion ON axle_results(axle, conclusion, period_start);
+CREATE INDEX IF NOT EXISTS idx_axle_status ON axle_results(axle, wsp_status, period_start);
+"""
+
+_INSERT_AXLES = (
+    "INSERT INTO axle_results (analysis_id, axle, conclusion, wsp_status, period_start) "
+    "SELECT id, ?, ?, ?, period_start FROM analyses WHERE pdf_sha256 = ?"
+)
+
+
+def period_bounds(graph_period):
+    """(start, end) of a graph period as sortable ISO strings; None where unknown"""
+    dates = re.findall(DATE_PATTERN, graph_period or "")
+    times = [datetime.strptime(" ".join(d.split()), "%d.%m.%y %H:%M:%S").strftime(ISO_FORMAT)
+             for d in (dates[:1] + dates[-1:])]
+    return (times[0], times[-1]) if times else (None, None)
+
+
+def _iso(value):
+    if value is None or isinstance(value, str):
+        return value
+    return value.strftime(ISO_FORMAT)
+
+
+class AnalysisHistory:
+    """SQLite store of analysis results with per-axle indexes"""
+
+    def __init__(self, path=DEFAULT_HISTORY_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    # --- Writing ---
+    def add(self, pdf_sha256, file_name, graph_period, report, engine=None):
+        """Record one analysis, replacing an earlier one of the same PDF"""
+        return self.add_many([(pdf_sha256, file_name, graph_period, report, engine)])
+
+    def add_many(self, records):
+        """Record (pdf_sha256, file_name, graph_period, report, engine) tuples in one transaction"""
+        analyses, axle_rows = {}, {}
+        now = time.time()
+        for pdf_sha256, file_name, graph_period, report, engine in records:
+            start, end = period_bounds(graph_period)
+            analyses[pdf_sha256] = (pdf_sha256, file_name, graph_period, start, end, engine, now,
+                                    report.to_json())
+            status = {row.axle: row.status for row in report.wsp}
+            axle_rows[pdf_sha256] = [(row.axle, row.conclusion, status.get(row.axle, "-"), pdf_sha256)
+                                     for row in report.axles]
+        if not analyses:
+            return 0
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("DELETE FROM analyses WHERE pdf_sha256 = ?", [(key,) for key in analyses])
+            conn.executemany(
+                "INSERT INTO analyses (pdf_sha256, file_name, graph_period, period_start, "
+                "period_end, engine, analyzed_at, report) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", analyses.values(),
+            )
+            conn.executemany(_INSERT_AXLES, (row for rows in axle_rows.values() for row in rows))
+        return len(analyses)
+
+    def add_results(self, results):
+        """Record the successful, newly analyzed BatchResults of a batch run"""
+        return self.add_many(
+            (r.pdf_sha256, r.name, r.graph_period, r.report, r.engine)
+            for r in results if r.ok and not r.cached and r.report is not None and r.pdf_sha256
+        )
+
+    def import_cache(self, cache):
+        """Record every report held in a ResultCache; returns the number imported"""
+        return self.add_many(
+            (pdf_sha256, None, graph_period, AnalysisReport.from_json(data), "Cache")
+            for pdf_sha256, graph_period, data in cache.artifacts_named("report.json")
+        )
+
+    # --- Queries ---
+    def find(self, axle=None, conclusion=None, wsp_status=None, since=None, until=None, limit=1000):
+        """Per-axle matches, newest recording first; since/until are datetimes or ISO strings"""
+        clauses, params = [], []
+        if axle is None:
+            # Keeps the leading index column constrained when no axle is given
+            clauses.append(f"r.axle IN ({', '.join('?' * len(AXLES))})")
+            params += AXLES
+        else:
+            clauses.append("r.axle = ?")
+            params.append(int(axle))
+        if conclusion:
+            clauses.append("r.conclusion = ?")
+            params.append(conclusion)
+        if wsp_status:
+            clauses.append("r.wsp_status = ?")
+            params.append(wsp_status)
+        if since is not None:
+            clauses.append("r.period_start >= ?")
+            params.append(_iso(since))
+        if until is not None:
+            clauses.append("r.period_start < ?")
+            params.append(_iso(until))
+        params.append(int(limit))
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "SELECT a.file_name, a.graph_period, r.period_start, r.axle, r.conclusion, r.wsp_status, "
+                "a.engine, a.pdf_sha256 FROM axle_results r JOIN analyses a ON a.id = r.analysis_id "
+                f"WHERE {' AND '.join(clauses)} ORDER BY r.period_start DESC LIMIT ?", params,
+            )
+            columns = [c[0] for c in cur.description]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    def trend(self, axle=None, by="month", field="conclusion", since=None, until=None):
+        """Counts of each conclusion (or WSP status) per day/week/month of recording"""
+        if by not in TREND_BUCKETS:
+            raise ValueError(f"by must be one of {', '.join(TREND_BUCKETS)}")
+        if field not in ("conclusion", "wsp_status"):
+            raise ValueError("field must be 'conclusion' or 'wsp_status'")
+        clauses, params = ["r.period_start IS NOT NULL"], []
+        if axle is not None:
+            clauses.append("r.axle = ?")
+            params.append(int(axle))
+        if since is not None:
+            clauses.append("r.period_start >= ?")
+            params.append(_iso(since))
+        if until is not None:
+            clauses.append("r.period_start < ?")
+            params.append(_iso(until))
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                f"SELECT {TREND_BUCKETS[by]} AS period, r.{field} AS value, COUNT(*) AS count "
+                f"FROM axle_results r WHERE {' AND '.join(clauses)} GROUP BY period, value ORDER BY period",
+                params,
+            )
+            return [{"period": period, field: value, "count": count} for period, value, count in cur.fetchall()]
+
+    def report(self, pdf_sha256):
+        """The stored AnalysisReport of one recording, or None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT report FROM analyses WHERE pdf_sha256 = ?", (pdf_sha256,)).fetchone()
+        return AnalysisReport.from_json(row[0]) if row else None
+
+    def count(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+
+# --- CLI ---
+def _time_range(args):
+    since = datetime.strptime(args.since, "%Y-%m-%d") if args.since else None
+    if args.days is not None:
+        since = datetime.now() - timedelta(days=args.days)
+    until = datetime.strptime(args.until, "%Y-%m-%d") + timedelta(days=1) if args.until else None
+    return since, until
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the history of WSP analyses")
+    parser.add_argument("--db", default=DEFAULT_HISTORY_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    query = sub.add_parser("query", help="List recordings matching an axle, conclusion or status")
+    trend = sub.add_parser("trend", help="Count conclusions per day, week or month")
+    for p in (query, trend):
+        p.add_argument("--axle", type=int, choices=AXLES)
+        p.add_argument("--since", help="First recording day (YYYY-MM-DD)")
+        p.add_argument("--until", help="Last recording day (YYYY-MM-DD)")
+        p.add_argument("--days", type=float, help="Only recordings from the last DAYS days")
+    query.add_argument("--conclusion")
+    query.add_argument("--status", help="WSP system status")
+    query.add_argument("--limit", type=int, default=100)
+    trend.add_argument("--by", choices=list(TREND_BUCKETS), default="month")
+    trend.add_argument("--status", action="store_true", help="Count WSP statuses instead of conclusions")
+    importer = sub.add_parser("import-cache", help="Record every report in the result cache")
+    importer.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    sub.add_parser("stats", help="Show the number of recorded analyses")
+    args = parser.parse_args(argv)
+
+    history = AnalysisHistory(args.db)
+    if args.command == "query":
+        since, until = _time_range(args)
+        started = time.perf_counter()
+        rows = history.find(args.axle, args.conclusion, args.status, since, until, args.limit)
+        for row in rows:
+            print(f"{row['period_start'] or '-':<19}  Axle {row['axle']}  {row['conclusion']:<20} "
+                  f"{row['wsp_status']:<22} {row['file_name'] or row['pdf_sha256'][:16]}")
+        print(f"{len(rows)} rows in {(time.perf_counter() - started) * 1000:.1f} ms")
+    elif args.command == "trend":
+        since, until = _time_range(args)
+        field = "wsp_status" if args.status else "conclusion"
+        for row in history.trend(args.axle, args.by, field, since, until):
+            print(f"{row['period']:<10} {row[field]:<28} {row['count']:>7}")
+    elif args.command == "import-cache":
+        from result_cache import ResultCache
+        imported = history.import_cache(ResultCache(args.cache_dir))
+        print(f"Imported {imported} report{'' if imported == 1 else 's'}")
+    elif args.command == "stats":
+        print(f"History db : {os.path.abspath(history.path)}")
+        print(f"Analyses   : {history.count()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
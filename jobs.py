@@ -0,0 +1,301 @@
+"""Analysis jobs: the single-report pipeline behind the app and the service.
+
+A job runs the whole pipeline (cache lookup, per-page ingestion, rules fast
+path, streamed model call, merge). Before ingesting, a job reserves the
+memory its largest page takes from the process budget and waits its turn
+while other analyses use it up (see memory_budget.py). The TXT and PDF
+downloads are built only when first asked for and then kept with the job
+and in the result cache, so the report is on screen without waiting for
+FPDF; the graph of a raw recording is likewise only drawn once something
+shows or embeds it.
+
+The Streamlit app runs jobs on a worker thread, so the script thread returns
+straight away and the page polls the job for streamed text; the headless
+service simply calls ``job.run()``. Cancelling a job aborts the model
+request in flight.
+
+Jobs for the same recording that overlap (several operators or tabs
+uploading it after a fault report) are coalesced: the first one runs the
+pipeline and every later one waits on its shared future, mirroring its
+streamed text, and takes over its result. The registry is per process, so
+it spans every Streamlit session and every request of a service worker.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+import metrics
+from analyzer import MODEL_NAME, estimate_memory, graph_png, iter_pages, recording_png, stream_report
+from classifier import fast_path_report
+from memory_budget import BUDGET
+from multipage import PageReport, merge_page_reports, recording_period
+from recorder_data import is_recorder_data
+from report_schema import AnalysisReport, parse_report, to_markdown
+from reports import ReportArtifacts
+from result_cache import cache_key
+from scheduler import ModelUnavailable
+from slip_analysis import with_measurements
+from stages import pipeline_fingerprint
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# --- In-Flight Registry ---
+_in_flight = {}  # result cache key (fast path setting included) -> (leader AnalysisJob, Future of the leader)
+_in_flight_lock = threading.Lock()
+
+
+def _claim(key, job):
+    """(leader, future) for the key; the job itself is the leader when nothing was in flight"""
+    with _in_flight_lock:
+        entry = _in_flight.get(key)
+        if entry is None:
+            entry = _in_flight[key] = (job, Future())
+        return entry
+
+
+def _release(key, job):
+    with _in_flight_lock:
+        if _in_flight.get(key, (None,))[0] is job:
+            del _in_flight[key]
+
+
+def in_flight_count():
+    """Recordings being analyzed right now in this process"""
+    with _in_flight_lock:
+        return len(_in_flight)
+
+
+class AnalysisJob:
+    """One report being generated in the background; safe to poll from any thread"""
+
+    def __init__(self, pdf_bytes, file_name, cache=None, fast_path=True, model_name=MODEL_NAME, history=None):
+        self.id = uuid.uuid4().hex
+        self.file_name = file_name
+        self.pdf_bytes = pdf_bytes
+        self.cache = cache
+        self.history = history
+        self.fast_path = fast_path
+        self.model_name = model_name
+        self.created = time.time()
+
+        self.status = QUEUED
+        self.progress = "Waiting to start..."
+        self.error = None
+        self.from_cache = False
+        self.coalesced = False  # result taken over from a concurrent job for the same recording
+        self.rules_only = False
+        self.graph_period = "Not Available"
+        self.report = None
+        self.pdf_sha256 = None
+        self.artifacts = None  # ReportArtifacts, once the report exists
+        self.trace = None  # metrics.Trace of the run, for the debug panel
+        self.answered_by = set()  # models that answered its pages; a fallback's report is not cached
+
+        self._partial = []
+        self._png = None  # first page's PNG bytes, or a callable drawing a recording's graph
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+
+    # --- Polling API ---
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def partial_report(self):
+        with self._lock:
+            return "".join(self._partial)
+
+    def cancel(self):
+        self._cancel.set()
+
+    # --- Downloads (built on first access) ---
+    @property
+    def png_bytes(self):
+        return self.artifacts.get("graph.png") if self.artifacts else None
+
+    @property
+    def text_content(self):
+        return self.artifacts.get("report.txt") if self.artifacts else None
+
+    @property
+    def pdf_data(self):
+        return self.artifacts.get("report.pdf") if self.artifacts else None
+
+    @property
+    def pdf_error(self):
+        return self.artifacts.errors.get("report.pdf") if self.artifacts else None
+
+    # --- Worker ---
+    def _set_progress(self, message):
+        with self._lock:
+            self.progress = message
+
+    def _append(self, text):
+        with self._lock:
+            self._partial.append(text)
+
+    def _check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def run(self):
+        self.status = RUNNING
+        try:
+            with metrics.trace(self.file_name) as self.trace:
+                self._run()
+            self.status = DONE
+        except JobCancelled:
+            self.status = CANCELLED
+            self.progress = "Cancelled"
+        except ModelUnavailable as e:
+            self.error = str(e)
+            self.status = FAILED
+        except Exception as e:
+            self.error = f"An error occurred: {e}"
+            self.status = FAILED
+        finally:
+            self.pdf_bytes = None
+
+    def _run(self):
+        key, key_parts = cache_key(self.pdf_bytes, pipeline_fingerprint(fast_path=self.fast_path), self.model_name)
+        self.pdf_sha256 = key_parts[0]
+        while True:
+            leader, future = _claim(key, self)
+            if leader is self:
+                break
+            if self._follow(leader, future):
+                return
+            # The leader was cancelled by its own user; run (or follow) again
+        try:
+            self._analyze(key, key_parts)
+            future.set_result(self)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            _release(key, self)
+
+    def _follow(self, leader, future):
+        """Wait for a concurrent job of the same recording and take over its result
+
+        Returns False when the leader was cancelled; raises the leader's error.
+        """
+        metrics.count("coalesced_requests")
+        while not future.done():
+            self._check_cancelled()
+            with self._lock:
+                self.progress = leader.progress
+                self._partial = [leader.partial_report]
+            self._cancel.wait(0.1)
+        if isinstance(future.exception(), JobCancelled):
+            return False
+        future.result()
+        for name in ("graph_period", "report", "artifacts", "from_cache", "rules_only", "answered_by"):
+            setattr(self, name, getattr(leader, name))
+        self._partial = [leader.partial_report]
+        self.coalesced = True
+        return True
+
+    def _analyze(self, key, key_parts):
+        cached = self.cache.get(key) if self.cache else None
+        hit = cached is not None and "report.json" in cached["artifacts"]
+        if self.cache:
+            metrics.count("cache_requests", result="hit" if hit else "miss")
+        if hit:
+            artifacts = cached["artifacts"]
+            self.graph_period = cached["graph_period"] or "Not Available"
+            self.report = AnalysisReport.from_json(artifacts["report.json"])
+            self._png = artifacts.get("graph.png")
+            if self._png is None and is_recorder_data(self.pdf_bytes):
+                self._png = recording_png(self.pdf_bytes)  # never drawn when it was analyzed
+            built = {"report.pdf": artifacts.get("report.pdf")}
+            if "report.txt" in artifacts:
+                built["report.txt"] = artifacts["report.txt"].decode("utf-8")
+            self._attach_artifacts(key, built)
+            self.from_cache = True
+            return
+
+        # Pages are rendered one at a time; wait until the largest fits in the process budget
+        with BUDGET.reserve(estimate_memory(self.pdf_bytes), check=self._check_cancelled,
+                            on_wait=lambda: self._set_progress("Waiting for memory (other analyses running)...")):
+            page_reports = self._analyze_pages()
+
+        if not page_reports:
+            raise ValueError("Could not extract image from PDF")
+        self._set_progress("Building report...")
+        self.graph_period = recording_period(page_reports)
+        self.rules_only = all(p.engine == "Rules" for p in page_reports)
+        engines = {p.engine for p in page_reports}
+        engine = engines.pop() if len(engines) == 1 else "Mixed"
+        with metrics.span("merge"):
+            self.report = merge_page_reports(page_reports)
+
+        # The key names the requested model; a fallback's answer must not be served as its result
+        cacheable = self.cache is not None and self.answered_by <= {self.model_name}
+        if cacheable:
+            self.cache.put(key, key_parts, self.graph_period, {
+                "report.json": self.report.to_json(),
+                "report.md": to_markdown(self.report),
+                "graph.png": None if callable(self._png) else self._png,  # a drawn graph is added when built
+            })
+        elif self.cache:
+            metrics.count("cache_skipped", reason="fallback_model")
+        self._attach_artifacts(key, cached=cacheable)
+        if self.history:
+            self.history.add(self.pdf_sha256, self.file_name, self.graph_period, self.report, engine)
+
+    def _analyze_pages(self):
+        """Ingest each page in turn, reporting it by the rules or a streamed model call"""
+        page_reports = []
+        for graph in iter_pages(self.pdf_bytes):
+            self._check_cancelled()
+            page_label = f"page {graph.page_number + 1} of {graph.page_count}"
+            page_report, engine = None, "Rules"
+            if self.fast_path:
+                page_report = fast_path_report(graph.traces)
+            if not page_report:
+                engine = "Gemini"
+                self._set_progress(f"Analyzing {page_label} with Gemini...")
+                if graph.page_count > 1:
+                    self._append(f"\n\n--- Page {graph.page_number + 1} ---\n\n")
+                chunks = []
+                for text in stream_report(graph.image, self.model_name, graph.traces, self._cancel,
+                                          self.answered_by.add):
+                    chunks.append(text)
+                    self._append(text)
+                self._check_cancelled()
+                with metrics.span("parse"):
+                    page_report = parse_report("".join(chunks))
+                page_report = with_measurements(page_report, graph.traces)
+            metrics.count("pages", engine=engine)
+            page_reports.append(PageReport(graph.page_number, graph.graph_period, page_report, engine))
+            if graph.page_number == 0:
+                self._png = graph_png(graph)  # a recording's graph is drawn only when something shows it
+            del graph
+        return page_reports
+
+    def _attach_artifacts(self, key, built=None, cached=True):
+        """Lazy PNG/TXT/PDF downloads; each one built is added to the cached entry"""
+        cache = self.cache
+        on_build = (lambda name, data: cache.add_artifact(key, name, data)) if cache and cached else None
+        self.artifacts = ReportArtifacts(self.report, self._png, self.graph_period, built, on_build)
+
+
+def start_job(job, executor=None):
+    """Run a job on the shared executor (or a daemon thread) and return it"""
+    if executor is not None:
+        executor.submit(job.run)
+    else:
+        threading.Thread(target=job.run, name=f"wsp-job-{job.id[:8]}", daemon=True).start()
+    return job
@@ -0,0 +1,111 @@
+"""Per-process memory budget for analysis jobs.
+
+Rendering a page is the one step whose memory grows with the input: a long
+high-DPI recording is a bitmap of tens of megapixels, plus the working
+arrays of trace extraction and the model image. Every job reserves what its
+largest page will take before ingesting and holds it until the last model
+call returns. While the budget is used up, new jobs wait in arrival order
+instead of rendering anyway and taking the process (and every other session
+in it) down. A job larger than the whole budget runs once it has the
+process to itself.
+
+Configuration (environment):
+    WSP_MEMORY_BUDGET_MB  bytes all jobs of a process may reserve (default 1024, 0: no limit)
+
+Usage:
+    python memory_budget.py estimate graph.pdf recording.csv
+"""
+import argparse
+import itertools
+import os
+import sys
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import metrics
+
+DEFAULT_BUDGET_MB = 1024
+MB = 1024 * 1024
+
+
+class MemoryBudget:
+    """Reservations against a byte limit, granted first come, first served"""
+
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes or 0  # 0: unlimited
+        self.reserved = 0
+        self._queue = deque()
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_env(cls):
+        return cls(int(float(os.getenv("WSP_MEMORY_BUDGET_MB", str(DEFAULT_BUDGET_MB))) * MB))
+
+    @property
+    def waiting(self):
+        with self._cond:
+            return len(self._queue)
+
+    def _fits(self, nbytes):
+        return not self.limit or self.reserved == 0 or self.reserved + nbytes <= self.limit
+
+    @contextmanager
+    def reserve(self, nbytes, check=None, on_wait=None):
+        """Hold ``nbytes`` for the with-block, waiting while earlier requests or the limit block it
+
+        ``check()`` is called while waiting and may raise to give up (e.g. a
+        cancelled job); ``on_wait()`` is called once if the request has to wait.
+        """
+        ticket = next(self._sequence)
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                if self._queue[0] != ticket or not self._fits(nbytes):
+                    metrics.count("memory_waits")
+                    if on_wait:
+                        on_wait()
+                    with metrics.span("memory_wait"):
+                        while self._queue[0] != ticket or not self._fits(nbytes):
+                            if check:
+                                check()
+                            self._cond.wait(0.1 if check else None)
+                self.reserved += nbytes
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.reserved -= nbytes
+                self._cond.notify_all()
+
+    def status(self):
+        with self._cond:
+            return {"limit_mb": round(self.limit / MB, 1), "reserved_mb": round(self.reserved / MB, 1),
+                    "waiting": len(self._queue)}
+
+
+BUDGET = MemoryBudget.from_env()
+
+
+# --- CLI ---
+def main(argv=None):
+    from analyzer import estimate_memory
+
+    parser = argparse.ArgumentParser(description="Memory a job reserves for each input")
+    sub = parser.add_subparsers(dest="command", required=True)
+    estimate = sub.add_parser("estimate", help="Show the reservation of PDFs or recorder exports")
+    estimate.add_argument("paths", nargs="+")
+    args = parser.parse_args(argv)
+
+    print(f"Budget: {BUDGET.limit / MB:.0f} MB per process")
+    for path in args.paths:
+        print(f"{path}: {estimate_memory(path) / MB:.1f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
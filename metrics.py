@@ -0,0 +1,218 @@
+"""Stage timings and counters for the analysis pipeline.
+
+Code wraps each stage in ``span("stage")`` and counts events with
+``count("name", value, label=...)``. Every observation goes to the
+process-wide ``REGISTRY`` (rendered in the Prometheus text format by the
+service's /metrics endpoint) and, when an analysis is running under
+``trace()``, to that analysis' ``Trace`` as well, which backs the app's debug
+panel. Set ``WSP_METRICS_LOG`` to a file path to append every finished trace
+to it as one JSON line.
+
+Stages: memory_wait, ingest, rasterize, render_recording, extract_traces,
+prepare_image, model_queue, model_upload, model_first_token, model_total,
+parse, merge, text_report, pdf_build.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_LOG = os.getenv("WSP_METRICS_LOG")
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP = {
+    "wsp_stage_seconds": ("histogram", "Time spent in each pipeline stage"),
+    "wsp_cache_requests_total": ("counter", "Result cache lookups by result"),
+    "wsp_cache_skipped_total": ("counter", "Reports left out of the result cache by reason"),
+    "wsp_pages_total": ("counter", "Analyzed pages by engine"),
+    "wsp_model_image_bytes_total": ("counter", "Image bytes sent to the model"),
+    "wsp_model_tokens_total": ("counter", "Model tokens by kind"),
+    "wsp_stage_requests_total": ("counter", "Stored stage output lookups by stage and result"),
+    "wsp_model_requests_total": ("counter", "Model requests by model and result"),
+    "wsp_model_fallbacks_total": ("counter", "Requests answered by a fallback model"),
+    "wsp_coalesced_requests_total": ("counter", "Analyses that waited on a concurrent one of the same recording"),
+    "wsp_memory_waits_total": ("counter", "Analyses queued until the process memory budget had room"),
+}
+
+
+def _label_text(labels):
+    return ",".join(f'{k}="{v}"' for k, v in labels)
+
+
+class Registry:
+    """Thread-safe counters and stage histograms"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * len(self.buckets) + [0, 0.0]  # buckets, count, sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += value
+
+    def stage_summary(self):
+        """{stage: (count, total seconds)} for the debug panel"""
+        with self._lock:
+            return {dict(labels)["stage"]: (h[-2], h[-1]) for (name, labels), h in self._histograms.items()
+                    if name == "wsp_stage_seconds"}
+
+    def counters(self):
+        with self._lock:
+            return {name + ("{" + _label_text(labels) + "}" if labels else ""): value
+                    for (name, labels), value in sorted(self._counters.items())}
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(h)) for key, h in self._histograms.items())
+        lines, described = [], set()
+
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                kind, text = METRIC_HELP.get(name, ("untyped", name))
+                lines.extend([f"# HELP {name} {text}", f"# TYPE {name} {kind}"])
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{name}{{{_label_text(labels)}}} {value}" if labels else f"{name} {value}")
+        for (name, labels), histogram in histograms:
+            describe(name)
+            label_text = _label_text(labels)
+            prefix = label_text + "," if label_text else ""
+            for bound, bucket_count in zip(self.buckets, histogram):
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {bucket_count}')
+            lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram[-2]}')
+            lines.append(f"{name}_sum{{{label_text}}} {histogram[-1]:.6f}")
+            lines.append(f"{name}_count{{{label_text}}} {histogram[-2]}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Trace:
+    """Spans and counts of one analysis"""
+
+    def __init__(self, name):
+        self.name = name
+        self.created = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, stage, start, seconds):
+        with self._lock:
+            self.spans.append({"stage": stage, "start": round(start, 4), "seconds": round(seconds, 4)})
+
+    def add_count(self, key, value):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def stage_totals(self):
+        """{stage: seconds} summed over repeated spans (e.g. one per page)"""
+        totals = {}
+        with self._lock:
+            for span_data in self.spans:
+                totals[span_data["stage"]] = totals.get(span_data["stage"], 0.0) + span_data["seconds"]
+        return totals
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "created": self.created,
+                "seconds": round(time.perf_counter() - self.started, 4),
+                "spans": list(self.spans),
+                "counts": dict(self.counts),
+            }
+
+
+_current_trace = contextvars.ContextVar("wsp_trace", default=None)
+_enabled = contextvars.ContextVar("wsp_metrics_enabled", default=True)
+_log_lock = threading.Lock()
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def disabled():
+    """Record nothing from the block, e.g. warm-up runs on synthetic input"""
+    token = _enabled.set(False)
+    try:
+        yield
+    finally:
+        _enabled.reset(token)
+
+
+@contextmanager
+def trace(name, log_path=None):
+    """Collect the spans of everything run inside the block into a new Trace"""
+    active = Trace(name)
+    token = _current_trace.set(active)
+    try:
+        yield active
+    finally:
+        _current_trace.reset(token)
+        write_log(active, log_path)
+
+
+def write_log(active, log_path=None):
+    log_path = log_path or METRICS_LOG
+    if not log_path:
+        return
+    line = json.dumps(active.to_dict(), separators=(",", ":"))
+    with _log_lock, open(log_path, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+def record_span(stage, seconds, started=None):
+    """Record a stage timed by the caller (e.g. time to first token)"""
+    if not _enabled.get():
+        return
+    REGISTRY.observe("wsp_stage_seconds", seconds, stage=stage)
+    active = _current_trace.get()
+    if active is not None:
+        start = (started if started is not None else time.perf_counter() - seconds) - active.started
+        active.add_span(stage, start, seconds)
+
+
+@contextmanager
+def span(stage):
+    """Time the block as one pipeline stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - started, started)
+
+
+def count(name, value=1, **labels):
+    """Add to the ``wsp_<name>_total`` counter and the current trace's counts"""
+    if not value or not _enabled.get():
+        return
+    REGISTRY.inc(f"wsp_{name}_total", value, **labels)
+    active = _current_trace.get()
+    if active is not None:
+        active.add_count(".".join([name, *map(str, labels.values())]), value)
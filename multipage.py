@@ -0,0 +1,141 @@
+"""Merge per-page analyses of a long recording into one report.
+
+Each page of a multi-page recorder PDF is analyzed on its own (and released
+before the next is loaded). The page reports are combined here into a single
+report in the usual format, with anomaly phases shifted onto one timeline
+that spans the whole recording.
+"""
+import re
+from dataclasses import dataclass
+from datetime import datetime
+
+from report_schema import (
+    CANNOT_DETERMINE,
+    CONCLUSIONS,
+    WSP_STATUSES,
+    AnalysisReport,
+    AxleRow,
+    TimelineRow,
+)
+
+DATE_PATTERN = r'\d{2}\.\d{2}\.\d{2}\s+\d{2}:\d{2}:\d{2}'
+
+# Severity order; "Cannot determine" is left out and ranks just above the best case
+CONCLUSION_RANK = [c for c in CONCLUSIONS if c != CANNOT_DETERMINE]
+WSP_STATUS_RANK = [s for s in WSP_STATUSES if s != CANNOT_DETERMINE]
+
+
+@dataclass
+class PageReport:
+    page_number: int
+    graph_period: str
+    report: AnalysisReport
+    engine: str = "Gemini"
+
+
+def _rank(value, order):
+    """Severity of a status value; unknown values rank just above the best case"""
+    return order.index(value) if value in order else 0.5
+
+
+def _worst(values, order):
+    return max(values, key=lambda v: _rank(v, order), default=None)
+
+
+def summarize_report(report):
+    """Fleet index fields of one report: affected axles, worst WSP status and conclusion"""
+    affected = [row.axle for row in report.axles if _rank(row.conclusion, CONCLUSION_RANK) > 0]
+    return {
+        "axles_affected": sorted(set(affected)),
+        "wsp_status": _worst([row.status for row in report.wsp], WSP_STATUS_RANK) or "Not Available",
+        "worst_conclusion": _worst([row.conclusion for row in report.axles], CONCLUSION_RANK) or "Not Available",
+    }
+
+
+# --- Timeline ---
+def _parse_time(text):
+    return datetime.strptime(" ".join(text.split()), "%d.%m.%y %H:%M:%S")
+
+
+def recording_period(page_reports):
+    """Whole-recording period: first page's start to last page's end"""
+    dates = [d for p in page_reports for d in re.findall(DATE_PATTERN, p.graph_period or "")]
+    if len(dates) >= 2:
+        return f"{dates[0]} to {dates[-1]}"
+    return dates[0] if dates else "Not Available"
+
+
+def page_offsets(page_reports):
+    """Seconds from the recording start to each page's start (None if unknown)"""
+    starts = []
+    for p in page_reports:
+        dates = re.findall(DATE_PATTERN, p.graph_period or "")
+        starts.append(_parse_time(dates[0]) if dates else None)
+    origin = next((s for s in starts if s), None)
+    return [(s - origin).total_seconds() if s and origin else None for s in starts]
+
+
+def shift_phase(phase, offset, page_number):
+    """Move 'x.xxs' times in a phase description onto the recording timeline"""
+    if phase.strip().lower() in ("none", "", "-"):
+        return None
+    if offset is None:
+        return f"Page {page_number + 1}: {phase}"
+    return re.sub(r'(\d+(?:\.\d+)?)\s*s\b', lambda m: f"{float(m.group(1)) + offset:.2f}s", phase)
+
+
+# --- Merge ---
+def _first_sentence(text):
+    text = " ".join(text.split())
+    return text.split(". ")[0].rstrip(".") + "." if text else "No summary available."
+
+
+def merge_page_reports(page_reports):
+    """Combine page reports into one AnalysisReport covering the whole recording"""
+    if len(page_reports) == 1:
+        return page_reports[0].report
+
+    offsets = page_offsets(page_reports)
+    axle_rows, wsp_rows, phases, timeline = {}, {}, {}, []
+    for page, offset in zip(page_reports, offsets):
+        report = page.report
+        for row in report.axles:
+            shifted = shift_phase(row.phase, offset, page.page_number)
+            if shifted:
+                phases.setdefault(row.axle, []).append(shifted)
+            if row.axle not in axle_rows or (_rank(row.conclusion, CONCLUSION_RANK)
+                                             > _rank(axle_rows[row.axle].conclusion, CONCLUSION_RANK)):
+                axle_rows[row.axle] = row
+        for row in report.wsp:
+            if row.axle not in wsp_rows or _rank(row.status, WSP_STATUS_RANK) > _rank(wsp_rows[row.axle].status,
+                                                                                      WSP_STATUS_RANK):
+                wsp_rows[row.axle] = row
+        worst = _worst([row.conclusion for row in report.axles], CONCLUSION_RANK) or "Normal Operation"
+        timeline.append(TimelineRow(page.page_number + 1, page.graph_period, offset, worst, page.engine))
+
+    period = recording_period(page_reports)
+    summary = [
+        f"This recording spans {len(page_reports)} pages covering {period}. Each page was analyzed "
+        "separately; the tables below show the worst condition observed per axle over the whole "
+        "recording, with anomaly phases in seconds from the start of the recording."
+    ]
+    summary += [f"- Page {p.page_number + 1} ({p.graph_period}): {_first_sentence(p.report.summary)}"
+                for p in page_reports]
+
+    recommendations, seen = [], set()
+    for page in page_reports:
+        for recommendation in page.report.recommendations:
+            if recommendation.lower() not in seen:
+                seen.add(recommendation.lower())
+                recommendations.append(recommendation)
+
+    return AnalysisReport(
+        summary="\n".join(summary),
+        axles=[AxleRow(axle, row.condition, "; ".join(phases.get(axle, [])) or "None", row.conclusion)
+               for axle, row in sorted(axle_rows.items())],
+        wsp=[wsp_rows[axle] for axle in sorted(wsp_rows)],
+        diagnosis="\n".join(f"Page {p.page_number + 1}: {' '.join(p.report.diagnosis.split())}"
+                            for p in page_reports if p.report.diagnosis),
+        recommendations=recommendations,
+        timeline=timeline,
+    )
@@ -0,0 +1,212 @@
+"""Shrink graph images before they are sent to the model.
+
+The rendered page carries margins, legends and anti-aliased RGB that the
+model does not need. Cropping to the plot, snapping every pixel to the known
+trace palette and downscaling with a filter that never drops a trace line
+gives a small palettized PNG with the same content.
+
+Run ``python preprocessing.py bench FILE.pdf ...`` to measure the payload
+reduction and check that the locally extracted tables are unchanged.
+"""
+import argparse
+import io
+import os
+import sys
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+from trace_extraction import (
+    AXLE_COLORS,
+    FRAME_COLOR,
+    FRAME_LINE_FRACTION,
+    GRID_COLOR,
+    INK_COLOR,
+    PALETTE,
+    REFERENCE_COLOR,
+    VALVE_COLORS,
+    color_mask,
+    find_plot_box,
+    quantize,
+)
+
+# Keep the axis labels around the plot (pixels at the default 2x render)
+CROP_MARGIN = 80
+MODEL_IMAGE_MAX_WIDTH = int(os.getenv("WSP_MODEL_IMAGE_MAX_WIDTH", "1600"))
+
+
+@dataclass
+class ImageOptions:
+    """What to do to a page image before it goes to the model"""
+    crop: bool = True
+    max_width: int = MODEL_IMAGE_MAX_WIDTH  # 0 keeps the rendered resolution
+    quantize: bool = True
+
+    @classmethod
+    def from_env(cls):
+        if os.getenv("WSP_PREPROCESS", "1").lower() in ("0", "false", "no"):
+            return cls(crop=False, max_width=0, quantize=False)
+        return cls()
+
+
+# Indices into PALETTE
+_DARK_INDICES = [PALETTE.index(c) for c in (FRAME_COLOR, GRID_COLOR, INK_COLOR)]
+_FIRST_TRACE_INDEX = PALETTE.index(INK_COLOR) + 1
+
+
+# --- Stages ---
+def crop_box(rgb, margin=CROP_MARGIN):
+    """Plot frame plus every row/column holding a palette colour, with a label margin"""
+    height, width = rgb.shape[:2]
+    trace_mask = np.logical_or.reduce(
+        [color_mask(rgb, c) for c in (REFERENCE_COLOR, *AXLE_COLORS.values(), *VALVE_COLORS.values())]
+    )
+    x0, y0, x1, y1 = find_plot_box(rgb, trace_mask)
+    if trace_mask.any():
+        ys, xs = np.nonzero(trace_mask)
+        x0, y0, x1, y1 = min(x0, xs.min()), min(y0, ys.min()), max(x1, xs.max()), max(y1, ys.max())
+    return (max(0, int(x0) - margin), max(0, int(y0) - margin),
+            min(width, int(x1) + margin + 1), min(height, int(y1) + margin + 1))
+
+
+def indexed_crop_box(index, margin=CROP_MARGIN):
+    """crop_box() for an image already quantized to PALETTE, from its index array"""
+    height, width = index.shape
+    dark = np.isin(index, _DARK_INDICES)
+    trace_rows = np.flatnonzero((index >= _FIRST_TRACE_INDEX).any(axis=1))
+    trace_cols = np.flatnonzero((index >= _FIRST_TRACE_INDEX).any(axis=0))
+    rows = np.flatnonzero(dark.sum(axis=1) > FRAME_LINE_FRACTION * width)
+    cols = np.flatnonzero(dark.sum(axis=0) > FRAME_LINE_FRACTION * height)
+    y_edges = [rows[[0, -1]]] if len(rows) >= 2 else []
+    x_edges = [cols[[0, -1]]] if len(cols) >= 2 else []
+    if len(trace_rows):
+        y_edges.append(trace_rows[[0, -1]])
+        x_edges.append(trace_cols[[0, -1]])
+    if not y_edges or not x_edges:
+        return 0, 0, width, height
+    ys, xs = np.concatenate(y_edges), np.concatenate(x_edges)
+    return (max(0, int(xs.min()) - margin), max(0, int(ys.min()) - margin),
+            min(width, int(xs.max()) + margin + 1), min(height, int(ys.max()) + margin + 1))
+
+
+def downscale_indexed(image, max_width):
+    """Shrink a palettized image by an integer factor, keeping the top-priority colour per block"""
+    factor = -(-image.width // max_width) if max_width else 1
+    if factor <= 1:
+        return image
+    index = np.asarray(image)
+    height, width = index.shape
+    padded = np.zeros((-(-height // factor) * factor, -(-width // factor) * factor), np.uint8)
+    padded[:height, :width] = index
+    # Strided maximum over the block offsets; far faster than reducing a 4-D block view
+    columns = padded[:, 0::factor].copy()
+    for offset in range(1, factor):
+        np.maximum(columns, padded[:, offset::factor], out=columns)
+    small_index = columns[0::factor].copy()
+    for offset in range(1, factor):
+        np.maximum(small_index, columns[offset::factor], out=small_index)
+    small = Image.fromarray(small_index, "P")
+    small.putpalette(image.getpalette())
+    return small
+
+
+def preprocess(image, options=None):
+    """Apply the configured crop, quantization and downscale to a page image"""
+    options = options or ImageOptions()
+    if options.quantize:
+        # Quantize first: the crop is then found on the small index array
+        image = quantize(image)
+        if options.crop:
+            image = image.crop(indexed_crop_box(np.asarray(image)))
+        return downscale_indexed(image, options.max_width)
+    if options.crop:
+        image = image.crop(crop_box(np.asarray(image.convert("RGB"))))
+    if options.max_width and image.width > options.max_width:
+        height = round(image.height * options.max_width / image.width)
+        image = image.resize((options.max_width, height), Image.Resampling.LANCZOS)
+    return image
+
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def model_image(image, options=None):
+    """Image part for the model request: a palettized PNG blob, or the PIL image untouched"""
+    options = options or ImageOptions.from_env()
+    if not (options.crop or options.max_width or options.quantize):
+        return image
+    return {"mime_type": "image/png", "data": encode_png(preprocess(image, options))}
+
+
+# --- Benchmark ---
+def baseline_bytes(image):
+    """Size of what the Gemini SDK uploads for a plain PIL image (lossless WebP)"""
+    buffer = io.BytesIO()
+    image.save(buffer, format="webp", lossless=True)
+    return len(buffer.getvalue())
+
+
+def table_cells(traces):
+    """Rule-based table cells that must not change, phases excluded"""
+    from classifier import classify
+    findings = classify(traces).axles
+    return [(f.axle, f.condition, f.conclusion, f.bv, f.ev, f.wsp_status) for f in findings]
+
+
+def bench(paths, options=None):
+    """Compare payload size and extracted tables before and after preprocessing"""
+    from analyzer import graph_duration_seconds, iter_pages
+    from trace_extraction import extract_traces
+
+    options = options or ImageOptions()
+    rows = []
+    for path in paths:
+        for graph in iter_pages(path, extract=False):
+            duration = graph_duration_seconds(graph.graph_period)
+            time_range = (0.0, duration) if duration else None
+            processed = preprocess(graph.image, options)
+            before = extract_traces(graph.image, time_range=time_range)
+            after = extract_traces(processed, time_range=time_range)
+            rows.append({
+                "file": os.path.basename(path),
+                "page": graph.page_number + 1,
+                "size_before": graph.image.size,
+                "size_after": processed.size,
+                "bytes_before": baseline_bytes(graph.image),
+                "bytes_after": len(encode_png(processed)),
+                "tables_match": table_cells(before) == table_cells(after),
+            })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Model image preprocessing")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench_parser = sub.add_parser("bench", help="Measure payload bytes and check tables are unchanged")
+    bench_parser.add_argument("pdfs", nargs="+")
+    bench_parser.add_argument("--max-width", type=int, default=MODEL_IMAGE_MAX_WIDTH)
+    bench_parser.add_argument("--no-crop", action="store_true")
+    bench_parser.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args(argv)
+
+    options = ImageOptions(crop=not args.no_crop, max_width=args.max_width, quantize=not args.no_quantize)
+    rows = bench(args.pdfs, options)
+    total_before = total_after = 0
+    for row in rows:
+        total_before += row["bytes_before"]
+        total_after += row["bytes_after"]
+        print(f"{row['file']} p{row['page']}: {row['size_before'][0]}x{row['size_before'][1]} "
+              f"{row['bytes_before']:,} B -> {row['size_after'][0]}x{row['size_after'][1]} "
+              f"{row['bytes_after']:,} B ({row['bytes_after'] / row['bytes_before']:.1%}), "
+              f"tables {'unchanged' if row['tables_match'] else 'CHANGED'}")
+    if rows:
+        print(f"Total: {total_before:,} B -> {total_after:,} B ({total_after / total_before:.1%})")
+    return 0 if all(row["tables_match"] for row in rows) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
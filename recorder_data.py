@@ -0,0 +1,279 @@
+"""Raw recorder exports (CSV or NumPy) as an input alongside PDF graphs.
+
+WSP units can export the samples behind the graph. Reading them gives the
+same GraphTraces the PDF path rebuilds from vector paths or pixels, without
+the vendor PDF or any image analysis. The graph is only drawn, locally with
+matplotlib, when something needs the picture: the PDF report, the on-screen
+graph or a model call.
+
+CSV layout: one header row naming the columns, then one row per sample.
+
+    # start: 18.01.25 07:10:24
+    # speed_unit: km/h
+    time,reference,axle1,axle2,axle3,axle4,valve1,valve2,valve3,valve4
+    0.000,80.0,80.0,80.0,80.0,80.0,0,0,0,0
+
+Time is in seconds and valves are 0/1; "# key: value" lines before the
+header are optional metadata. Column names are matched loosely ("Axle 1
+speed", "dump_valve_1", "ref"). The NumPy layout is a one-dimensional
+structured ``.npy`` array with the same field names, the metadata as JSON in
+the title of the time field; files are memory-mapped and uploaded bytes are
+read in place, so only the columns in use are ever copied.
+
+Usage:
+    python recorder_data.py convert recording.csv recording.npy
+    python recorder_data.py render recording.npy graph.png
+"""
+import argparse
+import io
+import json
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from trace_extraction import AXLE_COLORS, REFERENCE_COLOR, VALVE_COLORS, Calibration, GraphTraces, on_intervals
+
+RECORDER_SUFFIXES = (".csv", ".npy")
+DEFAULT_SPEED_UNIT = "km/h"
+DATE_FORMAT = "%d.%m.%y %H:%M:%S"  # as printed on the vendor graphs
+RENDER_SIZE = (1600, 900)  # pixels, about the size of a rendered graph page
+
+_NPY_MAGIC = b"\x93NUMPY"
+
+
+def is_recorder_data(source):
+    """True for a CSV/NPY export given as a path or as bytes"""
+    if isinstance(source, (str, os.PathLike)):
+        return str(source).lower().endswith(RECORDER_SUFFIXES)
+    head = bytes(source[:4096])
+    if head.startswith(_NPY_MAGIC):
+        return True
+    if head.startswith(b"%PDF"):
+        return False
+    for line in head.decode("utf-8", "replace").splitlines():
+        if line.strip() and not line.lstrip().startswith("#"):
+            return "," in line and _column_role(line.split(",")[0]) == ("time", None)
+    return False
+
+
+def _column_role(name):
+    """('time'|'reference'|'axle'|'valve', axle number or None), or None for other columns"""
+    key = re.sub(r"[^a-z0-9]", "", name.lower())
+    if key == "t" or key.startswith("time"):
+        return "time", None
+    if key.startswith("ref"):
+        return "reference", None
+    match = re.search(r"(valve|^bv|^dv)(\d)", key)
+    if match:
+        return "valve", int(match.group(2))
+    match = re.match(r"(?:axle|speed)(\d)", key)
+    if match:
+        return "axle", int(match.group(1))
+    return None
+
+
+# --- Reading ---
+def _read_metadata(text_lines):
+    """{key: value} from leading '# key: value' lines, and the number of lines they take"""
+    metadata, skipped = {}, 0
+    for line in text_lines:
+        if not line.startswith("#"):
+            break
+        key, _, value = line[1:].partition(":")
+        if value:
+            metadata[key.strip().lower()] = value.strip()
+        skipped += 1
+    return metadata, skipped
+
+
+def _read_csv(source):
+    """({role: column array}, metadata) of a CSV export, path or bytes"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding="utf-8") as f:
+            head = [f.readline() for _ in range(64)]
+    else:
+        head = bytes(source[:65536]).decode("utf-8", "replace").splitlines(keepends=True)
+    metadata, skipped = _read_metadata(head)
+    header = head[skipped].strip().split(",")
+    roles = {index: _column_role(name) for index, name in enumerate(header)}
+    roles = {index: role for index, role in roles.items() if role}
+    stream = source if isinstance(source, (str, os.PathLike)) else io.BytesIO(source)
+    # numpy's C reader streams the file and keeps only the columns in use
+    data = np.loadtxt(stream, delimiter=",", comments="#", skiprows=skipped + 1, usecols=sorted(roles),
+                      dtype=float, ndmin=2)
+    return {roles[index]: data[:, position] for position, index in enumerate(sorted(roles))}, metadata
+
+
+def _read_npy(source):
+    """({role: column array}, metadata) of a structured .npy export, memory-mapped or read in place"""
+    if isinstance(source, (str, os.PathLike)):
+        array = np.load(source, mmap_mode="r")
+    else:
+        buffer = io.BytesIO(source)
+        version = np.lib.format.read_magic(buffer)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(buffer)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(buffer)
+        else:  # newer header layouts: let numpy parse them, at the cost of a copy
+            return _npy_columns(np.load(io.BytesIO(source)))
+        array = np.frombuffer(source, dtype=dtype, count=int(np.prod(shape)), offset=buffer.tell())
+        array = array.reshape(shape, order="F" if fortran_order else "C")
+    return _npy_columns(array)
+
+
+def _npy_columns(array):
+    if array.dtype.names is None:
+        raise ValueError("NumPy recorder exports must be structured arrays with named columns")
+    if array.ndim != 1:
+        raise ValueError(f"NumPy recorder exports must be one-dimensional, not of shape {array.shape}")
+    columns, metadata = {}, {}
+    for name in array.dtype.names:
+        role = _column_role(name)
+        if role:
+            columns[role] = array[name]
+        title = array.dtype.fields[name][2:]
+        if role == ("time", None) and title:
+            try:
+                metadata = {str(key).lower(): str(value) for key, value in json.loads(title[0]).items()}
+            except (ValueError, AttributeError):
+                pass  # a title that is not ours
+    return columns, metadata
+
+
+def read_recording(source, speed_unit=None):
+    """(GraphTraces, graph period) of a CSV or NumPy recorder export given as a path or bytes"""
+    is_npy = (str(source).lower().endswith(".npy") if isinstance(source, (str, os.PathLike))
+              else bytes(source[:6]) == _NPY_MAGIC)
+    columns, metadata = _read_npy(source) if is_npy else _read_csv(source)
+    if ("time", None) not in columns:
+        raise ValueError("Recorder export has no time column")
+
+    times = np.asarray(columns[("time", None)], dtype=float)
+    reference = np.asarray(columns.get(("reference", None), np.full(len(times), np.nan)), dtype=float)
+    axles, valves, coverage = {}, {}, {}
+    for axle in AXLE_COLORS:
+        speed = columns.get(("axle", axle))
+        axles[axle] = np.asarray(speed, dtype=float) if speed is not None else np.full(len(times), np.nan)
+        coverage[axle] = float(np.isfinite(axles[axle]).mean()) if len(times) else 0.0
+        valve = columns.get(("valve", axle))
+        valves[axle] = on_intervals(np.asarray(valve) > 0.5, times) if valve is not None else np.empty((0, 2))
+    coverage["reference"] = float(np.isfinite(reference).mean()) if len(times) else 0.0
+
+    speeds = np.concatenate([reference] + list(axles.values()))
+    finite = speeds[np.isfinite(speeds)]
+    calibration = Calibration(
+        plot_box=(0, 0, max(len(times) - 1, 0), 0),  # no pixels; one column per sample
+        time_range=(float(times[0]), float(times[-1])) if len(times) else (0.0, 0.0),
+        speed_range=(float(finite.min()), float(finite.max())) if len(finite) else (0.0, 0.0),
+        speed_unit=speed_unit or metadata.get("speed_unit", DEFAULT_SPEED_UNIT),
+    )
+    traces = GraphTraces(time=times, reference=reference, axles=axles, valves=valves,
+                         calibration=calibration, coverage=coverage)
+    return traces, graph_period(metadata.get("start"), times)
+
+
+def graph_period(start, times):
+    """'18.01.25 07:10:24 to 18.01.25 07:12:54' from the start metadata, like the vendor graphs print"""
+    if not start or not len(times):
+        return "Not Available"
+    try:
+        begin = datetime.strptime(" ".join(start.split()), DATE_FORMAT)
+    except ValueError:
+        return "Not Available"
+    end = begin + timedelta(seconds=float(times[-1] - times[0]))
+    return f"{begin.strftime(DATE_FORMAT)} to {end.strftime(DATE_FORMAT)}"
+
+
+# --- Rendering ---
+def _envelope(times, values, buckets):
+    """Min/max polyline over ``buckets`` equal slices; keeps every spike of long series"""
+    if len(values) <= 2 * buckets:
+        return times, values
+    starts = np.linspace(0, len(values), buckets, endpoint=False).astype(int)
+    with np.errstate(invalid="ignore"):
+        low = np.fmin.reduceat(values, starts)
+        high = np.fmax.reduceat(values, starts)
+    return np.repeat(times[starts], 2), np.column_stack((low, high)).ravel()
+
+
+def render_graph(traces, graph_period="Not Available", size=RENDER_SIZE, dpi=100):
+    """Draw the traces in the recorder's colours as a PIL image (speed plot above the valve band)"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from PIL import Image
+
+    figure = Figure(figsize=(size[0] / dpi, size[1] / dpi), dpi=dpi, facecolor="white")
+    speed_axes, valve_axes = figure.subplots(2, 1, sharex=True, gridspec_kw={"height_ratios": [4, 1]})
+    buckets = size[0]
+    speed_axes.plot(*_envelope(traces.time, traces.reference, buckets), color=REFERENCE_COLOR, linewidth=1.2,
+                    label="Reference")
+    for axle in sorted(traces.axles):
+        speed_axes.plot(*_envelope(traces.time, traces.axles[axle], buckets), color=AXLE_COLORS[axle],
+                        linewidth=1.0, label=f"Axle {axle}")
+    step = float(np.median(np.diff(traces.time))) if len(traces.time) > 1 else 0.0
+    for axle, intervals in sorted(traces.valves.items()):
+        if len(intervals):
+            bars = np.column_stack((intervals[:, 0], np.maximum(intervals[:, 1] - intervals[:, 0], step)))
+            valve_axes.broken_barh(bars, (axle - 0.4, 0.8), color=VALVE_COLORS[axle])
+
+    speed_axes.set_ylabel(f"Speed ({traces.calibration.speed_unit})")
+    speed_axes.set_title(f"WSP recording {graph_period}", fontsize=10)
+    speed_axes.grid(True, color="#DDDDDD", linewidth=0.5)
+    speed_axes.legend(loc="upper right", fontsize=8)
+    valve_axes.set_yticks(sorted(VALVE_COLORS), [f"DV {axle}" for axle in sorted(VALVE_COLORS)])
+    valve_axes.set_ylim(0.4, len(VALVE_COLORS) + 0.6)
+    valve_axes.set_xlabel("Time (s)")
+    if len(traces.time):
+        valve_axes.set_xlim(traces.time[0], traces.time[-1])
+    figure.tight_layout()
+
+    canvas = FigureCanvasAgg(figure)
+    canvas.draw()
+    return Image.frombuffer("RGBA", canvas.get_width_height(), canvas.buffer_rgba()).convert("RGB")
+
+
+# --- CLI ---
+def convert(csv_path, npy_path):
+    """Save a CSV export as a structured .npy (memory-mappable); returns the sample count"""
+    columns, metadata = _read_csv(csv_path)
+    names = {("time", None): "time", ("reference", None): "reference"}
+    names.update({("axle", axle): f"axle{axle}" for axle in AXLE_COLORS})
+    names.update({("valve", axle): f"valve{axle}" for axle in VALVE_COLORS})
+    present = [role for role in names if role in columns]
+    fields = [(names[role], np.uint8 if role[0] == "valve" else np.float64) for role in present]
+    if metadata:  # kept as the title of the time field, which .npy headers preserve
+        fields[0] = ((json.dumps(metadata), "time"), np.float64)
+    array = np.empty(len(columns[("time", None)]), dtype=fields)
+    for role in present:
+        array[names[role]] = columns[role]
+    np.save(npy_path, array)
+    return len(array)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Raw WSP recorder exports")
+    sub = parser.add_subparsers(dest="command", required=True)
+    to_npy = sub.add_parser("convert", help="Convert a CSV export to the memory-mappable .npy layout")
+    to_npy.add_argument("csv")
+    to_npy.add_argument("npy")
+    render = sub.add_parser("render", help="Draw the graph of an export as a PNG")
+    render.add_argument("recording")
+    render.add_argument("png")
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        samples = convert(args.csv, args.npy)
+        print(f"Wrote {samples} samples to {args.npy}")
+    elif args.command == "render":
+        traces, period = read_recording(args.recording)
+        render_graph(traces, period).save(args.png)
+        print(f"Wrote {args.png}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""Structured WSP analysis report: schema, validation and markdown rendering.
+
+The model answers with JSON against ``RESPONSE_SCHEMA``; the answer is
+validated once into an ``AnalysisReport`` and every output (markdown, TXT,
+PDF, fleet index, cache) is rendered from that record instead of re-parsing
+text. The local rules build the same record directly.
+"""
+import json
+from dataclasses import MISSING, dataclass, field
+from datetime import datetime
+
+CANNOT_DETERMINE = "Cannot determine from graph"
+
+AXLE_COLOR_NAMES = {1: "Green", 2: "Yellow", 3: "Blue", 4: "Pink"}
+AXLES = sorted(AXLE_COLOR_NAMES)
+
+CONDITIONS = ["Tracking reference speed smoothly", "Fluctuating with deviations",
+              "Severe drops below reference", "Complete wheel lock", CANNOT_DETERMINE]
+CONCLUSIONS = ["Normal Operation", "Affected - Minor", "Affected - Moderate", "Severely Affected",
+               CANNOT_DETERMINE]
+BV_STATES = ["Activated immediately", "Multiple rapid activations", "Sustained activation",
+             "No activation detected", "Not required - no wheel slide", CANNOT_DETERMINE]
+EV_STATES = ["Proper closure after recovery", "Rapid cycling", "Delayed closure", "No closure signal",
+             "Not required", CANNOT_DETERMINE]
+WSP_STATUSES = ["Functioning Correctly", "Partially Effective", "Requires Maintenance",
+                "Malfunction Suspected", CANNOT_DETERMINE]
+
+SECTION_TITLES = {
+    "summary": "1. Executive Summary",
+    "axles": "2. Speed and Axle Deviation Analysis",
+    "wsp": "3. Wheel Slide Protection (WSP) System Response Analysis",
+    "diagnosis": "4. Diagnosis",
+    "recommendations": "5. Recommendations",
+}
+AXLE_TABLE_HEADERS = ["Axle No.", "Line Color", "Observed Speed Condition", "Phase of Anomaly", "Conclusion"]
+WSP_TABLE_HEADERS = ["Axle No.", "Dump Valve Activation (BV)", "Dump Valve Closure (EV)", "WSP System Status"]
+MEASURED_VALVES_HEADER = "Measured Valve Cycles"
+TIMELINE_TABLE_HEADERS = ["Page", "Graph Period", "Start Offset", "Worst Conclusion", "Analyzed By"]
+
+
+def _enum(values):
+    return {"type": "string", "format": "enum", "enum": list(values)}
+
+
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "axles": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "axle": {"type": "integer"},
+                    "condition": _enum(CONDITIONS),
+                    "phase": {"type": "string"},
+                    "conclusion": _enum(CONCLUSIONS),
+                },
+                "required": ["axle", "condition", "phase", "conclusion"],
+            },
+        },
+        "wsp": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "axle": {"type": "integer"},
+                    "bv": _enum(BV_STATES),
+                    "ev": _enum(EV_STATES),
+                    "status": _enum(WSP_STATUSES),
+                },
+                "required": ["axle", "bv", "ev", "status"],
+            },
+        },
+        "diagnosis": {"type": "string"},
+        "recommendations": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["summary", "axles", "wsp", "diagnosis", "recommendations"],
+}
+
+
+class ReportFormatError(ValueError):
+    """The model's answer does not match the report schema"""
+
+
+# --- Record ---
+@dataclass
+class AxleRow:
+    axle: int
+    condition: str
+    phase: str
+    conclusion: str
+
+    @property
+    def line_color(self):
+        return AXLE_COLOR_NAMES.get(self.axle, "-")
+
+
+@dataclass
+class WspRow:
+    axle: int
+    bv: str
+    ev: str
+    status: str
+    measured: str = ""  # valve cycles measured from the traces (slip_analysis.py); not in the model's answer
+
+
+@dataclass
+class TimelineRow:
+    """One page of a multi-page recording in the merged report"""
+    page: int
+    graph_period: str
+    start_offset: float  # seconds from the recording start, None if unknown
+    worst_conclusion: str
+    engine: str
+
+
+@dataclass
+class AnalysisReport:
+    summary: str
+    axles: list
+    wsp: list
+    diagnosis: str
+    recommendations: list
+    date: str = field(default_factory=lambda: datetime.now().strftime("%d-%m-%Y"))
+    timeline: list = field(default_factory=list)
+
+    def to_dict(self):
+        # Rows are flat, so this avoids asdict()'s recursive deep copy
+        return {
+            "summary": self.summary,
+            "axles": [dict(vars(row)) for row in self.axles],
+            "wsp": [dict(vars(row)) for row in self.wsp],
+            "diagnosis": self.diagnosis,
+            "recommendations": list(self.recommendations),
+            "date": self.date,
+            "timeline": [dict(vars(row)) for row in self.timeline],
+        }
+
+    def to_json(self):
+        """Compact JSON for storage"""
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Validate a decoded answer or stored record; raises ReportFormatError"""
+        if not isinstance(data, dict):
+            raise ReportFormatError("Report must be a JSON object")
+        missing = [key for key in RESPONSE_SCHEMA["required"] if key not in data]
+        if missing:
+            raise ReportFormatError(f"Report is missing {', '.join(missing)}")
+        axles = _rows(data["axles"], AxleRow, "axles")
+        wsp = _rows(data["wsp"], WspRow, "wsp")
+        recommendations = data["recommendations"]
+        if isinstance(recommendations, str):
+            recommendations = [recommendations]
+        if not isinstance(recommendations, list):
+            raise ReportFormatError("recommendations must be a list of strings")
+        report = cls(
+            summary=_text(data["summary"], "summary"),
+            axles=axles,
+            wsp=wsp,
+            diagnosis=_text(data["diagnosis"], "diagnosis"),
+            recommendations=[_text(r, "recommendations") for r in recommendations if str(r).strip()],
+            timeline=[TimelineRow(**row) for row in data.get("timeline") or []],
+        )
+        if data.get("date"):
+            report.date = str(data["date"])
+        return report
+
+    @classmethod
+    def from_json(cls, text):
+        if isinstance(text, (bytes, bytearray)):
+            text = text.decode("utf-8")
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ReportFormatError(f"Report is not valid JSON: {e}") from e
+        return cls.from_dict(data)
+
+
+def _text(value, name):
+    if not isinstance(value, (str, int, float)):
+        raise ReportFormatError(f"{name} must be text")
+    if name in ("summary", "diagnosis"):
+        return str(value).strip()  # may hold several paragraphs
+    return " ".join(str(value).split())
+
+
+def _rows(items, row_type, name):
+    """Validate one table: exactly one row per axle 1-4, returned in axle order"""
+    if not isinstance(items, list):
+        raise ReportFormatError(f"{name} must be a list")
+    fields = list(row_type.__dataclass_fields__)
+    required = [f for f, spec in row_type.__dataclass_fields__.items() if spec.default is MISSING]
+    rows = {}
+    for item in items:
+        if not isinstance(item, dict) or any(f not in item for f in required):
+            raise ReportFormatError(f"Each {name} row needs {', '.join(required)}")
+        try:
+            axle = int(item["axle"])
+        except (TypeError, ValueError):
+            raise ReportFormatError(f"Invalid axle number in {name}: {item['axle']!r}") from None
+        if axle not in AXLE_COLOR_NAMES or axle in rows:
+            raise ReportFormatError(f"Unexpected or duplicate axle {axle} in {name}")
+        rows[axle] = row_type(axle, **{f: _text(item[f], name) for f in fields[1:] if f in item})
+    if sorted(rows) != AXLES:
+        raise ReportFormatError(f"{name} must have one row for each of axles 1-4")
+    return [rows[axle] for axle in AXLES]
+
+
+def parse_report(text):
+    """Validate the model's JSON answer into an AnalysisReport"""
+    return AnalysisReport.from_json(text)
+
+
+# --- Rendering ---
+def axle_table_rows(report):
+    return [[f"Axle {r.axle}", r.line_color, r.condition, r.phase, r.conclusion] for r in report.axles]
+
+
+def wsp_table_headers(report):
+    """The WSP table columns, with the measured valve cycles when the report has them"""
+    if any(r.measured for r in report.wsp):
+        return WSP_TABLE_HEADERS + [MEASURED_VALVES_HEADER]
+    return WSP_TABLE_HEADERS
+
+
+def wsp_table_rows(report):
+    if any(r.measured for r in report.wsp):
+        return [[f"Axle {r.axle}", r.bv, r.ev, r.status, r.measured or "-"] for r in report.wsp]
+    return [[f"Axle {r.axle}", r.bv, r.ev, r.status] for r in report.wsp]
+
+
+def timeline_table_rows(report):
+    return [[str(t.page), t.graph_period, f"{t.start_offset:.2f}s" if t.start_offset is not None else "Unknown",
+             t.worst_conclusion, t.engine] for t in report.timeline]
+
+
+def _markdown_table(headers, rows):
+    lines = ["| " + " | ".join(headers) + " |", "|" + "|".join("-" * (len(h) + 2) for h in headers) + "|"]
+    lines += ["| " + " | ".join(row) + " |" for row in rows]
+    return lines
+
+
+def to_markdown(report):
+    """The report in the markdown layout the app has always shown"""
+    lines = ["## Date of Analysis", report.date, "", f"## {SECTION_TITLES['summary']}", report.summary, "",
+             f"## {SECTION_TITLES['axles']}", ""]
+    lines += _markdown_table(AXLE_TABLE_HEADERS, axle_table_rows(report))
+    lines += ["", f"## {SECTION_TITLES['wsp']}", ""]
+    lines += _markdown_table(wsp_table_headers(report), wsp_table_rows(report))
+    lines += ["", f"## {SECTION_TITLES['diagnosis']}"]
+    if report.timeline:
+        lines.append("")
+        lines += _markdown_table(TIMELINE_TABLE_HEADERS, timeline_table_rows(report))
+        lines.append("")
+    lines += [report.diagnosis, "", f"## {SECTION_TITLES['recommendations']}"]
+    lines += [f"- {recommendation}" for recommendation in report.recommendations]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,481 @@
+"""Report artifacts for WSP analyses: the formatted PDF and the plain-text export."""
+import hashlib
+import io
+import struct
+import threading
+import time
+from datetime import datetime
+
+from fpdf import FPDF
+from PIL import Image
+
+from metrics import span
+from report_schema import (
+    AXLE_TABLE_HEADERS,
+    SECTION_TITLES,
+    TIMELINE_TABLE_HEADERS,
+    axle_table_rows,
+    timeline_table_rows,
+    to_markdown,
+    wsp_table_headers,
+    wsp_table_rows,
+)
+
+# Bump when the report layout changes, so stored reports are re-rendered
+LAYOUT_VERSION = 1
+
+# --- Text Sanitizing ---
+# Core fonts are latin-1 only: map typographic punctuation to ASCII, drop the rest
+_PDF_TRANSLATION = str.maketrans({
+    '\u2019': "'", '\u2018': "'",
+    '\u201c': '"', '\u201d': '"',
+    '\u2013': '-', '\u2014': '-',
+})
+
+def pdf_safe(text):
+    """Strip markdown bold and anything the core PDF fonts cannot encode"""
+    text = str(text).replace('**', '').strip().translate(_PDF_TRANSLATION)
+    return text.encode('ascii', 'ignore').decode('ascii')
+
+# --- In-Memory Images ---
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+def parse_png(png_bytes):
+    """FPDF image info for a PNG held in memory (8-bit grey, RGB or palette, not interlaced)
+
+    Mirrors FPDF._parsepng, which can only read from a file path. The IDAT
+    data is passed through still compressed.
+    """
+    if png_bytes[:8] != PNG_SIGNATURE or png_bytes[12:16] != b'IHDR':
+        raise ValueError('Not a PNG image')
+    width, height, bpc, color_type, compression, png_filter, interlace = struct.unpack(
+        '>IIBBBBB', png_bytes[16:29])
+    if bpc > 8 or color_type not in (0, 2, 3) or compression or png_filter or interlace:
+        raise ValueError('Unsupported PNG layout for direct embedding')
+    colspace = {0: 'DeviceGray', 2: 'DeviceRGB', 3: 'Indexed'}[color_type]
+    
+    palette, idat, pos = b'', [], 8
+    while pos + 8 <= len(png_bytes):
+        length, chunk_type = struct.unpack('>I4s', png_bytes[pos:pos + 8])
+        chunk = png_bytes[pos + 8:pos + 8 + length]
+        if chunk_type == b'PLTE':
+            palette = chunk
+        elif chunk_type == b'IDAT':
+            idat.append(chunk)
+        elif chunk_type == b'IEND':
+            break
+        pos += length + 12
+    if colspace == 'Indexed' and not palette:
+        raise ValueError('PNG palette missing')
+    
+    colors = 3 if colspace == 'DeviceRGB' else 1
+    return {
+        'w': width, 'h': height, 'cs': colspace, 'bpc': bpc, 'f': 'FlateDecode',
+        'dp': f'/Predictor 15 /Colors {colors} /BitsPerComponent {bpc} /Columns {width}',
+        'pal': palette, 'trns': '', 'data': b''.join(idat),
+    }
+
+def to_embeddable_png(png_bytes):
+    """Re-encode a PNG FPDF cannot embed directly (alpha, 16-bit, interlaced) as plain RGB"""
+    with Image.open(io.BytesIO(png_bytes)) as image:
+        buffer = io.BytesIO()
+        image.convert('RGB').save(buffer, format='PNG')
+        return buffer.getvalue()
+
+# --- Enhanced PDF Class with Table Support ---
+class EnhancedPDF(FPDF):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.memory_images = {}  # name -> PNG bytes being embedded by image_from_bytes
+    
+    def header(self):
+        if self.page_no() > 2:  # Skip header for cover and image pages
+            self.set_font('Arial', 'I', 8)
+            self.set_text_color(128, 128, 128)
+            self.cell(0, 10, f'WSP Graph Analyzer - Page {self.page_no() - 2}', 0, 0, 'R')
+            self.ln(10)
+    
+    def image_from_bytes(self, png_bytes, x=None, y=None, w=0, h=0):
+        """Place a PNG from memory; identical bytes are embedded once
+
+        The PNG goes through the public ``image()`` under a name made from
+        its hash, which ``_parsepng`` resolves from memory: nothing touches
+        the disk.
+        """
+        name = f'memory:{hashlib.sha1(png_bytes).hexdigest()}.png'
+        if name not in self.images:
+            self.memory_images[name] = png_bytes
+        try:
+            self.image(name, x, y, w, h, type='png')
+        finally:
+            self.memory_images.pop(name, None)
+        return self.images[name]['w'], self.images[name]['h']
+    
+    def _parsepng(self, name):
+        png_bytes = self.memory_images.get(name)
+        if png_bytes is None:
+            return super()._parsepng(name)
+        try:
+            return parse_png(png_bytes)
+        except ValueError:
+            return parse_png(to_embeddable_png(png_bytes))
+    
+    def add_heading(self, text, level=1):
+        """Add formatted heading"""
+        self.ln(3)
+        if level == 1:
+            self.set_font('Arial', 'B', 14)
+            self.set_fill_color(52, 152, 219)
+            self.set_text_color(255, 255, 255)
+            safe_text = text.encode('ascii', 'ignore').decode('ascii')
+            self.cell(0, 10, safe_text, 0, 1, 'L', True)
+        elif level == 2:
+            self.set_font('Arial', 'B', 12)
+            self.set_text_color(0, 0, 0)
+            safe_text = text.encode('ascii', 'ignore').decode('ascii')
+            self.cell(0, 8, safe_text, 0, 1, 'L')
+        self.set_text_color(0, 0, 0)
+        self.ln(2)
+    
+    def add_paragraph(self, text):
+        """Add paragraph text"""
+        self.set_font('Arial', '', 10)
+        self.multi_cell(0, 5, pdf_safe(text))
+        self.ln(2)
+    
+    def add_table(self, headers, rows):
+        """Add formatted table with dynamic sizing; the header repeats after page breaks"""
+        num_cols = len(headers)
+        available_width = self.w - 20
+        headers = [pdf_safe(h) for h in headers]
+        rows = [[pdf_safe(c) for c in row[:num_cols]] for row in rows]
+        
+        # Calculate optimal column widths
+        max_content_lengths = [len(h) for h in headers]
+        for row in rows:
+            for col_idx, cell in enumerate(row):
+                if len(cell) > max_content_lengths[col_idx]:
+                    max_content_lengths[col_idx] = len(cell)
+        
+        total_content = sum(max_content_lengths)
+        if total_content > 0:
+            col_widths = [(length / total_content) * available_width for length in max_content_lengths]
+            col_widths = [max(20, w) for w in col_widths]
+            total_width = sum(col_widths)
+            if total_width > available_width:
+                scale = available_width / total_width
+                col_widths = [w * scale for w in col_widths]
+        else:
+            col_widths = [available_width / num_cols] * num_cols
+        x_start = self.get_x()
+        col_offsets = [x_start + sum(col_widths[:i]) for i in range(num_cols)]
+        
+        # Wrap every cell once, measuring with the font it is drawn in
+        self.set_font('Arial', 'B', 9)
+        header_lines = [self.wrap_text(h, w - 2) for h, w in zip(headers, col_widths)]
+        header_height = max(10, max(len(lines) for lines in header_lines) * 5)
+        
+        self.set_font('Arial', '', 8)
+        word_widths = {}
+        row_lines = [[self.wrap_text(cell, col_widths[i] - 2, word_widths) for i, cell in enumerate(row)]
+                     for row in rows]
+        
+        # Keep the header with at least the first row
+        first_height = max(10, max((len(c) for c in row_lines[0]), default=1) * 4 + 2) if rows else 0
+        if self.get_y() + header_height + first_height > self.page_break_trigger:
+            self.add_page()
+        self._draw_table_header(header_lines, col_offsets, col_widths, header_height)
+        
+        for row_idx, lines in enumerate(row_lines):
+            row_height = max(10, max((len(c) for c in lines), default=1) * 4 + 2)
+            if self.get_y() + row_height > self.page_break_trigger:
+                self.add_page()
+                self._draw_table_header(header_lines, col_offsets, col_widths, header_height)
+            
+            if row_idx % 2 == 0:
+                self.set_fill_color(255, 255, 255)
+            else:
+                self.set_fill_color(245, 245, 245)
+            
+            y_pos = self.get_y()
+            for x, width, cell_lines in zip(col_offsets, col_widths, lines):
+                self.rect(x, y_pos, width, row_height, 'DF')
+                for line_idx, text in enumerate(cell_lines):
+                    self.set_xy(x + 1, y_pos + 1 + line_idx * 3.5)
+                    self.cell(width - 2, 3.5, text)
+            
+            self.set_xy(x_start, y_pos + row_height)
+        
+        self.ln(5)
+    
+    def _draw_table_header(self, header_lines, col_offsets, col_widths, header_height):
+        self.set_font('Arial', 'B', 9)
+        self.set_fill_color(52, 152, 219)
+        self.set_text_color(255, 255, 255)
+        
+        y_start = self.get_y()
+        for x, width, lines in zip(col_offsets, col_widths, header_lines):
+            self.rect(x, y_start, width, header_height, 'DF')
+            for line_idx, text in enumerate(lines):
+                self.set_xy(x + 1, y_start + 1 + line_idx * 4)
+                self.cell(width - 2, 4, text, 0, 0, 'C')
+        
+        self.set_xy(col_offsets[0], y_start + header_height)
+        self.set_font('Arial', '', 8)
+        self.set_text_color(0, 0, 0)
+    
+    def wrap_text(self, text, width, word_widths=None):
+        """Greedy word wrap to a width in mm using the current font's real glyph widths
+
+        ``word_widths`` caches measured words across calls made with the same font.
+        """
+        if word_widths is None:
+            word_widths = {}
+        space = self.get_string_width(' ')
+        lines, current, current_width = [], [], 0.0
+        for word in text.split():
+            word_width = word_widths.get(word)
+            if word_width is None:
+                word_width = word_widths[word] = self.get_string_width(word)
+            if current and current_width + space + word_width <= width:
+                current.append(word)
+                current_width += space + word_width
+                continue
+            if current:
+                lines.append(' '.join(current))
+            if word_width > width:
+                # Break words longer than the column, like multi_cell does
+                pieces = self._split_long_word(word, width)
+                lines.extend(pieces[:-1])
+                word = pieces[-1]
+                word_width = self.get_string_width(word)
+            current, current_width = [word], word_width
+        if current:
+            lines.append(' '.join(current))
+        return lines or ['']
+    
+    def _split_long_word(self, word, width):
+        pieces, piece, piece_width = [], '', 0.0
+        for char in word:
+            char_width = self.get_string_width(char)
+            if piece and piece_width + char_width > width:
+                pieces.append(piece)
+                piece, piece_width = '', 0.0
+            piece += char
+            piece_width += char_width
+        pieces.append(piece)
+        return pieces
+
+# --- Helper: Create PDF from the Report Record ---
+def add_cover_page(pdf, title, lines):
+    """Full-bleed cover page with a title and centred info lines"""
+    pdf.add_page()
+    pdf.set_fill_color(70, 130, 180)
+    pdf.rect(0, 0, pdf.w, pdf.h, style='F')
+    pdf.set_text_color(255, 255, 255)
+    
+    pdf.set_y(pdf.h / 2 - 30)
+    pdf.set_font('Arial', 'B', 24)
+    pdf.ln(20)
+    pdf.cell(0, 15, title, 0, 1, 'C')
+    pdf.ln(10)
+    
+    pdf.set_font('Arial', '', 12)
+    for line in lines:
+        pdf.cell(0, 8, pdf_safe(line), 0, 1, 'C')
+    pdf.ln(30)
+    
+    pdf.set_font("Arial", 'I', size=9)
+    pdf.cell(0, 5, "This report is generated by Premade Innovations Pvt. Ltd.", 0, 1, 'C')
+    pdf.set_text_color(0, 0, 0)
+
+def add_report(pdf, report):
+    """Render an AnalysisReport's sections and tables"""
+    pdf.add_heading(SECTION_TITLES['summary'], level=2)
+    for paragraph in report.summary.split('\n'):
+        if paragraph.strip():
+            pdf.add_paragraph(paragraph.strip())
+    pdf.add_heading(SECTION_TITLES['axles'], level=2)
+    pdf.add_table(AXLE_TABLE_HEADERS, axle_table_rows(report))
+    pdf.add_heading(SECTION_TITLES['wsp'], level=2)
+    pdf.add_table(wsp_table_headers(report), wsp_table_rows(report))
+    pdf.add_heading(SECTION_TITLES['diagnosis'], level=2)
+    if report.timeline:
+        pdf.add_table(TIMELINE_TABLE_HEADERS, timeline_table_rows(report))
+    for paragraph in report.diagnosis.split('\n'):
+        if paragraph.strip():
+            pdf.add_paragraph(paragraph.strip())
+    pdf.add_heading(SECTION_TITLES['recommendations'], level=2)
+    for recommendation in report.recommendations:
+        pdf.add_paragraph(f"- {recommendation}")
+
+def create_pdf_with_image(report, png_bytes, graph_period):
+    """Create the PDF report from an AnalysisReport; the graph comes as PNG bytes"""
+    pdf = EnhancedPDF()
+    
+    # COVER PAGE
+    generated_time = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+    add_cover_page(pdf, 'WSP GRAPH SUMMARY', [
+        f'Generated Time : {generated_time}',
+        f'Graph Timestamp : {graph_period}',
+    ])
+    
+    # GRAPH IMAGE PAGE
+    pdf.add_page()
+    pdf.set_text_color(0, 0, 0)
+    
+    if png_bytes:
+        try:
+            with Image.open(io.BytesIO(png_bytes)) as img:
+                img_width, img_height = img.size
+            page_width = pdf.w - 20
+            scale_factor = page_width / img_width
+            scaled_height_px = img_height * scale_factor
+            scaled_height_mm = (scaled_height_px / 96) * 25.4
+            
+            current_y = pdf.get_y()
+            max_height = pdf.h - current_y - 30
+            
+            if scaled_height_mm > max_height:
+                scale_factor_height = max_height / scaled_height_mm
+                final_width = page_width * scale_factor_height
+                pdf.image_from_bytes(png_bytes, x=10 + (page_width - final_width) / 2, y=current_y, w=final_width)
+            else:
+                pdf.image_from_bytes(png_bytes, x=10, y=current_y, w=page_width)
+        except Exception as e:
+            pdf.set_font('Arial', '', 10)
+            pdf.cell(0, 10, f'[Image could not be embedded: {e}]', 0, 1)
+    
+    # ANALYSIS CONTENT PAGE
+    pdf.add_page()
+    pdf.add_heading('Analysis Report', level=1)
+    
+    pdf.add_heading('Date of Analysis', level=2)
+    pdf.add_paragraph(report.date)
+    pdf.add_heading('Graph Timestamp', level=2)
+    pdf.add_paragraph(graph_period)
+    
+    add_report(pdf, report)
+    
+    return pdf.output(dest='S').encode('latin-1')
+
+# --- Helper: Create Text File ---
+def create_text_with_image_info(report, png_bytes, graph_period):
+    """Create text file with image reference; ``png_bytes`` only has to say whether there is a graph"""
+    generated_time = datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+    
+    output = "=" * 70 + "\n"
+    output += "WSP GRAPH SUMMARY\n"
+    output += "=" * 70 + "\n\n"
+    output += f"Generated Time : {generated_time}\n"
+    output += f"Graph Timestamp : {graph_period}\n\n"
+    
+    if png_bytes:
+        output += "[GRAPH IMAGE INCLUDED - See PDF version for visual reference]\n\n"
+    
+    output += "-" * 70 + "\n"
+    output += "ANALYSIS REPORT\n"
+    output += "-" * 70 + "\n\n"
+    output += to_markdown(report)
+    output += "\n\n" + "=" * 70 + "\n"
+    output += "This report is generated by Premade Innovations Pvt. Ltd.\n"
+    output += "=" * 70 + "\n"
+    
+    return output
+
+# --- Lazy Artifacts ---
+ARTIFACT_BUILDERS = {
+    "report.txt": ("text_report", create_text_with_image_info),
+    "report.pdf": ("pdf_build", create_pdf_with_image),
+}
+
+def build_artifact(name, report, png_bytes, graph_period):
+    """Render one download ('report.txt' or 'report.pdf'), timed as its own stage"""
+    stage, build = ARTIFACT_BUILDERS[name]
+    with span(stage):
+        return build(report, png_bytes, graph_period)
+
+class ReportArtifacts:
+    """Graph PNG, TXT and PDF downloads of one report, each built on first request and then kept
+
+    ``png`` is the graph's PNG bytes, or a callable drawing them (a raw
+    recording's graph is only drawn for the PNG itself or the PDF).
+    ``built`` seeds already rendered artifacts (e.g. from the result cache);
+    ``on_build(name, data)`` is called once for every newly built one.
+    Safe to share between threads: concurrent requests build once.
+    """
+
+    def __init__(self, report, png, graph_period, built=None, on_build=None):
+        self.report = report
+        self.graph_period = graph_period
+        self._draw_png = png if callable(png) else None
+        self._built = {name: data for name, data in (built or {}).items() if data is not None}
+        if png is not None and not callable(png):
+            self._built["graph.png"] = png
+        self.errors = {}
+        self._on_build = on_build
+        self._lock = threading.Lock()
+
+    @property
+    def has_graph(self):
+        return "graph.png" in self._built or self._draw_png is not None
+
+    def get(self, name):
+        """The artifact, building it now if needed; None when building failed (see ``errors``)"""
+        with self._lock:
+            return self._get(name)
+
+    def _get(self, name):
+        if name not in self._built and name not in self.errors:
+            if name == "graph.png" and self._draw_png is None:
+                return None
+            try:
+                self._built[name] = self._build(name)
+            except Exception as e:
+                self.errors[name] = e
+                return None
+            if self._on_build:
+                self._on_build(name, self._built[name])
+        return self._built.get(name)
+
+    def _build(self, name):
+        if name == "graph.png":
+            return self._draw_png()
+        # The text report only notes that there is a graph, so it never draws one
+        png = self.has_graph if name == "report.txt" else self._get("graph.png")
+        return build_artifact(name, self.report, png, self.graph_period)
+    
+    def build_all(self):
+        """Every TXT/PDF download now, as {name: data}; raises the first build error"""
+        built = {name: self.get(name) for name in ARTIFACT_BUILDERS}
+        for name in ARTIFACT_BUILDERS:
+            if name in self.errors:
+                raise self.errors[name]
+        return built
+
+# --- Benchmark ---
+def bench_table(row_counts=(100, 1000, 10000)):
+    """Seconds to lay out and serialize fleet-sized tables, per row count"""
+    headers = ['File', 'Graph Period', 'Status', 'Engine', 'Seconds']
+    results = []
+    for count in row_counts:
+        rows = [[f'recording_{i:05d}.pdf', '18.01.25 07:10:24 to 18.01.25 07:12:54',
+                 'Severely Affected' if i % 7 == 0 else 'Normal Operation – no deviation',
+                 'Gemini' if i % 3 else 'Rules', f'{i % 40 + 0.5:.1f}'] for i in range(count)]
+        start = time.perf_counter()
+        pdf = EnhancedPDF()
+        pdf.add_page()
+        pdf.add_table(headers, rows)
+        layout = time.perf_counter() - start
+        data = pdf.output(dest='S').encode('latin-1')
+        results.append((count, layout, time.perf_counter() - start, pdf.page_no(), len(data)))
+    return results
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark PDF table layout")
+    parser.add_argument("rows", nargs="*", type=int, default=[100, 1000, 10000])
+    args = parser.parse_args()
+    for count, layout, total, pages, size in bench_table(args.rows):
+        print(f"{count:>7,} rows: layout {layout:.2f}s, total {total:.2f}s "
+              f"({total / count * 1000:.3f} ms/row), {pages} pages, {size:,} B")
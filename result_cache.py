@@ -0,0 +1,232 @@
+"""Persistent, content-addressed cache for WSP analysis results.
+
+Entries are keyed on the SHA-256 of the uploaded PDF bytes, a hash of the
+analysis prompt and stage versions (see stages.pipeline_fingerprint) and the
+model name, so a re-upload of the same recording returns the stored report
+without a new Gemini call or re-rendering.
+
+Usage:
+    python result_cache.py list
+    python result_cache.py stats
+    python result_cache.py purge [--older-than DAYS] [--key KEY] [--all]
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from datetime import datetime
+
+DEFAULT_CACHE_DIR = os.getenv("WSP_CACHE_DIR", ".wsp_cache")
+DEFAULT_MAX_BYTES = int(float(os.getenv("WSP_CACHE_MAX_MB", "512")) * 1024 * 1024)
+DEFAULT_MAX_AGE_DAYS = float(os.getenv("WSP_CACHE_MAX_AGE_DAYS", "30"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    pdf_sha256 TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    graph_period TEXT,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size_bytes INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    key TEXT NOT NULL REFERENCES entries(key) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (key, name)
+);
+CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed_at);
+"""
+
+
+def sha256_hex(data):
+    """Hex SHA-256 of bytes or text"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_key(pdf_bytes, prompt, model):
+    """Build the cache key for one (PDF, prompt or pipeline fingerprint, model) combination"""
+    parts = (sha256_hex(pdf_bytes), sha256_hex(prompt), model)
+    return sha256_hex("\n".join(parts)), parts
+
+
+class ResultCache:
+    """SQLite-backed store of reports and their rendered artifacts"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 86400
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, "cache.sqlite")
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA journal_mode = WAL")
+        return conn
+
+    def get(self, key):
+        """Return {'graph_period': ..., 'artifacts': {name: bytes}} or None"""
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT graph_period, created_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            graph_period, created_at = row
+            if self.max_age_seconds and time.time() - created_at > self.max_age_seconds:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            artifacts = dict(conn.execute(
+                "SELECT name, data FROM artifacts WHERE key = ?", (key,)
+            ).fetchall())
+        return {"graph_period": graph_period, "artifacts": artifacts}
+
+    def put(self, key, key_parts, graph_period, artifacts):
+        """Store artifacts (name -> bytes/str) under key, then evict"""
+        blobs = {
+            name: data.encode("utf-8") if isinstance(data, str) else bytes(data)
+            for name, data in artifacts.items() if data is not None
+        }
+        size = sum(len(b) for b in blobs.values())
+        now = time.time()
+        pdf_sha256, prompt_hash, model = key_parts
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            conn.execute(
+                "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, pdf_sha256, prompt_hash, model, graph_period, now, now, size),
+            )
+            conn.executemany(
+                "INSERT INTO artifacts (key, name, data) VALUES (?, ?, ?)",
+                [(key, name, blob) for name, blob in blobs.items()],
+            )
+        self.evict()
+
+    def add_artifact(self, key, name, data):
+        """Attach one more artifact to an existing entry (e.g. a late-built PDF)"""
+        blob = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+        with closing(self._connect()) as conn, conn:
+            cur = conn.execute(
+                "INSERT OR REPLACE INTO artifacts (key, name, data) "
+                "SELECT key, ?, ? FROM entries WHERE key = ?", (name, blob, key),
+            )
+            if cur.rowcount:
+                conn.execute(
+                    "UPDATE entries SET size_bytes = (SELECT SUM(LENGTH(data)) FROM artifacts "
+                    "WHERE artifacts.key = entries.key) WHERE key = ?", (key,),
+                )
+        self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least-recently used ones over the size budget"""
+        removed = 0
+        with closing(self._connect()) as conn, conn:
+            if self.max_age_seconds:
+                removed += conn.execute(
+                    "DELETE FROM entries WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+                ).rowcount
+            if self.max_bytes:
+                total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM entries").fetchone()[0]
+                if total > self.max_bytes:
+                    for key, size in conn.execute(
+                        "SELECT key, size_bytes FROM entries ORDER BY accessed_at"
+                    ).fetchall():
+                        if total <= self.max_bytes:
+                            break
+                        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                        total -= size
+                        removed += 1
+        return removed
+
+    def entries(self):
+        """List entry metadata, most recently used first"""
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "SELECT e.key, e.pdf_sha256, e.model, e.graph_period, e.created_at, "
+                "e.accessed_at, e.size_bytes, GROUP_CONCAT(a.name) "
+                "FROM entries e LEFT JOIN artifacts a ON a.key = e.key "
+                "GROUP BY e.key ORDER BY e.accessed_at DESC"
+            )
+            columns = ["key", "pdf_sha256", "model", "graph_period", "created_at",
+                       "accessed_at", "size_bytes", "artifacts"]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    def artifacts_named(self, name):
+        """(pdf_sha256, graph_period, data) of every entry holding the named artifact"""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT e.pdf_sha256, e.graph_period, a.data FROM entries e "
+                "JOIN artifacts a ON a.key = e.key WHERE a.name = ?", (name,),
+            ).fetchall()
+
+    def purge(self, key=None, older_than_days=None):
+        """Delete one entry, entries older than N days, or everything"""
+        with closing(self._connect()) as conn, conn:
+            if key:
+                cur = conn.execute("DELETE FROM entries WHERE key LIKE ?", (key + "%",))
+            elif older_than_days is not None:
+                cur = conn.execute(
+                    "DELETE FROM entries WHERE created_at < ?",
+                    (time.time() - older_than_days * 86400,),
+                )
+            else:
+                cur = conn.execute("DELETE FROM entries")
+            removed = cur.rowcount
+        with closing(self._connect()) as conn:
+            conn.execute("VACUUM")
+        return removed
+
+
+# --- CLI ---
+def _format_time(ts):
+    return datetime.fromtimestamp(ts).strftime("%d-%m-%Y %H:%M:%S")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and purge the WSP analysis cache")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="List cached reports")
+    sub.add_parser("stats", help="Show cache size and entry count")
+    purge = sub.add_parser("purge", help="Delete cached reports")
+    purge.add_argument("--key", help="Delete the entry with this key (prefix)")
+    purge.add_argument("--older-than", type=float, metavar="DAYS",
+                       help="Delete entries created more than DAYS ago")
+    purge.add_argument("--all", action="store_true", help="Delete every entry")
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.cache_dir)
+    if args.command == "list":
+        for e in cache.entries():
+            print(f"{e['key'][:16]}  {e['model']:<20} {e['size_bytes'] / 1024:>9.1f} KB  "
+                  f"created {_format_time(e['created_at'])}  used {_format_time(e['accessed_at'])}  "
+                  f"{e['graph_period'] or '-'}  [{e['artifacts'] or ''}]")
+    elif args.command == "stats":
+        entries = cache.entries()
+        total = sum(e["size_bytes"] for e in entries)
+        print(f"Cache dir : {os.path.abspath(cache.cache_dir)}")
+        print(f"Entries   : {len(entries)}")
+        print(f"Size      : {total / 1024 / 1024:.2f} MB of {cache.max_bytes / 1024 / 1024:.0f} MB")
+    elif args.command == "purge":
+        if not (args.key or args.older_than is not None or args.all):
+            parser.error("purge needs --key, --older-than or --all")
+        removed = cache.purge(key=args.key, older_than_days=args.older_than)
+        print(f"Removed {removed} entr{'y' if removed == 1 else 'ies'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,342 @@
+"""Spread Gemini requests over a pool of API keys and models.
+
+Every (API key, model) pair is an endpoint with its own token-bucket quota.
+A request waits for the endpoint of its model that frees up first, in
+priority order, so an interactive upload goes ahead of every queued batch
+page. Each model has its own queue: requests for a model whose keys are all
+busy never hold up those of another model. A 429 puts that endpoint on a cooldown (doubling with each
+consecutive 429) and the request moves on to another key; a timeout, or a
+model whose keys keep answering 429, falls back to the next model in the
+chain. Only when the whole chain is exhausted does the caller get a
+``ModelUnavailable`` with a message fit to show the user.
+
+Configuration (environment):
+    GEMINI_API_KEY       the primary key
+    GEMINI_API_KEYS      more keys, comma-separated
+    WSP_MODELS           fallback chain with requests per minute per key,
+                         default "gemini-2.5-flash:30,gemini-2.5-flash-lite:30" (0: no quota)
+    WSP_MODEL_TIMEOUT    seconds before a request falls back (default 120)
+    WSP_MODEL_BURST      requests a key may send back to back (default 1)
+    WSP_GEMINI_ENDPOINT  http://host:port of a fake server (synthetic.py server)
+
+Usage:
+    python scheduler.py simulate --requests 60 --keys 3 --rpm 20 --throttle-rate 0.1
+"""
+import argparse
+import heapq
+import itertools
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import metrics
+
+INTERACTIVE = 0  # uploads someone is watching
+BATCH = 1
+
+DEFAULT_MODELS = "gemini-2.5-flash:30,gemini-2.5-flash-lite:30"
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_BURST = 1
+BASE_COOLDOWN = 2.0
+MAX_COOLDOWN = 60.0
+
+
+class ModelUnavailable(RuntimeError):
+    """Every key of every model in the chain was throttled, failed or timed out"""
+
+
+def failure_kind(error):
+    """'throttled', 'timeout' or 'unavailable' for errors worth another endpoint, else None"""
+    # Loaded with the SDK by the time a request fails, so not imported up front. The REST
+    # transport (WSP_GEMINI_ENDPOINT) raises requests' own timeouts and connection errors.
+    from google.api_core import exceptions as api_exceptions
+    from requests import exceptions as requests_exceptions
+
+    if isinstance(error, api_exceptions.TooManyRequests):  # includes ResourceExhausted
+        return "throttled"
+    if isinstance(error, (api_exceptions.DeadlineExceeded, requests_exceptions.Timeout, TimeoutError)):
+        return "timeout"
+    if isinstance(error, (api_exceptions.ServiceUnavailable, api_exceptions.InternalServerError,
+                          requests_exceptions.ConnectionError, ConnectionError)):
+        return "unavailable"
+    return None
+
+
+# --- Quotas ---
+class TokenBucket:
+    """Requests-per-minute quota refilled continuously, holding at most ``burst`` tokens
+
+    A rate of 0 means no quota. Not thread-safe on its own; the scheduler
+    calls it under its lock.
+    """
+
+    def __init__(self, requests_per_minute, burst=DEFAULT_BURST):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available"""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        if not self.rate:
+            return
+        self._refill(now)
+        self.tokens -= 1
+
+
+@dataclass
+class Endpoint:
+    """One API key serving one model"""
+    api_key: str
+    model_name: str
+    bucket: TokenBucket
+    cooldown_until: float = 0.0
+    strikes: int = 0  # consecutive 429s
+    in_flight: int = 0
+
+    @property
+    def label(self):
+        return f"{self.model_name} key …{self.api_key[-4:]}" if self.api_key else self.model_name
+
+    def ready_in(self, now):
+        return max(self.cooldown_until - now, self.bucket.wait_time(now))
+
+
+def parse_models(spec):
+    """[(model name, requests per minute per key)] from e.g. 'gemini-2.5-flash:30,gemini-2.5-flash-lite'"""
+    models = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rpm = item.partition(":")
+        models.append((name.strip(), float(rpm) if rpm else 30.0))
+    return models
+
+
+def api_keys_from_env(primary=None):
+    """The primary key followed by GEMINI_API_KEYS, without duplicates"""
+    keys = [primary or os.getenv("GEMINI_API_KEY")] + os.getenv("GEMINI_API_KEYS", "").split(",")
+    keys = [key.strip() for key in keys if key and key.strip() and key.strip() != "YOUR_API_KEY_HERE"]
+    return list(dict.fromkeys(keys))
+
+
+# --- Scheduler ---
+class ModelScheduler:
+    """Runs model requests on the best available (key, model) endpoint
+
+    ``model_factory(model_name, api_key)`` returns the model object a
+    request is called with; ``models`` is the fallback chain as
+    [(name, requests per minute per key)].
+    """
+
+    def __init__(self, api_keys, models, model_factory, timeout=DEFAULT_TIMEOUT, burst=DEFAULT_BURST,
+                 attempts_per_model=None):
+        self.api_keys = list(api_keys) or [None]
+        self.models = list(models)
+        self.model_factory = model_factory
+        self.timeout = timeout
+        self.burst = burst
+        self.attempts_per_model = attempts_per_model or len(self.api_keys) + 2
+        self.endpoints = {name: [Endpoint(key, name, TokenBucket(rpm, burst)) for key in self.api_keys]
+                          for name, rpm in self.models}
+        self._cond = threading.Condition()
+        self._queues = {name: [] for name in self.endpoints}  # model -> heap of (priority, sequence) tickets
+        self._sequence = itertools.count()
+
+    @classmethod
+    def from_env(cls, model_factory, api_key=None):
+        return cls(api_keys_from_env(api_key), parse_models(os.getenv("WSP_MODELS") or DEFAULT_MODELS),
+                   model_factory, timeout=float(os.getenv("WSP_MODEL_TIMEOUT", DEFAULT_TIMEOUT)),
+                   burst=int(os.getenv("WSP_MODEL_BURST", DEFAULT_BURST)))
+
+    def chain(self, model_name):
+        """The model followed by its fallbacks"""
+        names = [name for name, _ in self.models]
+        if model_name in names:
+            return names[names.index(model_name):]
+        with self._cond:
+            if model_name not in self.endpoints:  # not configured: the first model's quota
+                rpm = self.models[0][1] if self.models else 30.0
+                self.endpoints[model_name] = [Endpoint(key, model_name, TokenBucket(rpm, self.burst))
+                                              for key in self.api_keys]
+                self._queues[model_name] = []
+        return [model_name] + names
+
+    def acquire(self, model_name, priority=BATCH):
+        """Wait for this request's turn in the model's queue and a free endpoint, then take its token"""
+        ticket = (priority, next(self._sequence))
+        endpoints = self.endpoints[model_name]
+        queue = self._queues[model_name]
+        with self._cond:
+            heapq.heappush(queue, ticket)
+            try:
+                while True:
+                    wait = None  # until the head of the queue changes
+                    if queue[0] == ticket:
+                        now = time.monotonic()
+                        endpoint = min(endpoints, key=lambda e: (e.ready_in(now), e.in_flight))
+                        wait = endpoint.ready_in(now)
+                        if wait <= 0:
+                            endpoint.bucket.take(now)
+                            endpoint.in_flight += 1
+                            return endpoint
+                    self._cond.wait(wait)
+            finally:
+                queue.remove(ticket)
+                heapq.heapify(queue)
+                self._cond.notify_all()
+
+    def release(self, endpoint, kind=None):
+        """Return an endpoint after a request; a 429 (kind 'throttled') starts its cooldown"""
+        with self._cond:
+            endpoint.in_flight -= 1
+            if kind == "throttled":
+                endpoint.strikes += 1
+                cooldown = min(MAX_COOLDOWN, BASE_COOLDOWN * 2 ** (endpoint.strikes - 1))
+                endpoint.cooldown_until = time.monotonic() + cooldown
+            elif kind is None:
+                endpoint.strikes = 0
+            self._cond.notify_all()
+
+    def call(self, request, model_name, priority=BATCH, on_answer=None):
+        """``request(model, timeout)`` on the best endpoint, retrying on other keys and models
+
+        429s and server faults move on to another key of the same model; a
+        timeout, or running out of attempts, falls back to the next model.
+        Other errors (bad request, invalid key, broken answer) are raised as is.
+        ``on_answer(name)`` is told which model answered; a fallback when it
+        is not ``model_name``.
+        """
+        chain = self.chain(model_name)
+        failures = []
+        for position, name in enumerate(chain):
+            for _ in range(self.attempts_per_model):
+                with metrics.span("model_queue"):
+                    endpoint = self.acquire(name, priority)
+                try:
+                    result = request(self.model_factory(name, endpoint.api_key), self.timeout)
+                except Exception as e:
+                    kind = failure_kind(e)
+                    self.release(endpoint, kind or "error")
+                    metrics.count("model_requests", model=name, result=kind or "error")
+                    if kind is None:
+                        raise
+                    failures.append(kind)
+                    if kind == "timeout":
+                        break
+                    continue
+                self.release(endpoint)
+                metrics.count("model_requests", model=name, result="ok")
+                if position:
+                    metrics.count("model_fallbacks", model=name)
+                if on_answer:
+                    on_answer(name)
+                return result
+        keys = len(self.api_keys)
+        raise ModelUnavailable(
+            f"Gemini is busy: {len(failures)} attempts on {keys} API key{'' if keys == 1 else 's'} "
+            f"({', '.join(chain)}) were rate limited or timed out. Please try again in a minute."
+        )
+
+    def status(self):
+        """[(endpoint label, seconds until ready, consecutive 429s)]"""
+        now = time.monotonic()
+        with self._cond:
+            return [(e.label, round(max(0.0, e.ready_in(now)), 1), e.strikes)
+                    for endpoints in self.endpoints.values() for e in endpoints]
+
+
+# --- Simulation ---
+def simulate(requests=60, keys=3, rpm=20.0, throttle_rate=0.1, latency=0.3, primary_latency=None,
+             timeout=5.0, concurrency=8, interactive_every=5, burst=DEFAULT_BURST):
+    """Drive the real SDK through the scheduler against a local fake server; returns a summary dict
+
+    The server enforces ``rpm`` per key and model and throttles a further
+    ``throttle_rate`` share at random; a ``primary_latency`` above
+    ``timeout`` makes the first model time out so requests fall back.
+    """
+    from synthetic import FakeGeminiServer
+
+    models = parse_models(DEFAULT_MODELS)
+    delays = {name: latency for name, _ in models}
+    if primary_latency is not None:
+        delays[models[0][0]] = primary_latency
+    with FakeGeminiServer(latency=delays, rpm=rpm, throttle_rate=throttle_rate) as server:
+        os.environ["WSP_GEMINI_ENDPOINT"] = server.url
+        import analyzer
+
+        scheduler = ModelScheduler([f"sim-key-{i}" for i in range(keys)], [(name, rpm) for name, _ in models],
+                                   analyzer.get_model, timeout=timeout, burst=burst)
+
+        def one(index):
+            priority = INTERACTIVE if interactive_every and index % interactive_every == 0 else BATCH
+            started = time.perf_counter()
+            try:
+                scheduler.call(lambda model, seconds: model.generate_content(
+                    "ping", request_options={"timeout": seconds}).text, models[0][0], priority)
+                ok = True
+            except ModelUnavailable:
+                ok = False
+            return priority, ok, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            outcomes = list(pool.map(one, range(requests)))
+        elapsed = time.perf_counter() - started
+        stats = dict(server.stats)
+
+    def median_latency(priority):
+        values = [seconds for p, ok, seconds in outcomes if p == priority and ok]
+        return round(statistics.median(values), 2) if values else None
+
+    return {
+        "requests": requests,
+        "completed": sum(ok for _, ok, _ in outcomes),
+        "seconds": round(elapsed, 2),
+        "throughput_rpm": round(sum(ok for _, ok, _ in outcomes) / elapsed * 60, 1),
+        "server_429s": sum(n for (_, _, status), n in stats.items() if status == 429),
+        "timed_out": sum(n for (_, _, status), n in stats.items() if status == "dropped"),
+        "answered_by": {name: sum(n for (_, model, status), n in stats.items() if model == name and status == 200)
+                        for name, _ in models},
+        "median_seconds_interactive": median_latency(INTERACTIVE),
+        "median_seconds_batch": median_latency(BATCH),
+    }
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Model request scheduling")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sim = sub.add_parser("simulate", help="Measure throughput against a local fake Gemini server")
+    sim.add_argument("--requests", type=int, default=60)
+    sim.add_argument("--keys", type=int, default=3, help="Simulated API keys")
+    sim.add_argument("--rpm", type=float, default=20.0, help="Quota per key and model")
+    sim.add_argument("--throttle-rate", type=float, default=0.1, help="Share of extra random 429s")
+    sim.add_argument("--latency", type=float, default=0.3, help="Seconds per request")
+    sim.add_argument("--primary-latency", type=float, help="Seconds per request on the first model")
+    sim.add_argument("--timeout", type=float, default=5.0, help="Seconds before falling back")
+    sim.add_argument("--concurrency", type=int, default=8)
+    sim.add_argument("--interactive-every", type=int, default=5, help="Every Nth request is interactive")
+    args = parser.parse_args(argv)
+
+    summary = simulate(args.requests, args.keys, args.rpm, args.throttle_rate, args.latency,
+                       args.primary_latency, args.timeout, args.concurrency, args.interactive_every)
+    for name, value in summary.items():
+        print(f"{name:<28} {value}")
+    return 0 if summary["completed"] == summary["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""Headless WSP analyzer: an async HTTP endpoint and a one-shot CLI.
+
+Both take raw PDF bytes (or a CSV/NPY recorder export) and return the report as JSON, markdown or the
+generated PDF, using the same pipeline, cache and shared Gemini client as
+the Streamlit app, without importing Streamlit.
+
+``serve`` warms the pipeline up before accepting connections (see
+warmup.py); with ``--workers N`` it then forks N workers that share the
+listening socket and the already loaded modules.
+
+Usage:
+    python service.py serve --host 0.0.0.0 --port 8080 --workers 4
+    curl --data-binary @graph.pdf -H "Content-Type: application/pdf" \\
+        "http://localhost:8080/analyze?format=json"
+    curl http://localhost:8080/metrics
+
+    python service.py analyze graph.pdf --format pdf --out report.pdf
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import signal
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from analyzer import MODEL_NAME, configure
+from history import AnalysisHistory
+from jobs import DONE, AnalysisJob, in_flight_count
+from memory_budget import BUDGET
+from metrics import REGISTRY
+from recorder_data import is_recorder_data
+from report_schema import to_markdown
+from result_cache import ResultCache
+from warmup import warm_up
+
+MAX_CONCURRENT_JOBS = int(os.getenv("WSP_MAX_CONCURRENT_JOBS", "8"))
+MAX_UPLOAD_BYTES = int(float(os.getenv("WSP_MAX_UPLOAD_MB", "50")) * 1024 * 1024)
+FORMATS = ("json", "markdown", "pdf", "txt")
+
+
+def run_analysis(pdf_bytes, name="upload.pdf", cache=None, fast_path=True, model_name=MODEL_NAME, history=None):
+    """Run the full pipeline synchronously and return the finished job"""
+    job = AnalysisJob(pdf_bytes, name, cache=cache, fast_path=fast_path, model_name=model_name, history=history)
+    job.run()
+    return job
+
+
+def job_to_dict(job, include_pdf=False):
+    """JSON-serializable view of a finished job"""
+    result = {
+        "file_name": job.file_name,
+        "status": job.status,
+        "error": job.error,
+        "graph_period": job.graph_period,
+        "cached": job.from_cache,
+        "coalesced": job.coalesced,
+        "engine": "Cache" if job.from_cache else ("Rules" if job.rules_only else "Gemini"),
+        "report": job.report.to_dict() if job.report else None,
+        "report_markdown": to_markdown(job.report) if job.report else None,
+        "timings": job.trace.stage_totals() if job.trace else {},
+    }
+    if include_pdf and job.pdf_data:
+        result["report_pdf_base64"] = base64.b64encode(job.pdf_data).decode("ascii")
+    return result
+
+
+def render_output(job, output_format, include_pdf=False):
+    """(body bytes, content type) for the requested output format"""
+    if output_format == "pdf":
+        return job.pdf_data, "application/pdf"
+    if output_format == "txt":
+        return (job.text_content.encode("utf-8") if job.text_content else None), "text/plain; charset=utf-8"
+    if output_format == "markdown":
+        return to_markdown(job.report).encode("utf-8"), "text/markdown; charset=utf-8"
+    return json.dumps(job_to_dict(job, include_pdf)).encode("utf-8"), "application/json"
+
+
+# --- HTTP Service ---
+def create_app(cache=None, max_concurrent=MAX_CONCURRENT_JOBS, history=None):
+    """Starlette app exposing POST /analyze, GET /healthz and GET /metrics (Prometheus text)"""
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, PlainTextResponse, Response
+    from starlette.routing import Route
+
+    executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="wsp-http")
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def analyze(request):
+        output_format = request.query_params.get("format", "json")
+        if output_format not in FORMATS:
+            return JSONResponse({"error": f"format must be one of {', '.join(FORMATS)}"}, status_code=400)
+        pdf_bytes = await request.body()
+        if len(pdf_bytes) > MAX_UPLOAD_BYTES:
+            return JSONResponse({"error": "PDF too large"}, status_code=413)
+        if not (pdf_bytes.startswith(b"%PDF") or is_recorder_data(pdf_bytes)):
+            return JSONResponse({"error": "Request body must be a PDF file or a CSV/NPY recorder export"},
+                                status_code=400)
+
+        fast_path = request.query_params.get("fast_path", "1") not in ("0", "false", "no")
+        name = request.query_params.get("name", "upload.pdf")
+        async with semaphore:
+            job = await asyncio.get_running_loop().run_in_executor(
+                executor, lambda: run_analysis(pdf_bytes, name, cache, fast_path, history=history)
+            )
+        if job.status != DONE:
+            return JSONResponse(job_to_dict(job), status_code=502)
+        include_pdf = request.query_params.get("include_pdf", "0") in ("1", "true", "yes")
+        body, content_type = render_output(job, output_format, include_pdf)
+        if body is None:
+            return JSONResponse({"error": f"{output_format} output not available",
+                                 **job_to_dict(job)}, status_code=500)
+        return Response(body, media_type=content_type)
+
+    async def healthz(request):
+        return JSONResponse({"status": "ok", "model": MODEL_NAME, "in_flight": in_flight_count(),
+                             "memory": BUDGET.status()})
+
+    async def metrics_endpoint(request):
+        return PlainTextResponse(REGISTRY.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+    app = Starlette(routes=[
+        Route("/analyze", analyze, methods=["POST"]),
+        Route("/healthz", healthz, methods=["GET"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+    ])
+    app.state.executor = executor
+    return app
+
+
+def run_server(host, port, cache=None, history=None, workers=1, warm=True):
+    """Run the HTTP endpoint, warmed up first; workers > 1 pre-forks that many processes"""
+    import uvicorn
+    if warm:
+        warm_up()
+    if workers <= 1:
+        uvicorn.run(create_app(cache, history=history), host=host, port=port)
+        return 0
+    if not hasattr(os, "fork"):
+        raise RuntimeError("--workers needs a platform with fork()")
+
+    # Bind once in the parent; every worker accepts on the inherited socket
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # Thread pools and the Gemini client are created after the fork, per worker
+            config = uvicorn.Config(create_app(cache, history=history), host=host, port=port)
+            uvicorn.Server(config).run(sockets=[sock])
+            os._exit(0)
+        children.append(pid)
+    sock.close()
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    status = 0
+    for pid in children:
+        _, wait_status = os.waitpid(pid, 0)
+        status = status or os.waitstatus_to_exitcode(wait_status)
+    return status
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless WSP graph analyzer")
+    parser.add_argument("--no-cache", action="store_true", help="Skip the result cache")
+    parser.add_argument("--no-history", action="store_true", help="Do not record results in the history")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="Run the HTTP endpoint")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--workers", type=int, default=1,
+                       help="Pre-fork this many worker processes after warming up")
+    serve.add_argument("--no-warm", action="store_true", help="Skip the start-up warm-up")
+
+    analyze = sub.add_parser("analyze", help="Analyze one PDF and write the report")
+    analyze.add_argument("pdf", help="Path to the graph PDF or recorder export ('-' for stdin)")
+    analyze.add_argument("--format", choices=FORMATS, default="json")
+    analyze.add_argument("--out", help="Output file (default: stdout)")
+    analyze.add_argument("--no-fast-path", action="store_true",
+                         help="Send the graph to the model even if it is clearly normal")
+    args = parser.parse_args(argv)
+
+    if not configure():
+        parser.error("set GEMINI_API_KEY in the environment")
+    cache = None if args.no_cache else ResultCache()
+    history = None if args.no_history else AnalysisHistory()
+
+    if args.command == "serve":
+        return run_server(args.host, args.port, cache, history, args.workers, warm=not args.no_warm)
+
+    if args.pdf == "-":
+        pdf_bytes, name = sys.stdin.buffer.read(), "stdin.pdf"
+    else:
+        with open(args.pdf, "rb") as f:
+            pdf_bytes, name = f.read(), os.path.basename(args.pdf)
+    job = run_analysis(pdf_bytes, name, cache, fast_path=not args.no_fast_path, history=history)
+    if job.status != DONE:
+        print(job.error or job.status, file=sys.stderr)
+        return 1
+
+    body, _ = render_output(job, args.format)
+    if body is None:
+        error = job.artifacts.errors.get(f"report.{args.format}") if job.artifacts else None
+        print(f"{args.format} output not available: {error or 'nothing was built'}", file=sys.stderr)
+        return 1
+    if args.out:
+        with open(args.out, "wb") as f:
+            f.write(body)
+    else:
+        sys.stdout.buffer.write(body)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""Measured slip phases and dump-valve cycles from the extracted traces.
+
+The model reads "Phase of Anomaly" times off the image by eye. Here they are
+computed from the numbers instead: the slip ratio of every axle against the
+reference speed is thresholded with hysteresis (a phase opens when slip
+reaches ``enter`` and closes once it falls below ``exit``), phase edges are
+interpolated between samples, and each phase is matched to the dump-valve
+pulses around it. The recorder draws one valve trace per axle, so a pulse
+opening is the BV (vent) activation and its end the EV closure.
+
+Everything is vectorized; a million-sample series takes tens of
+milliseconds. ``with_measurements`` writes the results into the report
+tables of model-analyzed pages.
+"""
+from dataclasses import dataclass, replace
+
+import numpy as np
+
+from classifier import effective_reference
+from report_schema import CANNOT_DETERMINE, CONCLUSIONS
+from trace_extraction import format_intervals
+
+# Bump when the detection below changes, so cached reports are rebuilt
+SLIP_VERSION = 3
+
+# Conclusions under which a row's phase is the measured one
+AFFECTED_CONCLUSIONS = [c for c in CONCLUSIONS if c not in ("Normal Operation", CANNOT_DETERMINE)]
+
+
+@dataclass
+class SlipParameters:
+    """Detection limits; slip ratios are fractions of the reference speed"""
+    enter: float = 0.10  # slip ratio that opens a phase
+    exit: float = 0.05  # ...and the level it must fall below to close it
+    min_reference: float = 5.0  # near standstill slip is undefined; phases close
+    min_duration: float = 0.1  # seconds; shorter phases are trace noise
+    merge_gap: float = 0.25  # seconds; phases closer than this are one phase
+    valve_lead: float = 0.5  # valve pulses opening this long before a phase belong to it
+    valve_lag: float = 3.0  # ...and those opening up to this long after recovery, however late they close
+    min_coverage: float = 0.2  # axles visible over less of the plot are not measured
+
+
+@dataclass
+class SlipPhases:
+    """Slip phases of one axle with the valve activity matched to each"""
+    axle: int
+    intervals: np.ndarray  # (n, 2) [start, end] seconds
+    peak_slip: np.ndarray  # (n,) largest slip ratio within each phase
+    valve_cycles: np.ndarray  # (n,) dump-valve pulses matched to each phase
+    activation_delay: np.ndarray  # (n,) first BV opening after phase start, s; NaN without pulses
+    closure_lag: np.ndarray  # (n,) last EV closure after recovery, s; NaN without pulses
+    total_valve_cycles: int
+    unmatched_valve_cycles: int  # pulses outside every phase's window
+
+
+def slip_ratio(speed, reference, min_reference=SlipParameters.min_reference):
+    """(reference - speed) / reference; 0 where the reference is below min_reference, NaN where unknown"""
+    speed = np.asarray(speed, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    moving = reference >= min_reference  # False for NaN
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = np.where(moving, (reference - speed) / reference, 0.0)
+    ratio[np.isnan(reference)] = np.nan
+    return ratio
+
+
+def hysteresis(signal, enter, exit):
+    """Boolean state that turns on where signal >= enter and off once it drops below exit
+
+    NaN samples (trace not visible) keep the current state.
+    """
+    events = np.full(len(signal), -1, np.int8)
+    with np.errstate(invalid="ignore"):
+        events[signal < exit] = 0
+        events[signal >= enter] = 1
+    last = np.where(events >= 0, np.arange(len(signal)), -1)
+    np.maximum.accumulate(last, out=last)
+    return (events[last] == 1) & (last >= 0)
+
+
+def _runs(state):
+    """(starts, ends) index arrays of the True runs; ends are exclusive"""
+    edges = np.diff(state.view(np.int8), prepend=0, append=0)
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _crossing(times, signal, left, right, level, fallback):
+    """Interpolated time where signal crosses level between samples left and right"""
+    t0, t1 = times[left], times[right]
+    s0, s1 = signal[left], signal[right]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = np.clip((level - s0) / (s1 - s0), 0.0, 1.0)
+    return np.where(np.isfinite(fraction), t0 + fraction * (t1 - t0), fallback)
+
+
+def phase_intervals(times, slip, params):
+    """(intervals, start indices, end indices) of the hysteresis phases of one slip series"""
+    starts, ends = _runs(hysteresis(slip, params.enter, params.exit))
+    if not len(starts):
+        return np.empty((0, 2)), starts, ends
+    last = len(times) - 1
+    before = np.maximum(starts - 1, 0)
+    after = np.minimum(ends, last)
+    start_times = _crossing(times, slip, before, starts, params.enter, times[starts])
+    end_times = _crossing(times, slip, ends - 1, after, params.exit, times[ends - 1])
+
+    # Merge phases separated by short gaps, then drop blips
+    keep = start_times[1:] - end_times[:-1] >= params.merge_gap
+    opens, closes = np.concatenate(([True], keep)), np.concatenate((keep, [True]))
+    starts, start_times = starts[opens], start_times[opens]
+    ends, end_times = ends[closes], end_times[closes]
+    long_enough = end_times - start_times >= params.min_duration
+    return (np.column_stack((start_times[long_enough], end_times[long_enough])),
+            starts[long_enough], ends[long_enough])
+
+
+def match_valve_pulses(intervals, pulses, lead, lag):
+    """Per phase: (pulse count, first index, last index) of the pulses opening in [start - lead, end + lag]
+
+    A pulse belongs to a phase by its opening (the BV activation); it may
+    close after the window, which is the delayed closure ``closure_lag``
+    reports. Pulses are sorted, so each window is two binary searches.
+    """
+    pulses = np.asarray(pulses, dtype=float).reshape(-1, 2)
+    first = np.searchsorted(pulses[:, 0], intervals[:, 0] - lead, side="left")
+    stop = np.searchsorted(pulses[:, 0], intervals[:, 1] + lag, side="right")
+    return np.maximum(stop - first, 0), first, stop - 1
+
+
+def measure_axle(times, speed, reference, pulses, axle, params=None):
+    """SlipPhases of one axle"""
+    params = params or SlipParameters()
+    slip = slip_ratio(speed, reference, params.min_reference)
+    intervals, starts, ends = phase_intervals(times, slip, params)
+    pulses = np.asarray(pulses, dtype=float).reshape(-1, 2)
+
+    if len(intervals):
+        # Peak per phase: reduce over [start, end) segments, every other result is a gap
+        padded = np.append(np.nan_to_num(slip, nan=0.0), 0.0)
+        peak_slip = np.maximum.reduceat(padded, np.column_stack((starts, ends)).ravel())[::2]
+    else:
+        peak_slip = np.empty(0)
+    counts, first, last = match_valve_pulses(intervals, pulses, params.valve_lead, params.valve_lag)
+    matched = counts > 0
+    activation_delay = np.full(len(intervals), np.nan)
+    closure_lag = np.full(len(intervals), np.nan)
+    activation_delay[matched] = pulses[first[matched], 0] - intervals[matched, 0]
+    closure_lag[matched] = pulses[last[matched], 1] - intervals[matched, 1]
+
+    # Pulses covered by at least one window
+    cover = np.zeros(len(pulses) + 1, int)
+    np.add.at(cover, first[matched], 1)
+    np.add.at(cover, last[matched] + 1, -1)
+    unmatched = int((np.cumsum(cover[:-1]) == 0).sum())
+    return SlipPhases(axle, intervals, peak_slip, counts, activation_delay, closure_lag, len(pulses), unmatched)
+
+
+def measure_slip(traces, params=None):
+    """{axle: SlipPhases} for every axle visible enough to measure; {} without traces"""
+    params = params or SlipParameters()
+    if traces is None or not traces.axles:
+        return {}
+    reference = effective_reference(traces)
+    return {axle: measure_axle(traces.time, traces.axles[axle], reference,
+                               traces.valves.get(axle, np.empty((0, 2))), axle, params)
+            for axle in sorted(traces.axles) if traces.coverage.get(axle, 0.0) >= params.min_coverage}
+
+
+# --- Report Tables ---
+def with_measurements(report, traces, params=None):
+    """The report with measured phases and valve cycles in its axle and WSP tables
+
+    Only time-calibrated traces are used. Measured phases replace the
+    model's estimate only on axles it concluded were affected, so condition,
+    phase and conclusion of a row always agree; the valve cycles go in the
+    WSP rows' own ``measured`` field, leaving the model's BV/EV states as
+    they are.
+    """
+    if traces is None or traces.calibration.time_range[1] is None:
+        return report
+    measured = measure_slip(traces, params)
+    if not measured:
+        return report
+    axles, wsp = [], []
+    for row in report.axles:
+        phases = measured.get(row.axle)
+        if phases is not None and len(phases.intervals) and row.conclusion in AFFECTED_CONCLUSIONS:
+            row = replace(row, phase=format_intervals(phases.intervals))
+        axles.append(row)
+    for row in report.wsp:
+        phases = measured.get(row.axle)
+        if phases is not None and phases.total_valve_cycles:
+            summary = valve_summary(phases)
+            lags = phases.closure_lag[np.isfinite(phases.closure_lag)]
+            if len(lags):
+                summary += f"; closed {_offset(lags.max())} recovery"
+            row = replace(row, measured=summary)
+        wsp.append(row)
+    return replace(report, axles=axles, wsp=wsp)
+
+
+def _offset(seconds):
+    return f"{abs(seconds):.2f}s {'after' if seconds >= 0 else 'before'}"
+
+
+def valve_summary(phases):
+    """e.g. '7 valve cycles in 2 slide phases, first 0.25s after onset'"""
+    cycles = phases.total_valve_cycles
+    text = f"{cycles} valve cycle{'' if cycles == 1 else 's'}"
+    matched = int((phases.valve_cycles > 0).sum())
+    if matched:
+        delays = phases.activation_delay[np.isfinite(phases.activation_delay)]
+        text += f" in {matched} slide phase{'' if matched == 1 else 's'}, first {_offset(delays[0])} onset"
+    if phases.unmatched_valve_cycles:
+        text += f", {phases.unmatched_valve_cycles} without slide"
+    return text
@@ -0,0 +1,308 @@
+"""Dependency-tracked analysis stages with stored intermediate outputs.
+
+Re-analysing the fleet after a change should only redo the stages the change
+affects. Every stage output is stored under a key built from a hash of the
+stage's input and the stage's version:
+
+    ingest  PDF hash, page, INGEST_VERSION      -> page PNG, traces, graph period
+    rules   ingest digest, RULES_VERSION        -> rules report, or escalate
+    model   ingest digest, prompt, model name   -> the model's validated answer
+    report  merged record, graph, LAYOUT_VERSION -> report.txt and report.pdf
+
+The later stages are keyed on the ingest *digest* (a hash of the stored image
+and traces; the traces alone for a raw recording, whose graph is drawn only
+when needed), so a re-ingest that produces the same page reuses everything
+downstream. Editing the prompt re-runs only the model calls, from stored
+images; bumping RULES_VERSION re-runs only the rules; a layout change
+re-renders reports without a single model call.
+
+The store lives next to the result cache and is not evicted; purge it here.
+
+Usage:
+    python stages.py stats
+    python stages.py purge [--stage model] [--older-than DAYS] [--all]
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter
+from contextlib import closing
+from dataclasses import dataclass
+
+from PIL import Image
+
+import metrics
+from analyzer import (ANALYSIS_PROMPT, GENERATION_CONFIG, INGEST_VERSION, GraphDocument, RecordedGraph,
+                      encode_png, ingest_pdf)
+from classifier import RULES_VERSION, Thresholds, fast_path_report
+from preprocessing import ImageOptions
+from report_schema import AnalysisReport
+from reports import LAYOUT_VERSION, ReportArtifacts
+from result_cache import DEFAULT_CACHE_DIR, sha256_hex
+from slip_analysis import SLIP_VERSION
+from trace_extraction import traces_from_bytes, traces_to_bytes
+
+STAGES = ("ingest", "rules", "model", "report")
+ESCALATE = "escalate"  # rules output for pages that need the model
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    stage TEXT NOT NULL,
+    key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    data BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (stage, key, name)
+);
+"""
+
+
+def _key(*parts):
+    return sha256_hex("\n".join(str(part) for part in parts))
+
+
+def model_version(prompt=ANALYSIS_PROMPT):
+    """Everything besides the page that shapes a model answer"""
+    return "\n".join([sha256_hex(prompt), json.dumps(GENERATION_CONFIG, sort_keys=True),
+                      repr(ImageOptions.from_env())])
+
+
+def pipeline_fingerprint(prompt=ANALYSIS_PROMPT, fast_path=True):
+    """Changes whenever any stage version (or the fast path setting) does; the result cache is keyed on it
+
+    With the fast path off every page goes to the model, so those reports
+    are kept apart from the rules-only ones.
+    """
+    return "\n".join([model_version(prompt), repr(Thresholds()),
+                      f"ingest={INGEST_VERSION} rules={RULES_VERSION} slip={SLIP_VERSION} layout={LAYOUT_VERSION}",
+                      f"fast_path={'on' if fast_path else 'off'}"])
+
+
+class StageStore:
+    """SQLite store of stage outputs (name -> bytes) per (stage, key)
+
+    Instances only hold paths, so they can be passed to worker processes.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, "stages.sqlite")
+        self.tally = Counter()  # (stage, "hit" | "miss") seen by this process
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    def get(self, stage, key):
+        """{name: bytes} stored for the key, or None"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT name, data FROM outputs WHERE stage = ? AND key = ?",
+                                (stage, key)).fetchall()
+        return dict(rows) if rows else None
+
+    def put(self, stage, key, outputs):
+        """Store outputs (name -> bytes/str), replacing any earlier ones for the key"""
+        now = time.time()
+        rows = [(stage, key, name, data.encode("utf-8") if isinstance(data, str) else bytes(data), now)
+                for name, data in outputs.items()]
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM outputs WHERE stage = ? AND key = ?", (stage, key))
+            conn.executemany("INSERT INTO outputs VALUES (?, ?, ?, ?, ?)", rows)
+
+    def record(self, stage, hit):
+        """Count one lookup in the process tally and the metrics"""
+        result = "hit" if hit else "miss"
+        self.tally[stage, result] += 1
+        metrics.count("stage_requests", stage=stage, result=result)
+
+    def lookup(self, stage, key):
+        outputs = self.get(stage, key)
+        self.record(stage, outputs is not None)
+        return outputs
+
+    def reuse_summary(self):
+        """e.g. 'ingest 10/10, rules 10/10, model 3/7, report 0/4' (reused/looked up)"""
+        return ", ".join(f"{stage} {self.tally[stage, 'hit']}/{self.tally[stage, 'hit'] + self.tally[stage, 'miss']}"
+                         for stage in STAGES if self.tally[stage, "hit"] + self.tally[stage, "miss"])
+
+    def stats(self):
+        """[(stage, outputs, bytes)] per stage"""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT stage, COUNT(DISTINCT key), COALESCE(SUM(LENGTH(data)), 0) FROM outputs GROUP BY stage"
+            ).fetchall()
+
+    def purge(self, stage=None, older_than_days=None):
+        """Delete one stage's outputs, outputs older than N days, or everything"""
+        clauses, params = [], []
+        if stage:
+            clauses.append("stage = ?")
+            params.append(stage)
+        if older_than_days is not None:
+            clauses.append("created_at < ?")
+            params.append(time.time() - older_than_days * 86400)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        with closing(self._connect()) as conn, conn:
+            removed = conn.execute(f"SELECT COUNT(DISTINCT stage || key) FROM outputs{where}", params).fetchone()[0]
+            conn.execute(f"DELETE FROM outputs{where}", params)
+        with closing(self._connect()) as conn:
+            conn.execute("VACUUM")
+        return removed
+
+
+# --- Stages ---
+@dataclass
+class IngestedPage:
+    graph: GraphDocument
+    png_bytes: bytes = None
+    digest: str = None  # hash of the stored image and traces; None without a store
+    reused: bool = False
+
+
+def ingest_stage(store, pdf_sha256, pdf_bytes, page_number, with_png=False):
+    """Ingest one page, or load the stored ingest of it; safe to run in worker processes
+
+    The page comes back without its bitmap, so workers never pickle one back
+    to the parent: a PDF page carries its PNG (see ``page_image``), a raw
+    recording its traces, with its graph drawn only when ``with_png``.
+    """
+    if store is None:
+        graph = ingest_pdf(pdf_bytes, page_number=page_number)
+        png_bytes = encode_png(graph.image) if with_png or not isinstance(graph, RecordedGraph) else None
+        graph.image = None
+        return IngestedPage(graph, png_bytes)
+    key = _key("ingest", INGEST_VERSION, pdf_sha256, page_number)
+    stored = store.get("ingest", key)
+    if stored:
+        meta = json.loads(stored["meta.json"])
+        traces = traces_from_bytes(stored["traces.npz"]) if "traces.npz" in stored else None
+        png_bytes = stored.get("page.png")
+        if meta.get("recording"):
+            graph = RecordedGraph(image=None, graph_period=meta["graph_period"], text="", traces=traces)
+            if png_bytes is None and with_png:
+                png_bytes = encode_png(graph.image)
+                graph.image = None
+        else:
+            graph = GraphDocument(image=None, graph_period=meta["graph_period"], text=meta["text"],
+                                  traces=traces, page_number=page_number, page_count=meta["page_count"])
+        return IngestedPage(graph, png_bytes, meta["digest"], reused=True)
+
+    graph = ingest_pdf(pdf_bytes, page_number=page_number)
+    recording = isinstance(graph, RecordedGraph)
+    outputs = {}
+    if with_png or not recording:
+        outputs["page.png"] = encode_png(graph.image)
+    graph.image = None
+    # A recording is identified by its traces, whether or not its graph was drawn
+    digest = hashlib.sha256(b"" if recording else outputs["page.png"])
+    if graph.traces is not None:
+        outputs["traces.npz"] = traces_to_bytes(graph.traces)
+        digest.update(outputs["traces.npz"])
+    meta = {"graph_period": graph.graph_period, "text": graph.text, "page_count": graph.page_count,
+            "digest": digest.hexdigest(), "recording": recording}
+    outputs["meta.json"] = json.dumps(meta)
+    store.put("ingest", key, outputs)
+    return IngestedPage(graph, outputs.get("page.png"), meta["digest"])
+
+
+def page_image(page):
+    """The bitmap of an ingested page: its PNG decoded, or a recording's graph drawn from the traces"""
+    if page.png_bytes is None:
+        return page.graph.image
+    image = Image.open(io.BytesIO(page.png_bytes))
+    image.load()
+    return image
+
+
+def rules_stage(store, page, thresholds=None):
+    """The rules report of a page, or None when the page needs the model"""
+    if store is None or page.digest is None:
+        return fast_path_report(page.graph.traces, thresholds)
+    key = _key("rules", RULES_VERSION, repr(thresholds or Thresholds()), page.digest)
+    stored = store.lookup("rules", key)
+    if stored is not None:
+        return AnalysisReport.from_json(stored["report.json"]) if "report.json" in stored else None
+    report = fast_path_report(page.graph.traces, thresholds)
+    store.put("rules", key, {"report.json": report.to_json()} if report else {ESCALATE: b""})
+    return report
+
+
+def model_key(page, model_name, prompt=ANALYSIS_PROMPT):
+    """Stage key of a page's model answer; None without a store"""
+    return _key("model", model_version(prompt), model_name, page.digest) if page.digest else None
+
+
+def stored_answer(store, key):
+    """The stored model answer for a key, or None"""
+    if store is None or key is None:
+        return None
+    stored = store.lookup("model", key)
+    return AnalysisReport.from_json(stored["report.json"]) if stored else None
+
+
+def save_answer(store, key, report):
+    if store is not None and key is not None:
+        store.put("model", key, {"report.json": report.to_json()})
+
+
+def report_key(report, png_bytes, graph_period):
+    """Stage key of a merged record's TXT/PDF"""
+    return _key("report", LAYOUT_VERSION, report.to_json(), sha256_hex(png_bytes or b""), graph_period)
+
+
+def stored_reports(store, key):
+    """The stored TXT and PDF for a key, or None; look up in the parent so its tally counts them"""
+    if store is None:
+        return None
+    stored = store.lookup("report", key)
+    if stored and "report.pdf" in stored:
+        return {"report.txt": stored["report.txt"].decode("utf-8"), "report.pdf": stored["report.pdf"]}
+    return None
+
+
+def report_stage(store, key, report, png_bytes, graph_period):
+    """TXT and PDF renderings of a merged record, stored under the key; safe to run in worker processes"""
+    outputs = ReportArtifacts(report, png_bytes, graph_period).build_all()
+    if store is not None:
+        store.put("report", key, outputs)
+    return outputs
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and purge stored stage outputs")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="Show stored outputs per stage")
+    purge = sub.add_parser("purge", help="Delete stored outputs")
+    purge.add_argument("--stage", choices=STAGES, help="Only this stage's outputs")
+    purge.add_argument("--older-than", type=float, metavar="DAYS",
+                       help="Only outputs stored more than DAYS ago")
+    purge.add_argument("--all", action="store_true", help="Delete every stored output")
+    args = parser.parse_args(argv)
+
+    store = StageStore(args.cache_dir)
+    if args.command == "stats":
+        print(f"Stage store : {os.path.abspath(store.db_path)}")
+        for stage, entries, size in store.stats():
+            print(f"{stage:<8} {entries:>8} outputs {size / 1024 / 1024:>10.2f} MB")
+    elif args.command == "purge":
+        if not (args.stage or args.older_than is not None or args.all):
+            parser.error("purge needs --stage, --older-than or --all")
+        removed = store.purge(args.stage, args.older_than)
+        print(f"Removed {removed} output{'' if removed == 1 else 's'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,389 @@
+"""Synthetic recorder PDFs and a local stand-in for the Gemini model.
+
+The generator draws vector graphs in the recorder layout the extractors
+expect: a grey plot frame with numeric axis labels, the red reference speed,
+the four axle traces, dump-valve bars under the plot and the graph period in
+the page text. Output is deterministic for a given seed, so benchmarks and
+manual checks run on the same bytes every time.
+
+``FakeGeminiModel`` answers ``generate_content`` with a canned report after a
+configurable delay, streaming or not; ``install_fake_model`` puts it in the
+shared model table so the whole pipeline runs without network access.
+
+``FakeGeminiServer`` goes one level lower: a local HTTP server speaking the
+Gemini REST API, with per-key quotas that answer 429 when exceeded, a random
+share of extra 429s and per-model latency. Point the real SDK at it with
+``WSP_GEMINI_ENDPOINT`` to exercise key scheduling, retries and fallback.
+
+Usage:
+    python synthetic.py pdfs out/ --count 20 --pages 3 --points 800 --anomaly-rate 0.3
+    python synthetic.py server --port 8790 --rpm 60 --throttle-rate 0.1
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import fitz
+
+from report_schema import AnalysisReport, AxleRow, WspRow
+from trace_extraction import AXLE_COLORS, REFERENCE_COLOR, VALVE_COLORS, hex_to_rgb
+
+PAGE_SIZE = (842, 595)  # A4 landscape, points
+PLOT_BOX = (60, 70, 800, 450)
+VALVE_ROW_TOP = 470
+VALVE_ROW_HEIGHT = 8
+FRAME_COLOR = (0.5, 0.5, 0.5)
+SPEED_LABELS = range(0, 101, 20)
+DEFAULT_START = datetime(2025, 1, 18, 7, 10, 24)
+FAKE_PROMPT_TOKENS = 1800  # prompt text plus one graph image
+
+
+def _color(hex_color):
+    return tuple(c / 255 for c in hex_to_rgb(hex_color))
+
+
+# --- PDF Generator ---
+def _speed_profile(t, duration, rng_phase):
+    """Reference speed in km/h: a braking curve with some slow variation"""
+    return max(0.0, 90.0 * (1 - 0.8 * t / duration) + 4.0 * rng_phase)
+
+
+def _draw_page(page, start, duration, points, anomalies, rng):
+    x0, y0, x1, y1 = PLOT_BOX
+    page.insert_text((50, 40), f"WSP Recorder  {start:%d.%m.%y %H:%M:%S} - "
+                               f"{start + timedelta(seconds=duration):%d.%m.%y %H:%M:%S}", fontsize=10)
+    page.draw_rect(fitz.Rect(PLOT_BOX), color=FRAME_COLOR, width=0.5)
+    for speed in SPEED_LABELS:
+        y = y1 - (y1 - y0) * speed / 100
+        page.insert_text((x0 - 22, y + 3), str(speed), fontsize=7)
+    for step in range(6):
+        x = x0 + (x1 - x0) * step / 5
+        page.insert_text((x - 6, y1 + 12), f"{duration * step / 5:g}", fontsize=7)
+
+    def to_xy(t, speed):
+        return fitz.Point(x0 + (x1 - x0) * t / duration, y1 - (y1 - y0) * min(max(speed, 0), 100) / 100)
+
+    times = [duration * i / (points - 1) for i in range(points)]
+    phase = rng.random()
+    reference = [_speed_profile(t, duration, phase) for t in times]
+    page.draw_polyline([to_xy(t, v) for t, v in zip(times, reference)], color=_color(REFERENCE_COLOR), width=1)
+    for axle, hex_color in AXLE_COLORS.items():
+        speeds = []
+        for t, v in zip(times, reference):
+            dip = 0.0
+            for (axle_hit, begin, end, depth) in anomalies:
+                if axle_hit == axle and begin <= t <= end:
+                    dip = depth
+            speeds.append(v - dip + rng.uniform(-0.4, 0.4))
+        page.draw_polyline([to_xy(t, v) for t, v in zip(times, speeds)], color=_color(hex_color), width=1)
+
+    for axle_hit, begin, end, _ in anomalies:
+        top = VALVE_ROW_TOP + (axle_hit - 1) * VALVE_ROW_HEIGHT
+        for pulse_start in range(int(begin), int(end), 2):
+            bar = fitz.Rect(to_xy(pulse_start, 0).x, top, to_xy(min(pulse_start + 1, end), 0).x,
+                            top + VALVE_ROW_HEIGHT - 2)
+            page.draw_rect(bar, color=None, fill=_color(VALVE_COLORS[axle_hit]))
+
+
+def make_recording(pages=1, points=400, anomaly_rate=0.0, seed=0, start=DEFAULT_START, page_seconds=90):
+    """PDF bytes of one synthetic recording
+
+    ``points`` is the trace density (vertices per trace per page); each page
+    has a slide on one random axle with probability ``anomaly_rate``.
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for number in range(pages):
+        anomalies = []
+        if rng.random() < anomaly_rate:
+            begin = rng.uniform(0.1, 0.6) * page_seconds
+            anomalies.append((rng.choice(list(AXLE_COLORS)), begin,
+                              begin + rng.uniform(0.05, 0.25) * page_seconds, rng.uniform(15, 40)))
+        page = doc.new_page(width=PAGE_SIZE[0], height=PAGE_SIZE[1])
+        _draw_page(page, start + timedelta(seconds=number * page_seconds), page_seconds, points, anomalies, rng)
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+
+def write_recordings(out_dir, count, pages=1, points=400, anomaly_rate=0.0, seed=0):
+    """Write ``count`` recordings to out_dir; returns their paths"""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = os.path.join(out_dir, f"synthetic_{index:04d}.pdf")
+        with open(path, "wb") as f:
+            f.write(make_recording(pages, points, anomaly_rate, seed=seed + index,
+                                   start=DEFAULT_START + timedelta(hours=index)))
+        paths.append(path)
+    return paths
+
+
+# --- Fake Model ---
+def canned_report():
+    """A plausible anomalous report, as the model would return it"""
+    axles = [AxleRow(axle, "Tracking reference speed smoothly", "None", "Normal Operation") for axle in AXLE_COLORS]
+    wsp = [WspRow(axle, "Not required - no wheel slide", "Not required", "Functioning Correctly")
+           for axle in AXLE_COLORS]
+    axles[2] = AxleRow(3, "Fluctuating with deviations", "19.94s - 32.86s", "Affected - Moderate")
+    wsp[2] = WspRow(3, "Multiple rapid activations", "Proper closure after recovery", "Functioning Correctly")
+    return AnalysisReport(
+        summary="Axle 3 shows a wheel slide between 19.94s and 32.86s that the WSP system corrected. "
+                "The other axles track the reference speed throughout the recording.",
+        axles=axles,
+        wsp=wsp,
+        diagnosis="Low adhesion on axle 3 caused a moderate slide. The dump valves cycled and the axle "
+                  "recovered to the reference speed.",
+        recommendations=["Inspect the axle 3 speed sensor and phonic wheel.",
+                         "Check the rail conditions reported for this section."],
+    )
+
+
+def _usage(text):
+    """Token usage in the shape of the SDK's usage_metadata (about 4 characters per token)"""
+    return SimpleNamespace(prompt_token_count=FAKE_PROMPT_TOKENS, candidates_token_count=len(text) // 4)
+
+
+class _FakeChunk:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class _FakeStream:
+    """Iterable streaming response; delays are spread over the chunks"""
+
+    def __init__(self, text, latency, chunk_size):
+        self._chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        self._delay = latency / max(1, len(self._chunks))
+        self._done = False
+        self.usage_metadata = _usage(text)
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            time.sleep(self._delay)
+            yield _FakeChunk(chunk)
+        self._done = True
+
+
+class FakeGeminiModel:
+    """Stand-in for ``genai.GenerativeModel`` returning a canned JSON report"""
+
+    def __init__(self, latency=0.5, text=None, chunk_size=64):
+        self.latency = latency
+        self.text = text or canned_report().to_json()
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if stream:
+            return _FakeStream(self.text, self.latency, self.chunk_size)
+        time.sleep(self.latency)
+        return _FakeChunk(self.text, _usage(self.text))
+
+
+def install_fake_model(model=None, model_name=None):
+    """Serve every ``get_model`` call for model_name, whatever the API key, from the fake; returns it
+
+    The scheduler is replaced by one without quotas or fallbacks, so timings
+    measure the pipeline rather than request pacing.
+    """
+    import analyzer
+    from scheduler import ModelScheduler
+    model = model or FakeGeminiModel()
+    model_name = model_name or analyzer.MODEL_NAME
+    with analyzer._models_lock:
+        for key in [key for key in analyzer._models if key[0] == model_name]:
+            del analyzer._models[key]
+        analyzer._models[model_name, None] = model
+        analyzer._scheduler = ModelScheduler([None], [(model_name, 0)], analyzer.get_model)
+    return model
+
+
+# --- Fake Model Server ---
+_MODEL_PATH = re.compile(r"^/v1beta/models/([^/:]+):(generateContent|streamGenerateContent)")
+
+
+class _KeyQuota:
+    """Requests-per-minute quota of one API key on the fake server, over a sliding minute"""
+
+    def __init__(self, rpm):
+        self.rpm = rpm
+        self.sent = deque()
+
+    def take(self):
+        now = time.monotonic()
+        while self.sent and now - self.sent[0] >= 60:
+            self.sent.popleft()
+        if len(self.sent) >= self.rpm:
+            return False
+        self.sent.append(now)
+        return True
+
+
+class FakeGeminiServer:
+    """Local Gemini REST endpoint returning the canned report
+
+    ``rpm`` is the quota per (key, model); requests over it, and a random
+    ``throttle_rate`` share of the rest, get HTTP 429. ``latency`` (seconds)
+    may be a dict per model name. ``stats`` counts (key, model, status),
+    with status "dropped" when the client hung up before the answer.
+    """
+
+    def __init__(self, port=0, latency=0.2, rpm=None, throttle_rate=0.0, text=None, chunk_size=64, seed=0):
+        self.latency = latency
+        self.rpm = rpm
+        self.throttle_rate = throttle_rate
+        self.text = text or canned_report().to_json()
+        self.chunk_size = chunk_size
+        self.stats = Counter()
+        self._random = random.Random(seed)
+        self._quotas = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-gemini", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _admit(self, key, model):
+        """HTTP status for one request: 200, or 429 when over quota or randomly throttled"""
+        with self._lock:
+            if self.rpm:
+                quota = self._quotas.setdefault((key, model), _KeyQuota(self.rpm))
+                if not quota.take():
+                    return 429
+            if self._random.random() < self.throttle_rate:
+                return 429
+            return 200
+
+    def _latency(self, model):
+        return self.latency.get(model, 0.0) if isinstance(self.latency, dict) else self.latency
+
+    def _chunk(self, text, final):
+        chunk = {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}]}
+        if final:
+            chunk["candidates"][0]["finishReason"] = "STOP"
+            chunk["usageMetadata"] = {"promptTokenCount": FAKE_PROMPT_TOKENS,
+                                      "candidatesTokenCount": len(self.text) // 4,
+                                      "totalTokenCount": FAKE_PROMPT_TOKENS + len(self.text) // 4}
+        return chunk
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                match = _MODEL_PATH.match(self.path)
+                if not match:
+                    return self._json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+                model, method = match.groups()
+                key = self.headers.get("x-goog-api-key") or "-"
+                status = server._admit(key, model)
+                try:
+                    self._answer(status, model, method)
+                except (BrokenPipeError, ConnectionResetError):
+                    status = "dropped"  # the client gave up, e.g. timed out
+                with server._lock:
+                    server.stats[key, model, status] += 1
+
+            def _answer(self, status, model, method):
+                if status == 429:
+                    return self._json(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED",
+                                                      "message": "Resource has been exhausted (e.g. check quota)."}})
+                delay = server._latency(model)
+                if method == "generateContent":
+                    time.sleep(delay)
+                    return self._json(200, server._chunk(server.text, final=True))
+
+                # Streamed as one JSON array, written chunk by chunk like the real endpoint
+                pieces = [server.text[i:i + server.chunk_size] for i in range(0, len(server.text), server.chunk_size)]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b"[")
+                for index, piece in enumerate(pieces):
+                    time.sleep(delay / len(pieces))
+                    data = json.dumps(server._chunk(piece, final=index == len(pieces) - 1))
+                    self.wfile.write(("," if index else "").encode() + data.encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"]")
+
+        return Handler
+
+
+# --- CLI ---
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Synthetic WSP recorder PDFs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    pdfs = sub.add_parser("pdfs", help="Write synthetic recordings")
+    pdfs.add_argument("out_dir")
+    pdfs.add_argument("--count", type=int, default=10)
+    pdfs.add_argument("--pages", type=int, default=1)
+    pdfs.add_argument("--points", type=int, default=400, help="Vertices per trace per page")
+    pdfs.add_argument("--anomaly-rate", type=float, default=0.3, help="Share of pages with a wheel slide")
+    pdfs.add_argument("--seed", type=int, default=0)
+    server = sub.add_parser("server", help="Run a fake Gemini REST endpoint")
+    server.add_argument("--port", type=int, default=8790)
+    server.add_argument("--latency", type=float, default=0.5, help="Seconds per request")
+    server.add_argument("--rpm", type=int, help="Quota per key and model (requests per minute)")
+    server.add_argument("--throttle-rate", type=float, default=0.0, help="Share of extra random 429s")
+    args = parser.parse_args(argv)
+
+    if args.command == "server":
+        fake = FakeGeminiServer(args.port, args.latency, args.rpm, args.throttle_rate)
+        print(f"Fake Gemini endpoint on {fake.url} (set WSP_GEMINI_ENDPOINT={fake.url})")
+        try:
+            fake.start()._thread.join()
+        except KeyboardInterrupt:
+            fake.stop()
+        return 0
+
+    paths = write_recordings(args.out_dir, args.count, args.pages, args.points, args.anomaly_rate, args.seed)
+    print(f"Wrote {len(paths)} recordings to {args.out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analyzer  # noqa: E402
+from scheduler import ModelScheduler  # noqa: E402
+from synthetic import FakeGeminiServer  # noqa: E402
+
+PRIMARY = "gemini-2.5-flash"
+FALLBACK = "gemini-2.5-flash-lite"
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    """Start a FakeGeminiServer and point new models at it"""
+    servers = []
+
+    def start(**options):
+        server = FakeGeminiServer(**options).start()
+        servers.append(server)
+        monkeypatch.setenv("WSP_GEMINI_ENDPOINT", server.url)
+        # Clients are cached per key; make sure none points at an earlier server
+        monkeypatch.setattr(analyzer, "_models", {})
+        monkeypatch.setattr(analyzer, "_clients", {})
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def fake_models(fake_server, monkeypatch):
+    """Route the pipeline's model calls through a fresh scheduler over one key; returns the fake server"""
+
+    def start(**options):
+        server = fake_server(**options)
+        scheduler = ModelScheduler(["key-a"], [(PRIMARY, 0), (FALLBACK, 0)], analyzer.get_model, timeout=5,
+                                   attempts_per_model=1)
+        monkeypatch.setattr(analyzer, "_scheduler", scheduler)
+        return server
+
+    return start
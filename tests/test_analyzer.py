@@ -0,0 +1,23 @@
+"""Page rendering and ingestion on synthetic recordings"""
+import fitz
+import numpy as np
+import pytest
+from PIL import Image
+
+from analyzer import RENDER_BAND_ROWS, pdf_to_image, render_zoom
+from synthetic import make_recording
+
+
+def direct_render(page, zoom):
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return np.asarray(Image.frombytes("RGB", (pix.width, pix.height), pix.samples))
+
+
+@pytest.mark.parametrize("max_pixels", [0, 1_000_000], ids=["full", "downscaled"])
+def test_banded_render_matches_a_direct_pixmap(max_pixels):
+    with fitz.open(stream=make_recording(pages=2, anomaly_rate=1.0, seed=3), filetype="pdf") as doc:
+        for page in doc:
+            zoom = render_zoom(page.rect, max_pixels=max_pixels)
+            banded = np.asarray(pdf_to_image(page, max_pixels=max_pixels))
+            assert banded.shape[0] > 2 * RENDER_BAND_ROWS  # several bands were stitched
+            np.testing.assert_array_equal(banded, direct_render(page, zoom))
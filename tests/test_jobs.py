@@ -0,0 +1,69 @@
+"""AnalysisJob end to end on synthetic recordings, with the model behind FakeGeminiServer"""
+import threading
+
+import analyzer
+from conftest import FALLBACK, PRIMARY
+from jobs import DONE, AnalysisJob
+from result_cache import ResultCache, cache_key
+from stages import pipeline_fingerprint
+from synthetic import make_recording
+
+SLIDE = make_recording(anomaly_rate=1.0, seed=1)  # anomalous, so the rules hand it to the model
+
+
+def run_job(pdf_bytes, cache):
+    job = AnalysisJob(pdf_bytes, "slide.pdf", cache=cache, model_name=PRIMARY)
+    job.run()
+    assert job.status == DONE, job.error
+    return job
+
+
+def test_primary_model_answer_is_cached(fake_models, tmp_path):
+    fake_models(latency=0.0)
+    cache = ResultCache(str(tmp_path))
+    job = run_job(SLIDE, cache)
+
+    assert job.answered_by == {PRIMARY}
+    assert run_job(SLIDE, cache).from_cache
+
+
+def test_fallback_model_answer_is_not_cached_as_the_primary_result(fake_models, tmp_path):
+    fake_models(latency=0.0, rpm=1)  # one request per model
+    ping = lambda model, timeout: model.generate_content("ping").text  # noqa: E731
+    analyzer.get_scheduler().call(ping, PRIMARY)  # the primary is used up
+    cache = ResultCache(str(tmp_path))
+    job = run_job(SLIDE, cache)
+
+    assert job.answered_by == {FALLBACK}
+    assert job.report is not None
+    assert job.pdf_data  # downloads still build, they just are not stored
+    key, _ = cache_key(SLIDE, pipeline_fingerprint(fast_path=True), PRIMARY)
+    assert cache.get(key) is None
+
+
+def test_concurrent_jobs_for_one_recording_share_a_single_model_call(fake_models):
+    server = fake_models(latency=1.0)
+    jobs = [AnalysisJob(SLIDE, f"upload-{i}.pdf", model_name=PRIMARY) for i in range(3)]
+    threads = [threading.Thread(target=job.run) for job in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [job.status for job in jobs] == [DONE] * 3
+    assert sum(server.stats.values()) == 1
+    assert sorted(job.coalesced for job in jobs) == [False, True, True]
+    assert len({job.report.to_json() for job in jobs}) == 1
+
+
+def test_jobs_with_different_fast_path_settings_are_not_coalesced(fake_models):
+    server = fake_models(latency=1.0)
+    jobs = [AnalysisJob(SLIDE, "upload.pdf", model_name=PRIMARY, fast_path=fast_path) for fast_path in (True, False)]
+    threads = [threading.Thread(target=job.run) for job in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [job.coalesced for job in jobs] == [False, False]
+    assert sum(server.stats.values()) == 2
@@ -0,0 +1,27 @@
+"""Model image preprocessing on synthetic recordings"""
+import pytest
+
+from preprocessing import ImageOptions, bench
+from synthetic import write_recordings
+
+
+@pytest.fixture(scope="module")
+def recordings(tmp_path_factory):
+    return write_recordings(str(tmp_path_factory.mktemp("recordings")), 4, anomaly_rate=0.5)
+
+
+@pytest.mark.parametrize("options", [
+    ImageOptions(),
+    ImageOptions(max_width=0),
+    ImageOptions(quantize=False),
+    ImageOptions(crop=False),
+], ids=["default", "full-width", "no-quantize", "no-crop"])
+def test_preprocessing_leaves_rule_tables_unchanged(recordings, options):
+    rows = bench(recordings, options)
+    assert len(rows) == 4
+    assert [row["file"] for row in rows if not row["tables_match"]] == []
+
+
+def test_default_preprocessing_shrinks_the_payload(recordings):
+    rows = bench(recordings)
+    assert sum(row["bytes_after"] for row in rows) < 0.5 * sum(row["bytes_before"] for row in rows)
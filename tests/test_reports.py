@@ -0,0 +1,30 @@
+"""PDF report building from in-memory PNGs"""
+import io
+
+import fpdf.fpdf
+from PIL import Image
+
+from reports import EnhancedPDF
+
+
+def png(mode, size=(300, 200)):
+    buffer = io.BytesIO()
+    Image.new(mode, size).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_png_is_embedded_from_memory_once(monkeypatch):
+    def no_files(*args, **kwargs):
+        raise AssertionError("FPDF opened a file")
+
+    monkeypatch.setattr(fpdf.fpdf, "open", no_files, raising=False)
+    pdf = EnhancedPDF()
+    pdf.add_page()
+    graph = png("RGBA")  # re-encoded as RGB, which FPDF can take
+    for i in range(3):
+        assert pdf.image_from_bytes(graph, x=10, y=10 + 50 * i, w=40) == (300, 200)
+    pdf.image_from_bytes(png("P"), x=10, y=200, w=40)
+
+    assert len(pdf.images) == 2
+    assert pdf.memory_images == {}
+    assert pdf.output(dest="S").startswith("%PDF")
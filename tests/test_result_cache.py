@@ -0,0 +1,47 @@
+"""ResultCache eviction by age and by size"""
+from types import SimpleNamespace
+
+import pytest
+
+import result_cache
+from result_cache import ResultCache, cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A settable time.time() for the cache module"""
+    now = [1_000_000.0]
+    monkeypatch.setattr(result_cache, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def put(cache, name, size):
+    key, parts = cache_key(name.encode(), "prompt", "model")
+    cache.put(key, parts, "period", {"report.json": b"x" * size})
+    return key
+
+
+def test_least_recently_used_entries_go_first_when_over_size(tmp_path, clock):
+    cache = ResultCache(str(tmp_path), max_bytes=2500, max_age_days=0)
+    first = put(cache, "a", 1000)
+    clock[0] += 1
+    second = put(cache, "b", 1000)
+    clock[0] += 1
+    assert cache.get(first)  # now more recently used than the second
+    clock[0] += 1
+    third = put(cache, "c", 1000)
+
+    assert cache.get(second) is None
+    assert cache.get(first) and cache.get(third)
+    assert sorted(e["key"] for e in cache.entries()) == sorted([first, third])
+
+
+def test_expired_entries_are_dropped(tmp_path, clock):
+    cache = ResultCache(str(tmp_path), max_bytes=0, max_age_days=1)
+    old = put(cache, "old", 10)
+    clock[0] += 2 * 86400
+    fresh = put(cache, "fresh", 10)  # evicts the expired entry on the way in
+
+    assert [e["key"] for e in cache.entries()] == [fresh]
+    assert cache.get(old) is None
+    assert cache.artifacts_named("report.json") == [(cache_key(b"fresh", "prompt", "model")[1][0], "period", b"x" * 10)]
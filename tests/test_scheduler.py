@@ -0,0 +1,92 @@
+"""ModelScheduler driving the real SDK against synthetic.FakeGeminiServer"""
+import threading
+import time
+
+import pytest
+
+import analyzer
+from conftest import FALLBACK, PRIMARY
+from scheduler import BATCH, INTERACTIVE, ModelScheduler, ModelUnavailable
+
+
+def ping(model, timeout):
+    return model.generate_content("ping", request_options={"timeout": timeout}).text
+
+
+def answered(server, status=200):
+    return {(key, model): n for (key, model, code), n in server.stats.items() if code == status}
+
+
+def test_throttled_key_cools_down_and_request_moves_to_next_key(fake_server):
+    server = fake_server(latency=0.0, rpm=1)  # the server allows one request per key and model
+    scheduler = ModelScheduler(["key-a", "key-b"], [(PRIMARY, 0)], analyzer.get_model, timeout=5)
+
+    assert scheduler.call(ping, PRIMARY)
+    first = next(e for e in scheduler.endpoints[PRIMARY] if e.api_key == "key-a")
+    assert scheduler.call(ping, PRIMARY)  # key-a answers 429, key-b takes over
+
+    assert answered(server) == {("key-a", PRIMARY): 1, ("key-b", PRIMARY): 1}
+    assert answered(server, 429) == {("key-a", PRIMARY): 1}
+    assert first.strikes == 1
+    assert first.cooldown_until > time.monotonic()
+    label, ready_in, strikes = next(row for row in scheduler.status() if row[0] == first.label)
+    assert ready_in > 0 and strikes == 1
+
+
+def test_timeout_falls_back_to_next_model(fake_server):
+    server = fake_server(latency={PRIMARY: 3.0, FALLBACK: 0.0})
+    scheduler = ModelScheduler(["key-a"], [(PRIMARY, 0), (FALLBACK, 0)], analyzer.get_model, timeout=0.5)
+
+    assert scheduler.call(ping, PRIMARY)
+    assert answered(server) == {("key-a", FALLBACK): 1}
+
+
+def test_interactive_request_goes_ahead_of_queued_batch_requests(fake_server):
+    fake_server(latency=0.0)
+    # One token every 0.25 s, so every request after the first has to queue
+    scheduler = ModelScheduler(["key-a"], [(PRIMARY, 240)], analyzer.get_model, timeout=5)
+    served, lock = [], threading.Lock()
+
+    def request(name):
+        def run(model, timeout):
+            with lock:
+                served.append(name)
+            return ping(model, timeout)
+        return run
+
+    scheduler.call(request("first"), PRIMARY, BATCH)
+    threads = [threading.Thread(target=scheduler.call, args=(request(f"batch-{i}"), PRIMARY, BATCH))
+               for i in range(3)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    interactive = threading.Thread(target=scheduler.call, args=(request("interactive"), PRIMARY, INTERACTIVE))
+    interactive.start()
+    for thread in threads + [interactive]:
+        thread.join(10)
+
+    assert served == ["first", "interactive", "batch-0", "batch-1", "batch-2"]
+
+
+def test_busy_model_does_not_hold_up_another_model(fake_server):
+    fake_server(latency=0.0)
+    scheduler = ModelScheduler(["key-a"], [(PRIMARY, 6), (FALLBACK, 0)], analyzer.get_model, timeout=5)
+    scheduler.call(ping, PRIMARY)
+    waiting = threading.Thread(target=scheduler.call, args=(ping, PRIMARY), daemon=True)
+    waiting.start()  # the next PRIMARY token is ten seconds away
+    time.sleep(0.1)
+
+    started = time.monotonic()
+    assert scheduler.call(ping, FALLBACK)
+    assert time.monotonic() - started < 2
+
+
+def test_every_key_and_model_throttled_raises_model_unavailable(fake_server):
+    server = fake_server(latency=0.0, throttle_rate=1.0)
+    scheduler = ModelScheduler(["key-a", "key-b"], [(PRIMARY, 0), (FALLBACK, 0)], analyzer.get_model,
+                               timeout=5, attempts_per_model=2)
+
+    with pytest.raises(ModelUnavailable, match="rate limited"):
+        scheduler.call(ping, PRIMARY)
+    assert answered(server, 429) == {(key, model): 1 for key in ("key-a", "key-b") for model in (PRIMARY, FALLBACK)}
+    assert all(e.strikes == 1 for endpoints in scheduler.endpoints.values() for e in endpoints)
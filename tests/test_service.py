@@ -0,0 +1,21 @@
+"""The service CLI on a synthetic recording the rules report without the model"""
+import reports
+import service
+from synthetic import make_recording
+
+
+def test_cli_reports_a_missing_artifact_instead_of_crashing(tmp_path, monkeypatch, capsys):
+    def broken_pdf(report, png_bytes, graph_period):
+        raise RuntimeError("font missing")
+
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setitem(reports.ARTIFACT_BUILDERS, "report.pdf", ("pdf_build", broken_pdf))
+    pdf = tmp_path / "normal.pdf"
+    pdf.write_bytes(make_recording(seed=0))
+    out = tmp_path / "report.pdf"
+
+    status = service.main(["--no-cache", "--no-history", "analyze", str(pdf), "--format", "pdf", "--out", str(out)])
+
+    assert status == 1
+    assert "font missing" in capsys.readouterr().err
+    assert not out.exists()
@@ -0,0 +1,36 @@
+"""Slip phases and their matched dump-valve pulses"""
+import numpy as np
+
+from slip_analysis import SlipParameters, match_valve_pulses, measure_axle
+
+PARAMS = SlipParameters(valve_lead=0.5, valve_lag=3.0)
+
+
+def test_pulse_opening_in_the_window_counts_even_if_it_closes_after_it():
+    phase = np.array([[10.0, 20.0]])  # window 9.5 .. 23.0
+    pulses = np.array([
+        [5.0, 9.8],  # closes inside the window but opened before it
+        [12.0, 13.0],
+        [22.0, 30.0],  # opens inside the window, closes well after it
+        [23.5, 24.0],  # opens after the window
+    ])
+
+    counts, first, last = match_valve_pulses(phase, pulses, PARAMS.valve_lead, PARAMS.valve_lag)
+
+    assert counts.tolist() == [2]
+    assert (first.tolist(), last.tolist()) == ([1], [2])
+
+
+def test_late_closure_is_reported_as_closure_lag():
+    times = np.arange(0.0, 40.0, 0.05)
+    reference = np.full_like(times, 50.0)
+    speed = np.where((times >= 10.0) & (times < 20.0), 30.0, 50.0)  # 40% slip from 10 s to 20 s
+    pulses = [[9.8, 11.0], [22.0, 30.0]]
+
+    phases = measure_axle(times, speed, reference, pulses, axle=1, params=PARAMS)
+
+    assert len(phases.intervals) == 1
+    assert phases.valve_cycles.tolist() == [2]
+    assert phases.unmatched_valve_cycles == 0
+    np.testing.assert_allclose(phases.activation_delay, [-0.2], atol=0.06)
+    np.testing.assert_allclose(phases.closure_lag, [10.0], atol=0.06)
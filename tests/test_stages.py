@@ -0,0 +1,39 @@
+"""Stored-stage reuse across batch runs of synthetic recordings"""
+from batch import run_batch
+from conftest import PRIMARY
+from stages import StageStore, ingest_stage
+from synthetic import make_recording
+
+SOURCES = [(f"slide-{seed}.pdf", make_recording(anomaly_rate=1.0, seed=seed)) for seed in range(2)]
+SOURCES.append(("normal.pdf", make_recording(anomaly_rate=0.0, seed=5)))
+
+
+def run(store):
+    results = sorted(run_batch(SOURCES, workers=2, render_workers=1, model_name=PRIMARY, stages=store),
+                     key=lambda result: result.name)
+    assert all(result.ok for result in results), [result.error for result in results]
+    return results
+
+
+def test_rerun_reuses_every_stored_stage(fake_models, tmp_path):
+    server = fake_models(latency=0.0)
+    first = run(StageStore(str(tmp_path)))
+    calls = sum(server.stats.values())
+    assert calls == 2  # the clearly normal recording never reaches the model
+
+    store = StageStore(str(tmp_path))
+    second = run(store)
+    assert sum(server.stats.values()) == calls
+    assert store.reuse_summary() == "ingest 3/3, rules 3/3, model 2/2, report 3/3"
+    assert [result.report.to_json() for result in second] == [result.report.to_json() for result in first]
+
+
+def test_stored_ingest_matches_a_fresh_one(tmp_path):
+    store = StageStore(str(tmp_path))
+    fresh = ingest_stage(store, "sha", SOURCES[0][1], 0)
+    stored = ingest_stage(store, "sha", SOURCES[0][1], 0)
+
+    assert not fresh.reused and stored.reused
+    assert stored.digest == fresh.digest
+    assert stored.png_bytes == fresh.png_bytes
+    assert stored.graph.graph_period == fresh.graph.graph_period
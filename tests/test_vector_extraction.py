@@ -0,0 +1,40 @@
+"""Trace extraction from the vector paths of synthetic recordings"""
+import fitz
+import numpy as np
+import pytest
+
+from synthetic import PLOT_BOX, make_recording
+from trace_extraction import AXLE_COLORS, hex_to_rgb
+from vector_extraction import extract_vector_traces
+
+
+def color(hex_color):
+    return tuple(c / 255 for c in hex_to_rgb(hex_color))
+
+
+def test_full_traces_cover_the_plot():
+    with fitz.open(stream=make_recording(seed=0), filetype="pdf") as doc:
+        traces = extract_vector_traces(doc[0], time_range=(0.0, 90.0))
+
+    assert all(traces.coverage[axle] == pytest.approx(1.0) for axle in AXLE_COLORS)
+
+
+def test_gap_between_drawn_segments_is_not_interpolated():
+    x0, y0, x1, y1 = PLOT_BOX
+    doc = fitz.open()
+    page = doc.new_page()
+    page.draw_rect(fitz.Rect(PLOT_BOX), color=(0.5, 0.5, 0.5), width=0.5)
+    middle = (y0 + y1) / 2
+    quarter = (x1 - x0) / 4
+    # Axle 1 is drawn over the first and the last quarter of the plot only
+    for start in (x0, x1 - quarter):
+        page.draw_polyline([fitz.Point(start, middle), fitz.Point(start + quarter / 2, middle - 10),
+                            fitz.Point(start + quarter, middle)], color=color(AXLE_COLORS[1]), width=1)
+
+    traces = extract_vector_traces(page, time_range=(0.0, 100.0))
+    doc.close()
+
+    speed = traces.axles[1]
+    assert traces.coverage[1] == pytest.approx(0.5, abs=0.01)
+    assert np.isnan(speed[(traces.time > 30) & (traces.time < 70)]).all()
+    assert np.isfinite(speed[(traces.time > 2) & (traces.time < 23)]).all()
@@ -0,0 +1,316 @@
+"""Deterministic trace extraction from a rendered WSP graph.
+
+Every trace on the recorder graph is drawn in a fixed colour (the same hex
+codes the analysis prompt lists). Masking those colours in the page image
+gives per-axle speed-vs-time series and dump-valve on/off intervals as NumPy
+arrays, without asking the model to read pixels.
+"""
+import io
+import json
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+from PIL import Image
+
+REFERENCE_COLOR = "#FE0000"
+
+AXLE_COLORS = {
+    1: "#00FF01",  # Green
+    2: "#FFFF00",  # Yellow
+    3: "#0000FE",  # Blue
+    4: "#FF00FE",  # Pink
+}
+
+VALVE_COLORS = {
+    1: "#9A99FF",
+    2: "#6599FF",
+    3: "#6665FE",
+    4: "#3401CC",
+}
+
+# Everything else on the page is background, grid or ink. The palette order
+# is also the priority used when downscaling a quantized image (see
+# preprocessing.py): speed traces win over valve bars, valve bars over text
+# and grid, and anything wins over the background.
+BACKGROUND_COLOR = "#FFFFFF"
+LIGHT_GRID_COLOR = "#D2D2D2"
+FRAME_COLOR = "#BEBEBE"  # thin grey frame lines render about this light
+GRID_COLOR = "#808080"
+INK_COLOR = "#000000"
+PALETTE = [BACKGROUND_COLOR, LIGHT_GRID_COLOR, FRAME_COLOR, GRID_COLOR, INK_COLOR,
+           *VALVE_COLORS.values(),
+           *AXLE_COLORS.values(), REFERENCE_COLOR]
+
+# Per-channel tolerance; the closest pair of palette colours differs by ~50
+COLOR_TOLERANCE = 24
+# A frame line must cover this share of the plot width/height
+FRAME_LINE_FRACTION = 0.5
+# Valve pulses are filled bars; opening with this kernel drops the anti-aliased
+# fringes of the blue/pink speed lines, which blend into the valve palette
+VALVE_KERNEL = np.ones((3, 3), np.uint8)
+# Without axis calibration speeds are reported in percent of full scale
+DEFAULT_SPEED_RANGE = (0.0, 100.0)
+
+
+def hex_to_rgb(hex_color):
+    hex_color = hex_color.lstrip("#")
+    return tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+@dataclass
+class Calibration:
+    """Maps pixel coordinates of the plot box to seconds and speed units"""
+    plot_box: tuple  # (x0, y0, x1, y1) in pixels
+    time_range: tuple = (0.0, None)  # seconds at x0 and x1; None means "pixels"
+    speed_range: tuple = DEFAULT_SPEED_RANGE  # speed at y1 (bottom) and y0 (top)
+    speed_unit: str = "% of full scale"
+
+    def x_to_seconds(self, x):
+        x0, _, x1, _ = self.plot_box
+        t0, t1 = self.time_range
+        if t1 is None:
+            return np.asarray(x, dtype=float) - x0
+        return t0 + (np.asarray(x, dtype=float) - x0) * (t1 - t0) / max(x1 - x0, 1)
+
+    def y_to_speed(self, y):
+        _, y0, _, y1 = self.plot_box
+        v_min, v_max = self.speed_range
+        return v_max - (np.asarray(y, dtype=float) - y0) * (v_max - v_min) / max(y1 - y0, 1)
+
+
+@dataclass
+class GraphTraces:
+    """Numeric series rebuilt from one graph image
+
+    ``time`` is shared by every speed series; samples with no trace pixels
+    in that column are NaN. Valve intervals are (n, 2) arrays of
+    [start, end] seconds. ``samples`` holds the exact (time, speed) points
+    per trace when they came from vector paths rather than pixels.
+    """
+    time: np.ndarray
+    reference: np.ndarray
+    axles: dict
+    valves: dict
+    calibration: Calibration
+    coverage: dict = field(default_factory=dict)
+    samples: dict = field(default_factory=dict)
+
+
+# --- Serialization ---
+def _key_text(key):
+    return str(key)
+
+
+def _key_value(text):
+    return int(text) if text.isdigit() else text
+
+
+def traces_to_bytes(traces):
+    """GraphTraces as an .npz blob (arrays) with a JSON header; no pickling"""
+    arrays = {"time": traces.time, "reference": traces.reference}
+    for axle, series in traces.axles.items():
+        arrays[f"axle/{axle}"] = series
+    for axle, intervals in traces.valves.items():
+        arrays[f"valve/{axle}"] = intervals
+    for key, (times, speeds) in traces.samples.items():
+        arrays[f"samples/{_key_text(key)}"] = np.vstack((times, speeds))
+    calibration = traces.calibration
+    header = {
+        "plot_box": [float(v) for v in calibration.plot_box],
+        "time_range": list(calibration.time_range),
+        "speed_range": list(calibration.speed_range),
+        "speed_unit": calibration.speed_unit,
+        "coverage": {_key_text(k): v for k, v in traces.coverage.items()},
+    }
+    arrays["header"] = np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8)
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def traces_from_bytes(data):
+    """Inverse of traces_to_bytes"""
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        header = json.loads(npz["header"].tobytes().decode("utf-8"))
+        axles, valves, samples = {}, {}, {}
+        for name in npz.files:
+            group, _, key = name.partition("/")
+            if group == "axle":
+                axles[int(key)] = npz[name]
+            elif group == "valve":
+                valves[int(key)] = npz[name]
+            elif group == "samples":
+                times, speeds = npz[name]
+                samples[_key_value(key)] = (times, speeds)
+        return GraphTraces(
+            time=npz["time"],
+            reference=npz["reference"],
+            axles=dict(sorted(axles.items())),
+            valves=dict(sorted(valves.items())),
+            calibration=Calibration(
+                plot_box=tuple(header["plot_box"]),
+                time_range=tuple(header["time_range"]),
+                speed_range=tuple(header["speed_range"]),
+                speed_unit=header["speed_unit"],
+            ),
+            coverage={_key_value(k): v for k, v in header["coverage"].items()},
+            samples=samples,
+        )
+
+
+def color_mask(rgb, hex_color, tolerance=COLOR_TOLERANCE):
+    """Boolean mask of pixels within tolerance of a palette colour"""
+    r, g, b = hex_to_rgb(hex_color)
+    lower = np.array([max(0, r - tolerance), max(0, g - tolerance), max(0, b - tolerance)], np.uint8)
+    upper = np.array([min(255, r + tolerance), min(255, g + tolerance), min(255, b + tolerance)], np.uint8)
+    return cv2.inRange(rgb, lower, upper) > 0
+
+
+def _palette_image():
+    image = Image.new("P", (1, 1))
+    image.putpalette([c for hex_color in PALETTE for c in hex_to_rgb(hex_color)])
+    return image
+
+
+PALETTE_IMAGE = _palette_image()
+
+
+def quantize(image):
+    """Snap every pixel to the nearest palette colour; returns a 'P' image indexing PALETTE"""
+    return image.convert("RGB").quantize(palette=PALETTE_IMAGE, dither=Image.Dither.NONE)
+
+
+def palette_index(image):
+    """Index into PALETTE of every pixel, by nearest colour
+
+    Labelling by nearest colour rather than a tolerance box keeps the
+    anti-aliased edges of a line partly hidden under another trace, and
+    gives the same masks on the original render as on its quantized copy.
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(np.ascontiguousarray(image))
+    if image.mode == "P" and image.getpalette()[:3 * len(PALETTE)] == PALETTE_IMAGE.getpalette()[:3 * len(PALETTE)]:
+        return np.asarray(image)
+    return np.asarray(quantize(image))
+
+
+def find_plot_box(rgb, trace_mask=None, dark=None):
+    """Locate the plot frame from long grey/black axis lines, else the trace extent
+
+    ``dark`` is the mask of frame-coloured pixels when already known.
+    """
+    height, width = rgb.shape[:2]
+    if dark is None:
+        high = rgb.max(axis=2)
+        dark = (high < 200) & (high - rgb.min(axis=2) < 30)
+    rows = np.flatnonzero(dark.sum(axis=1) > FRAME_LINE_FRACTION * width)
+    cols = np.flatnonzero(dark.sum(axis=0) > FRAME_LINE_FRACTION * height)
+    if len(rows) >= 2 and len(cols) >= 2 and rows[-1] - rows[0] > 10 and cols[-1] - cols[0] > 10:
+        return int(cols[0]), int(rows[0]), int(cols[-1]), int(rows[-1])
+    if trace_mask is not None and trace_mask.any():
+        ys, xs = np.nonzero(trace_mask)
+        return int(xs.min()), int(ys.min()), int(xs.max()), int(ys.max())
+    return 0, 0, width - 1, height - 1
+
+
+def column_centroids(mask):
+    """Mean row index of the mask in every column (NaN where the column is empty)"""
+    counts = mask.sum(axis=0)
+    rows = np.arange(mask.shape[0], dtype=float)
+    sums = rows @ mask
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroids = sums / counts
+    centroids[counts == 0] = np.nan
+    return centroids
+
+
+def on_intervals(active, times):
+    """Turn a boolean per-sample signal into an (n, 2) array of [start, end] times"""
+    edges = np.diff(np.concatenate(([0], active.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return np.column_stack((times[starts], times[ends])) if len(starts) else np.empty((0, 2))
+
+
+def extract_traces(image, time_range=None, speed_range=DEFAULT_SPEED_RANGE, plot_box=None,
+                   speed_unit="% of full scale"):
+    """Rebuild reference/axle speed series and valve intervals from a graph image
+
+    ``time_range`` is the recording span in seconds (e.g. from the graph
+    period); without it the time axis is in pixels from the plot edge.
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.fromarray(np.ascontiguousarray(image))
+    index = palette_index(image)
+    rgb = np.ascontiguousarray(np.asarray(image.convert("RGB")))
+
+    speed_masks = {"reference": index == PALETTE.index(REFERENCE_COLOR)}
+    for axle, hex_color in AXLE_COLORS.items():
+        speed_masks[axle] = index == PALETTE.index(hex_color)
+
+    if plot_box is None:
+        # Frame pixels by palette colour too, so a quantized copy finds the same frame
+        dark = np.isin(index, [PALETTE.index(c) for c in (FRAME_COLOR, GRID_COLOR, INK_COLOR)])
+        plot_box = find_plot_box(rgb, np.logical_or.reduce(list(speed_masks.values())), dark)
+    calibration = Calibration(
+        plot_box=plot_box,
+        time_range=tuple(time_range) if time_range else (0.0, None),
+        speed_range=tuple(speed_range),
+        speed_unit=speed_unit,
+    )
+
+    x0, y0, x1, y1 = plot_box
+    columns = np.arange(x0, x1 + 1)
+    times = calibration.x_to_seconds(columns)
+
+    series = {}
+    coverage = {}
+    for name, mask in speed_masks.items():
+        centroids = column_centroids(mask[y0:y1 + 1, x0:x1 + 1]) + y0
+        series[name] = calibration.y_to_speed(centroids)
+        coverage[name] = float(np.isfinite(centroids).mean()) if len(centroids) else 0.0
+
+    # Valve pulses may be drawn in a band outside the speed plot, so use full columns
+    valves = {}
+    for axle, hex_color in VALVE_COLORS.items():
+        mask = (index[:, x0:x1 + 1] == PALETTE.index(hex_color)).astype(np.uint8)
+        active = cv2.morphologyEx(mask, cv2.MORPH_OPEN, VALVE_KERNEL).any(axis=0)
+        valves[axle] = on_intervals(active, times)
+
+    return GraphTraces(
+        time=times,
+        reference=series.pop("reference"),
+        axles=series,
+        valves=valves,
+        calibration=calibration,
+        coverage=coverage,
+    )
+
+
+# --- Anomaly Phases ---
+def deviation_intervals(traces, axle, threshold):
+    """Intervals where an axle deviates from the reference by more than threshold"""
+    deviation = np.abs(traces.axles[axle] - traces.reference)
+    return on_intervals(np.nan_to_num(deviation, nan=0.0) > threshold, traces.time)
+
+
+def format_intervals(intervals, unit="s"):
+    """Render intervals the way the report tables expect, e.g. '16.00s - 30.75s'"""
+    if len(intervals) == 0:
+        return "None"
+    return ", ".join(f"{start:.2f}{unit} - {end:.2f}{unit}" for start, end in intervals)
+
+
+def describe_traces(traces, threshold=5.0):
+    """Plain-text measurement summary that can accompany the graph image"""
+    unit = "s" if traces.calibration.time_range[1] is not None else "px"
+    lines = []
+    for axle in sorted(traces.axles):
+        phases = format_intervals(deviation_intervals(traces, axle, threshold), unit)
+        valve = format_intervals(traces.valves[axle], unit)
+        lines.append(
+            f"- Axle {axle}: deviation from reference > {threshold:g} {traces.calibration.speed_unit}: {phases}; "
+            f"dump valve active: {valve} ({len(traces.valves[axle])} activations)"
+        )
+    return "\n".join(lines)
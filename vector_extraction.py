@@ -0,0 +1,212 @@
+"""Trace extraction straight from the PDF's vector drawing.
+
+Recorder PDFs draw every trace as a coloured polyline and the dump-valve
+signals as filled bars. Reading them with PyMuPDF's ``page.get_drawings()``
+gives exact sample positions without rasterizing the page, and the axis
+labels in the text layer map page coordinates to seconds and speed.
+"""
+import re
+
+import numpy as np
+
+from trace_extraction import (
+    AXLE_COLORS,
+    DEFAULT_SPEED_RANGE,
+    REFERENCE_COLOR,
+    VALVE_COLORS,
+    Calibration,
+    GraphTraces,
+    hex_to_rgb,
+)
+
+# Vector colours are exact, so only allow for float rounding in the PDF
+VECTOR_COLOR_TOLERANCE = 8
+# Resampling density of the shared time grid, in samples per PDF point
+SAMPLES_PER_POINT = 4
+MAX_SAMPLES = 20000
+# Axis labels must sit within this many points of the plot frame
+LABEL_MARGIN = 40
+
+_NUMBER = re.compile(r"^-?\d+(?:[.,]\d+)?$")
+
+
+def _to_rgb255(color):
+    return tuple(int(round(c * 255)) for c in color[:3])
+
+
+def _match_color(color, palette):
+    """Key of the palette entry matching an (r, g, b) float colour, or None"""
+    if not color or len(color) < 3:
+        return None
+    rgb = _to_rgb255(color)
+    for key, hex_color in palette.items():
+        if all(abs(a - b) <= VECTOR_COLOR_TOLERANCE for a, b in zip(rgb, hex_to_rgb(hex_color))):
+            return key
+    return None
+
+
+def _is_grey(color):
+    if not color or len(color) < 3:
+        return False
+    rgb = _to_rgb255(color)
+    return max(rgb) - min(rgb) < 30 and max(rgb) < 200
+
+
+def _segment_points(items):
+    """All points of the line/curve segments in one drawing"""
+    points = []
+    for item in items:
+        kind = item[0]
+        if kind == "l":
+            points.extend((item[1], item[2]))
+        elif kind == "c":
+            points.extend((item[1], item[4]))
+    return points
+
+
+def _segment_spans(items):
+    """(min x, max x) of every line/curve segment in one drawing"""
+    spans = []
+    for item in items:
+        if item[0] == "l":
+            xs = (item[1].x, item[2].x)
+        elif item[0] == "c":
+            xs = (item[1].x, item[2].x, item[3].x, item[4].x)  # the control points bound the curve
+        else:
+            continue
+        spans.append((min(xs), max(xs)))
+    return spans
+
+
+def _merge_intervals(intervals):
+    """Sort and merge overlapping or touching [start, end] pairs"""
+    if not intervals:
+        return np.empty((0, 2))
+    intervals = np.array(sorted(intervals), dtype=float)
+    merged = [intervals[0]]
+    for start, end in intervals[1:]:
+        if start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append(np.array([start, end]))
+    return np.vstack(merged)
+
+
+def _fit_axis(labels):
+    """Least-squares linear map from page coordinate to axis value, or None"""
+    if len(labels) < 2:
+        return None
+    positions, values = np.array(labels, dtype=float).T
+    if np.ptp(positions) < 1 or np.ptp(values) == 0:
+        return None
+    slope, intercept = np.polyfit(positions, values, 1)
+    return lambda p: slope * p + intercept
+
+
+def _axis_labels(page, plot_box):
+    """Numeric labels left of the plot (speed) and below it (time)"""
+    x0, y0, x1, y1 = plot_box
+    speed_labels, time_labels = [], []
+    for wx0, wy0, wx1, wy1, word, *_ in page.get_text("words"):
+        if not _NUMBER.match(word):
+            continue
+        value = float(word.replace(",", "."))
+        cx, cy = (wx0 + wx1) / 2, (wy0 + wy1) / 2
+        if x0 - LABEL_MARGIN <= wx1 <= x0 + 2 and y0 - 5 <= cy <= y1 + 5:
+            speed_labels.append((cy, value))
+        elif y1 - 2 <= wy0 <= y1 + LABEL_MARGIN and x0 - 5 <= cx <= x1 + 5:
+            time_labels.append((cx, value))
+    return speed_labels, time_labels
+
+
+def extract_vector_traces(page, time_range=None, speed_range=None):
+    """Rebuild traces from the page's vector paths; None if the page has none
+
+    Axis labels calibrate time and speed when present; otherwise the time
+    axis falls back to ``time_range`` (e.g. from the graph period) and speed
+    to percent of full scale, exactly like the raster extractor.
+    """
+    speed_palette = {"reference": REFERENCE_COLOR, **AXLE_COLORS}
+    points = {key: [] for key in speed_palette}
+    drawn = {key: [] for key in speed_palette}  # x extents of the segments actually drawn
+    valve_spans = {axle: [] for axle in VALVE_COLORS}
+    frames = []
+
+    for drawing in page.get_drawings():
+        stroke, fill = drawing.get("color"), drawing.get("fill")
+        key = _match_color(stroke, speed_palette)
+        if key is not None:
+            points[key].extend((p.x, p.y) for p in _segment_points(drawing["items"]))
+            drawn[key].extend(_segment_spans(drawing["items"]))
+            continue
+        valve = _match_color(fill, VALVE_COLORS) or _match_color(stroke, VALVE_COLORS)
+        if valve is not None:
+            valve_spans[valve].append((drawing["rect"].x0, drawing["rect"].x1))
+            continue
+        if _is_grey(stroke):
+            for item in drawing["items"]:
+                if item[0] == "re":
+                    frames.append(item[1])
+
+    if not any(points.values()):
+        return None
+
+    all_points = np.array([p for pts in points.values() for p in pts], dtype=float)
+    if frames:
+        frame = max(frames, key=lambda r: r.width * r.height)
+        plot_box = (frame.x0, frame.y0, frame.x1, frame.y1)
+    else:
+        plot_box = (*all_points.min(axis=0), *all_points.max(axis=0))
+    x0, y0, x1, y1 = plot_box
+
+    speed_labels, time_labels = _axis_labels(page, plot_box)
+    speed_fit, time_fit = _fit_axis(speed_labels), _fit_axis(time_labels)
+    speed_unit = "% of full scale"
+    if speed_fit:
+        speed_range, speed_unit = (float(speed_fit(y1)), float(speed_fit(y0))), "km/h"
+    if time_fit:
+        time_range = (float(time_fit(x0)), float(time_fit(x1)))
+    calibration = Calibration(
+        plot_box=plot_box,
+        time_range=tuple(time_range) if time_range else (0.0, None),
+        speed_range=tuple(speed_range) if speed_range else DEFAULT_SPEED_RANGE,
+        speed_unit=speed_unit,
+    )
+
+    samples = int(min(MAX_SAMPLES, max(2, (x1 - x0) * SAMPLES_PER_POINT)))
+    grid_x = np.linspace(x0, x1, samples)
+    times = calibration.x_to_seconds(grid_x)
+
+    series, raw, coverage = {}, {}, {}
+    for key, pts in points.items():
+        if not pts:
+            series[key] = np.full(samples, np.nan)
+            coverage[key] = 0.0
+            continue
+        xy = np.array(pts, dtype=float)
+        order = np.argsort(xy[:, 0], kind="stable")
+        xs, ys = xy[order, 0], xy[order, 1]
+        speeds = calibration.y_to_speed(ys)
+        raw[key] = (calibration.x_to_seconds(xs), speeds)
+        resampled = np.interp(grid_x, xs, speeds)
+        # Interpolate along the drawn segments only; a gap in the trace is missing data, not a line
+        spans = _merge_intervals(drawn[key])
+        inside = np.searchsorted(spans[:, 0], grid_x, side="right") - 1
+        resampled[(inside < 0) | (grid_x > spans[np.maximum(inside, 0), 1])] = np.nan
+        series[key] = resampled
+        coverage[key] = float(np.isfinite(resampled).mean())
+
+    valves = {
+        axle: calibration.x_to_seconds(_merge_intervals(spans)) if spans else np.empty((0, 2))
+        for axle, spans in valve_spans.items()
+    }
+
+    return GraphTraces(
+        time=times,
+        reference=series.pop("reference"),
+        axles=series,
+        valves=valves,
+        calibration=calibration,
+        coverage=coverage,
+        samples=raw,
+    )
@@ -0,0 +1,109 @@
+"""Start-up warm-up for the analysis pipeline.
+
+Importing the pipeline costs about a second on a fresh container, most of it
+the Gemini SDK, then PyMuPDF, OpenCV and NumPy. On top of that the first
+page, model image and PDF each pay one-off initialisation. ``warm_up()``
+imports everything and runs one synthetic page through the local stages
+(ingest, rules, model image, TXT/PDF reports; never the model itself) with
+metrics switched off.
+
+The Streamlit app renders its first page without these modules and starts
+``warm_up_in_background()``. ``service.py serve`` warms up before it accepts
+connections and, with ``--workers``, before forking, so every worker starts
+warm and shares the loaded modules copy-on-write.
+
+Usage:
+    python warmup.py          # print what each step costs on this machine
+"""
+import importlib
+import io
+import sys
+import threading
+import time
+
+import metrics
+
+PIPELINE_MODULES = (
+    "google.generativeai",
+    "analyzer",
+    "jobs",
+    "batch",
+    "fleet_report",
+)
+
+_warm_lock = threading.Lock()
+_warm_timings = None
+
+
+def preload(modules=PIPELINE_MODULES):
+    """Import the given modules; returns the seconds it took"""
+    started = time.perf_counter()
+    for name in modules:
+        importlib.import_module(name)
+    return time.perf_counter() - started
+
+
+def exercise():
+    """Run one synthetic page through every local stage; returns {step: seconds}"""
+    from analyzer import ingest_pdf
+    from classifier import fast_path_report
+    from preprocessing import model_image
+    from reports import create_pdf_with_image, create_text_with_image_info
+    from synthetic import canned_report, make_recording
+
+    timings = {}
+    started = time.perf_counter()
+
+    def lap(step):
+        nonlocal started
+        now = time.perf_counter()
+        timings[step] = now - started
+        started = now
+
+    graph = ingest_pdf(make_recording(points=200, anomaly_rate=1.0))
+    lap("ingest")
+    fast_path_report(graph.traces)
+    model_image(graph.image)
+    lap("rules_and_model_image")
+    buffer = io.BytesIO()
+    graph.image.save(buffer, format="PNG")
+    report = canned_report()
+    create_pdf_with_image(report, buffer.getvalue(), graph.graph_period)
+    create_text_with_image_info(report, buffer.getvalue(), graph.graph_period)
+    lap("reports")
+    return timings
+
+
+def warm_up():
+    """Import the pipeline and exercise its local stages, once per process
+
+    Returns {step: seconds}; later calls return the first call's timings.
+    """
+    global _warm_timings
+    with _warm_lock:
+        if _warm_timings is None:
+            with metrics.disabled():
+                timings = {"imports": preload()}
+                timings.update(exercise())
+            _warm_timings = timings
+        return dict(_warm_timings)
+
+
+def warm_up_in_background():
+    """Start warm_up() on a daemon thread and return the thread"""
+    thread = threading.Thread(target=warm_up, name="wsp-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+# --- CLI ---
+def main():
+    started = time.perf_counter()
+    for step, seconds in warm_up().items():
+        print(f"{step:<24} {seconds * 1000:>8.1f} ms")
+    print(f"{'total':<24} {(time.perf_counter() - started) * 1000:>8.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())